@@ -1,5 +1,6 @@
 from datetime import UTC, datetime
 from pathlib import Path
+from typing import Any
 
 from dotenv import dotenv_values
 from loguru import logger
@@ -20,6 +21,7 @@ class SystemConfig(BaseModel):
     tick_rate: float = 0.01
     max_workers_per_pool: int = 32
     minimum_workers_per_pool: int = 3
+    cache_dir: Path = Path(".chandragen_cache")
 
     class Config:
         extra = "ignore"  # ignore unknown keys if loading from larger env dict
@@ -32,9 +34,9 @@ def hydrate_system_config(env_path: Path = Path(".env")) -> SystemConfig:
     return SystemConfig.model_validate(env)
 
 
-def store_system_config(env_path: Path = Path(".env")) -> None:
+def store_system_config(new_config: SystemConfig, env_path: Path = Path(".env")) -> None:
     """Writes a system config bck to a .env file"""
-    config = system_config.model_dump()
+    config = new_config.model_dump()
     logger.info(f"Stored global config: {config}")
     blacklist = {"running", "invoked_command", "start_time"}
     cleaned = {key: str(value) for key, value in config.items() if key not in blacklist}
@@ -52,8 +54,26 @@ def update_system_config(new_config: SystemConfig):
     """helper function for modules to use for pushing an updated system state to the rest of the program"""
     global system_config  # noqa: PLW0603
     system_config = new_config
-    store_system_config()
+    store_system_config(new_config)
 
 
 __version__ = "0.0.0"
-system_config: SystemConfig = hydrate_system_config()
+system_config: SystemConfig
+
+
+def loaded_system_config() -> SystemConfig | None:
+    """
+    Returns the system config if something has already loaded it, without reading .env otherwise.
+    Library entry points like format_text use it to skip anything that needs a config, eg. the on-disk caches.
+    """
+    return globals().get("system_config")
+
+
+def __getattr__(name: str) -> Any:
+    # the .env file is only read the first time something asks for the system config, so just importing chandragen stays cheap
+    if name == "system_config":
+        global system_config  # noqa: PLW0603
+        system_config = hydrate_system_config()
+        return system_config
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
@@ -1,21 +1,31 @@
 from __future__ import annotations
 
 import argparse
+import importlib
+import json
 import sys
 import time
 import tomllib
+from contextlib import ExitStack
+from datetime import UTC, datetime
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any, TextIO
 
 from loguru import logger
 
 import chandragen
-from chandragen import system_config
-from chandragen.db import init_db
-from chandragen.formatters import FORMATTER_REGISTRY
-from chandragen.jobs import scheduler
-from chandragen.jobs.pooler import ProcessPooler
-from chandragen.jobs.runners.formatter import FormatterJob
+from chandragen.formatters import DocumentFormatter, FormatterProfile, write_document
+from chandragen.formatters.manifest import get_manifest
+from chandragen.formatters.reader import INPUT_MODES, open_document
+from chandragen.formatters.types import FormatterConfig, FormatterFlags
+
+# the database and job system are only imported by the subcommands that use them, keeping startup fast for the rest
+if TYPE_CHECKING:
+    from chandragen.jobs.runners.formatter import FormatterJob
+    from chandragen.jobs.runners.index import IndexJob
+
+# modules defining a job runner, imported by run_pooler since importing them is what registers the runners
+RUNNER_MODULES = ("chandragen.jobs.runners.formatter", "chandragen.jobs.runners.index")
 
 
 class Parser(argparse.ArgumentParser):
@@ -33,59 +43,141 @@ class Parser(argparse.ArgumentParser):
         logger.log("CLI", message)
 
 
-def main():
-    """Main entry point for the program, implements a cli via argparse."""
-    set_up_logger()
-    logger.log("CLI", "Starting ChandraGen CLI")
-    init_db()  # ensure database is properly set up on launch
-
+def build_parser() -> Parser:
+    """Builds the argument parser, with a subparser for every subcommand."""
     parser = Parser(description="Chandragen Static Capsule Generation Framework")
     parser.add_argument("--shell", action="store_true", help="Launch interactive shell alongside the subcommand")
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # Subcommand: run-pooler
     pool_parser = subparsers.add_parser("run-pooler", help="Run a ChandraGen worker process pool from the .env file")
-    pool_parser.set_defaults(func=run_pooler)
+    pool_parser.set_defaults(func=run_pooler, needs_db=True)
 
     # Subcommand: run-config
     run_parser = subparsers.add_parser("run-config", help="Run ChandraGen tasks from a given config file.")
     run_parser.add_argument("config", help="Path to the config file.")
-    run_parser.set_defaults(func=run_config)
+    run_parser.add_argument(
+        "--force", action="store_true", help="Re-render every file, even if it's unchanged since the last run."
+    )
+    run_parser.add_argument(
+        "--profile-formatters",
+        action="store_true",
+        help="Time every formatter, then log the timings per job and aggregated across the whole run.",
+    )
+    run_parser.set_defaults(func=run_config, needs_db=True)
 
     # Subcommand: list-formatters
     list_parser = subparsers.add_parser("list-formatters", help="List all available formatter modules.")
     list_parser.set_defaults(func=list_formatters_command)
 
+    # Subcommand: bench
+    bench_parser = subparsers.add_parser(
+        "bench", help="Benchmark formatters and full pipelines against a synthetic markdown/MDX corpus."
+    )
+    bench_parser.add_argument(
+        "-f", "--formatter", dest="formatters", action="append", help="Only benchmark this formatter (repeatable)."
+    )
+    bench_parser.add_argument("--no-pipelines", action="store_true", help="Skip the full pipeline benchmarks.")
+    bench_parser.add_argument("--documents", type=int, default=50, help="Number of documents to generate.")
+    bench_parser.add_argument("--blocks", type=int, default=200, help="Number of blocks per generated document.")
+    bench_parser.add_argument("--seed", type=int, default=0, help="Seed for the corpus generator.")
+    bench_parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs, the best one is reported.")
+    bench_parser.add_argument("--no-frontmatter", action="store_true", help="Generate documents without frontmatter.")
+    for kind, default in (("tables", 0.05), ("bullet-links", 0.1), ("code-blocks", 0.05), ("jsx", 0.05)):
+        bench_parser.add_argument(f"--{kind}", type=float, default=default, help=f"Proportion of {kind} blocks.")
+    bench_parser.add_argument(
+        "--inline-links", type=float, default=0.2, help="Proportion of paragraph lines containing inline links."
+    )
+    bench_parser.add_argument("-o", "--output", help="Save the results as JSON to this path.")
+    bench_parser.add_argument("--compare", help="Previous JSON results to compare against.")
+    bench_parser.add_argument(
+        "--startup",
+        action="store_true",
+        help="Check startup import times and heavy imports against their budgets instead, exits 1 if any are exceeded.",
+    )
+    bench_parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check that optimized pipelines give the same output as unoptimized ones, and that format_text works without a config, instead. exits 1 if any check fails.",
+    )
+    bench_parser.set_defaults(func=bench_command)
+
     # Subcommand: formatter-info
     info_parser = subparsers.add_parser("formatter-info", help="Get information about a formatter")
     info_parser.add_argument("formatter", help="Name of a formatter")
     info_parser.set_defaults(func=formatter_info_command)
 
+    # Subcommand: format
+    format_parser = subparsers.add_parser(
+        "format", help="Stream a single document through a formatter pipeline. use - for stdin/stdout."
+    )
+    format_parser.add_argument("input", help="Path to the document to format, or - to read from stdin.")
+    format_parser.add_argument(
+        "-o", "--output", default="-", help="Path to write the formatted document to, or - for stdout (default)."
+    )
+    format_parser.add_argument(
+        "-f", "--formatter", dest="formatters", action="append", default=[], help="Enable a formatter (repeatable)."
+    )
+    format_parser.add_argument(
+        "--columns", type=int, default=80, help="Number of text columns preformatted text blocks should take up."
+    )
+    format_parser.add_argument(
+        "--input-mode",
+        choices=INPUT_MODES,
+        default="auto",
+        help="How to read the input file: stream it, memory-map it, or pick based on its size (default).",
+    )
+    format_parser.add_argument(
+        "--peridot", action="store_true", help="Render Peridot substitutions once the formatters are done."
+    )
+    format_parser.set_defaults(func=format_command, log_sink=sys.stderr)
+    return parser
+
+
+def main():
+    """Main entry point for the program, implements a cli via argparse."""
+    parser = build_parser()
+    # the parser logs help and usage errors at the CLI level, so the logger has to be ready before parsing
+    set_up_logger()
     args = parser.parse_args()
 
+    # commands that write documents to stdout keep the log out of the way on stderr
+    log_sink = getattr(args, "log_sink", sys.stdout)
+    if log_sink is not sys.stdout:
+        set_up_logger(log_sink)
+    logger.log("CLI", "Starting ChandraGen CLI")
+    if getattr(args, "needs_db", False):
+        from chandragen.db import init_db  # noqa: PLC0415
+
+        init_db()  # ensure database is properly set up on launch
+
     # spawn the interactive debug shell if desired
     if args.shell:
-        from chandragen.shell import InteractiveShellThread
+        from chandragen.shell import InteractiveShellThread  # noqa: PLC0415
 
         shell = InteractiveShellThread()
         shell.start()
     args.func(args)  # calls the right function depending on the subcommand
 
 
-def set_up_logger():
+def set_up_logger(sink: TextIO = sys.stdout):
     """Sets up Loguru. clears default handlers, registers the main custom handler, and adds the CLI log level."""
     # Clear any default handlers to avoid duplicate logs
     logger.remove()
 
-    # Add custom handler (stdout)
+    # Add custom handler (stdout unless told otherwise)
     logger.add(
-        sink=sys.stdout,
-        level=system_config.log_level,
+        sink=sink,
+        level=chandragen.system_config.log_level,
         format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
         backtrace=True,
         diagnose=True,
     )
-    logger.level("CLI", no=255, color="<green>")
+    # the level can only be added once, set_up_logger runs again when a command moves the log to another sink
+    try:
+        logger.level("CLI")
+    except ValueError:
+        logger.level("CLI", no=255, color="<green>")
 
 
 def apply_blacklist(formatters: list[str] | str, blacklist: list[str] | str) -> list[str]:
@@ -98,15 +190,18 @@ def apply_blacklist(formatters: list[str] | str, blacklist: list[str] | str) ->
 
 
 # Parse a config file and generate a joblist with configs to push to the file converter
-def parse_config_file(toml_path: Path) -> list[FormatterJob]:
-    """Legacy config parser system. takes a toml config and spits out formatting jobs."""
+def parse_config_file(toml_path: Path) -> list[FormatterJob | IndexJob]:
+    """Legacy config parser system. takes a toml config and spits out formatting and index jobs."""
+    from chandragen.jobs.runners.formatter import FormatterJob  # noqa: PLC0415
+    from chandragen.jobs.runners.index import IndexJob  # noqa: PLC0415
+
     with Path(toml_path).open("rb") as f:
         raw_config = tomllib.load(f)
     logger.info(f"parsing config file {toml_path} and generating joblist")
 
     # Parse out system options
     system = raw_config.get("system", {})
-    system_config.scheduler_mode = system.get("scheduler_mode")
+    chandragen.system_config.scheduler_mode = system.get("scheduler_mode")
 
     # Parse out defaults
     defaults = raw_config.get("defaults", {})
@@ -115,7 +210,9 @@ def parse_config_file(toml_path: Path) -> list[FormatterJob]:
     default_outdir = Path(defaults.get("output_path"))
     default_columns = defaults.get("preformatted_text_columns", 80)
     default_interval = defaults.get("interval")
-    job_list: list[FormatterJob] = []
+    default_input_mode = defaults.get("input_mode", "auto")
+    default_peridot = defaults.get("peridot", False)
+    job_list: list[FormatterJob | IndexJob] = []
 
     for section, entry in raw_config.items():
         if section == "defaults":
@@ -140,6 +237,8 @@ def parse_config_file(toml_path: Path) -> list[FormatterJob]:
                         enabled_formatters=final_formatters,
                         formatter_flags=flags,
                         preformatted_unicode_columns=subentry.get("preformatted_text_columns", default_columns),
+                        input_mode=subentry.get("input_mode", default_input_mode),
+                        peridot=subentry.get("peridot", default_peridot),
                         heading=subentry.get("heading"),
                         heading_end_pattern=subentry.get("heading_end_pattern"),
                         heading_strip_offset=subentry.get("heading_strip_offset", 0),
@@ -171,6 +270,8 @@ def parse_config_file(toml_path: Path) -> list[FormatterJob]:
                         enabled_formatters=final_formatters,
                         formatter_flags=flags,
                         preformatted_unicode_columns=subentry.get("preformatted_text_columns", default_columns),
+                        input_mode=subentry.get("input_mode", default_input_mode),
+                        peridot=subentry.get("peridot", default_peridot),
                         heading=subentry.get("heading"),
                         heading_end_pattern=subentry.get("heading_end_pattern"),
                         heading_strip_offset=subentry.get("heading_strip_offset", 0),
@@ -179,38 +280,140 @@ def parse_config_file(toml_path: Path) -> list[FormatterJob]:
                         footing_strip_offset=subentry.get("footing_strip_offset", 0),
                     )
                 )
+
+        if section == "index":
+            for name, subentry in entry.items():
+                feed_path = subentry.get("feed_path")
+                job_list.append(
+                    IndexJob(
+                        jobname=name,
+                        interval=subentry.get("interval", default_interval),
+                        entries_path=Path(subentry.get("entries_path")),
+                        output_path=Path(subentry.get("output_path", Path(subentry.get("entries_path")) / "index.gmi")),
+                        title=subentry.get("title", name),
+                        heading=subentry.get("heading"),
+                        feed_path=Path(feed_path) if feed_path is not None else None,
+                        base_url=subentry.get("base_url"),
+                        author=subentry.get("author"),
+                        feed_entries=subentry.get("feed_entries", 50),
+                    )
+                )
     return job_list
 
 
 def run_pooler(args: argparse.Namespace | None = None):
     """Starts a worker pool and then spins indefinitely. intended to be invoked from cli."""
+    # workers need to know how to run every job type before they claim one
+    for module_name in RUNNER_MODULES:
+        importlib.import_module(module_name)
+    from chandragen.jobs.pooler import ProcessPooler  # noqa: PLC0415
+
     logger.log(
         "CLI",
-        f"Starting dynamic pool of {system_config.minimum_workers_per_pool} to {system_config.max_workers_per_pool} worker processes ",
+        f"Starting dynamic pool of {chandragen.system_config.minimum_workers_per_pool} to {chandragen.system_config.max_workers_per_pool} worker processes ",
     )
     pooler = ProcessPooler()
     pooler.start()
-    while system_config.running:
+    while chandragen.system_config.running:
         time.sleep(120)
 
 
 def run_config(args: argparse.Namespace):
     """CLI command that uses the oneshot scheduler to run a set of Formatter jobs from a legacy TOML config"""
-    updated_config = system_config
+    updated_config = chandragen.system_config
     updated_config.invoked_command = "run_config"
     updated_config.config_path = args.config
     chandragen.update_system_config(updated_config)
+    from chandragen.jobs import scheduler  # noqa: PLC0415
+    from chandragen.jobs.runners.formatter import FormatterJob  # noqa: PLC0415
+
     joblist = parse_config_file(args.config)
+    for job in joblist:
+        job.force_rebuild = args.force
+        if isinstance(job, FormatterJob):
+            job.profile_formatters = args.profile_formatters
+    started_at = datetime.now(UTC)
     runner = scheduler.SchedulerRunner()
     runner.run(joblist)
+    if args.profile_formatters:
+        report_formatter_profile(started_at)
+
+
+def report_formatter_profile(since: datetime):
+    """Aggregates the formatter timings every job stored since a given time, and logs them."""
+    from chandragen.db.controllers.job_queue import JobQueueController  # noqa: PLC0415
+
+    profile = FormatterProfile()
+    results = JobQueueController().get_job_results_since(since)
+    for result in results:
+        profile.merge(FormatterProfile.from_dict(json.loads(result.result_json)))
+    logger.log("CLI", f"Formatter timings across {len(results)} jobs:\n{profile.render()}")
+
+
+def format_command(args: argparse.Namespace):
+    """CLI command that streams one document through a formatter pipeline, reading and writing files or stdin/stdout."""
+    config = FormatterConfig(
+        jobname="cli_format",
+        enabled_formatters=args.formatters,
+        preformatted_unicode_columns=args.columns,
+        input_path=None if args.input == "-" else Path(args.input),
+        input_mode=args.input_mode,
+        peridot=args.peridot,
+        output_path=None if args.output == "-" else Path(args.output),
+    )
+    formatter = DocumentFormatter(config, FormatterFlags())
+
+    with ExitStack() as stack:
+        source = sys.stdin if config.input_path is None else stack.enter_context(open_document(config))
+        if config.output_path is None:
+            sys.stdout.writelines(formatter.stream_document(source))
+            sys.stdout.flush()
+        else:
+            write_document(config.output_path, formatter.stream_document(source))
+
+
+def bench_command(args: argparse.Namespace):
+    """CLI command that benchmarks formatters against a generated corpus, and optionally saves or compares results."""
+    from chandragen import bench  # noqa: PLC0415
+
+    if args.startup:
+        results = bench.check_startup(args.repeat)
+        logger.log("CLI", f"\n{bench.render_startup(results)}")
+        if not all(result.ok for result in results):
+            sys.exit(1)
+        return
+
+    spec = bench.CorpusSpec(
+        documents=args.documents,
+        blocks_per_document=args.blocks,
+        seed=args.seed,
+        frontmatter=not args.no_frontmatter,
+        tables=args.tables,
+        bullet_links=args.bullet_links,
+        code_blocks=args.code_blocks,
+        jsx=args.jsx,
+        inline_link_rate=args.inline_links,
+    )
+    if args.verify:
+        checks = bench.check_equivalence(spec)
+        logger.log("CLI", f"\n{bench.render_checks(checks)}")
+        if not all(check.ok for check in checks):
+            sys.exit(1)
+        return
+    report = bench.run_benchmarks(spec, args.formatters, pipelines=not args.no_pipelines, repeat=args.repeat)
+    baseline = bench.load_report(Path(args.compare)) if args.compare else None
+    logger.log("CLI", f"\n{bench.render_report(report, baseline)}")
+    if args.output:
+        bench.save_report(report, Path(args.output))
+        logger.log("CLI", f"Saved benchmark results to {args.output}")
 
 
 # TODO: move the formatter system specific cli funcs into the formatter module, set up dynamic loader that adds cli subcommands from each internal module. maybe even plugin support here?
 def list_formatters_command(args: argparse.Namespace):
-    """CLI command that loads the formatter registry and then logs a cleanly formatted list"""
-    updated_config = system_config
-    updated_config.invoked_command = "list_formatters"
-    chandragen.update_system_config(updated_config)
+    """CLI command that reads the formatter manifest and then logs a cleanly formatted list, without importing any formatters"""
+    # read-only command, nothing worth writing back to .env
+    chandragen.system_config.invoked_command = "list_formatters"
+    manifest = get_manifest()
     logger.log(
         "CLI",
         f"""
@@ -218,47 +421,41 @@ def list_formatters_command(args: argparse.Namespace):
         - - - Loaded formatters - - -
     
     Line formatters:
-        {"        ".join(f" - {name}\n" for name in FORMATTER_REGISTRY.line)}
+        {"        ".join(f" - {entry.name}\n" for entry in manifest.by_kind("line"))}
     Multi-line formatters:
-        {"        ".join(f" - {name}\n" for name in FORMATTER_REGISTRY.multiline)}
+        {"        ".join(f" - {entry.name}\n" for entry in manifest.by_kind("multiline"))}
     Document Pre-Processors:
-        {"        ".join(f" - {name}\n" for name in FORMATTER_REGISTRY.preprocessor)}
+        {"        ".join(f" - {entry.name}\n" for entry in manifest.by_kind("preprocessor"))}
     """,
     )
 
 
 def formatter_info_command(args: argparse.Namespace):
-    """CLI command that checks the formatter registry for the requested formatter and provides the in-class metadata for it."""
-    updated_config = system_config
-    updated_config.invoked_command = "formatter_info"
-    chandragen.update_system_config(updated_config)
+    """CLI command that looks the requested formatter up in the formatter manifest and provides the in-class metadata for it."""
+    # read-only command, nothing worth writing back to .env
+    chandragen.system_config.invoked_command = "formatter_info"
 
     formatter = args.formatter
-    formatter_types = {
-        "line": ("Line-Formatter", None, None),
-        "preprocessor": ("Document Pre-Processor", None, None),
-        "multiline": ("Multi-Line Formatter", "start_pattern", "end_pattern"),
+    labels = {
+        "line": "Line-Formatter",
+        "preprocessor": "Document Pre-Processor",
+        "multiline": "Multi-Line Formatter",
     }
 
-    for registry_type, (label, start_attr, end_attr) in formatter_types.items():
-        if formatter in getattr(FORMATTER_REGISTRY, registry_type):
-            formatter_cls = getattr(FORMATTER_REGISTRY, registry_type)[formatter]
-            start_regex = getattr(formatter_cls, start_attr) if start_attr else ""
-            end_regex = getattr(formatter_cls, end_attr) if end_attr else ""
-
-            logger.log(
-                "CLI",
-                f"""
-{label} "{formatter}":
+    for entry in get_manifest().find(formatter):
+        logger.log(
+            "CLI",
+            f"""
+{labels[entry.kind]} "{formatter}":
     
         -= Description =-
-{formatter_cls.description}
-Valid types: {formatter_cls.valid_types}
-Origin: {formatter_cls.__module__}
-{"Start Regex: " + start_regex if start_regex else ""}
-{"End Regex: " + end_regex if end_regex else ""}
+{entry.description}
+Valid types: {entry.valid_types}
+Origin: {entry.module}
+{"Start Regex: " + entry.start_pattern if entry.start_pattern else ""}
+{"End Regex: " + entry.end_pattern if entry.end_pattern else ""}
 """,
-            )
+        )
 
 
 # bootstrap nonsense
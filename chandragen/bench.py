@@ -0,0 +1,529 @@
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import chandragen
+from chandragen.formatters import DocumentFormatter, FormatterConfig, FormatterFlags, format_lines
+from chandragen.formatters.manifest import get_manifest
+from chandragen.formatters.pipeline import compile_pipeline, reference_pipeline
+from chandragen.formatters.types import DispatchTable, LineFormatter, Substitution, SubstitutionFormatter
+
+"""
+ChandraGen Formatter Benchmarks ⏱️
+
+Generates synthetic markdown/MDX corpora and measures how fast each registered formatter,
+and a few full pipelines, get through them. Results can be saved as JSON and compared between runs
+to catch performance regressions in formatters (plugin ones included) before production jobs do.
+
+check_equivalence verifies that the pipeline's optimizations (fused substitutions, batched lines) never change output,
+by comparing it to the reference pipeline on the generated corpus and on inputs that broke them before.
+
+Also guards startup: check_startup measures the import time of each startup path with `python -X importtime`,
+and makes sure heavy modules (the database stack, formatter modules) stay out of paths that shouldn't need them.
+"""
+
+# Markers every generated document carries, so the heading/footing pre-processors have something to cut at
+HEADING_END_MARKER = "<!-- end of heading -->\n"
+FOOTING_START_MARKER = "<!-- start of footing -->\n"
+
+# Full pipelines benchmarked alongside the individual formatters
+BENCH_PIPELINES: dict[str, list[str]] = {
+    "pipeline:md": [
+        "convert_frontmatter",
+        "strip_inline_md_formatting",
+        "convert_bullet_point_links",
+        "convert_inline_links",
+        "strip_html_comments",
+        "normalize_code_blocks",
+        "format_tables_as_unicode",
+    ],
+    "pipeline:mdx": [
+        "convert_frontmatter",
+        "strip_imports_exports",
+        "strip_inline_md_formatting",
+        "convert_bullet_point_links",
+        "convert_inline_links",
+        "strip_jsx_expressions",
+        "convert_known_mdx_components",
+        "strip_jsx_tags",
+        "normalize_code_blocks",
+        "format_tables_as_unicode",
+        "convert_mdx_images",
+    ],
+}
+
+# Inputs that once came out differently from the reference pipeline, by name: (enabled formatters, document)
+REGRESSION_CASES: dict[str, tuple[list[str], str]] = {
+    # stripping the expression used to join <Note> together before convert_known_mdx_components saw it
+    "fused deletion": (
+        ["strip_jsx_expressions", "convert_known_mdx_components"],
+        "<No{x}te> and <Warning>{y}</Warning>\n",
+    ),
+    # a line only blank after formatting has to flush the links buffered before it, not after the next paragraph
+    "blank after formatting": (
+        ["convert_inline_links", "strip_jsx_expressions"],
+        "Intro\n{/* comment */}\nSee [a](http://a) here.\n\nNext\n",
+    ),
+}
+
+# Literal substitutions run back to back, by name: (mappings in pipeline order, line)
+# fusing them must give the same line as running them one after the other, whether or not they actually get fused.
+FUSION_CASES: dict[str, tuple[list[dict[str, str]], str]] = {
+    # the second key starts inside the first one, a single leftmost-match pass would only find the second
+    "overlapping keys": ([{"bc": "XY"}, {"ab": "ZW"}], "abc\n"),
+    # the second key only shows up once the first substitution inserted its text
+    "match across inserted text": ([{"x": "ab"}, {"bc": "ZZ"}], "xc\n"),
+    # deleting the dash joins the text around it into a key of the second substitution
+    "match across deleted text": ([{"-": ""}, {"ab": "Z"}], "a-b\n"),
+    "independent keys": ([{"ChandraGen": "chandragen"}, {"<Note>": "NOTE:"}], "ChandraGen <Note> ChandraGen\n"),
+}
+
+# Import time budgets in milliseconds for each startup path. they're generous enough for slow CI machines,
+# the forbidden imports below catch the big regressions exactly.
+STARTUP_BUDGETS_MS: dict[str, float] = {
+    # any embedder or worker touching the package
+    "chandragen": 400,
+    # every CLI invocation, before the subcommand imports what it needs
+    "chandragen.__main__": 450,
+    # what a freshly spawned WorkerProcess imports before it claims a job
+    "chandragen.jobs.pooler": 1000,
+}
+
+_FORMATTER_MODULES = (
+    "chandragen.formatters.line_formatters",
+    "chandragen.formatters.multiline_formatters",
+    "chandragen.formatters.document_preprocessors",
+    "chandragen.plugins.example_plugin",
+)
+
+# Modules that must never be imported by a startup path
+STARTUP_FORBIDDEN: dict[str, tuple[str, ...]] = {
+    "chandragen": ("sqlalchemy", "sqlmodel", *_FORMATTER_MODULES),
+    "chandragen.__main__": ("sqlalchemy", "sqlmodel", *_FORMATTER_MODULES),
+    "chandragen.jobs.pooler": _FORMATTER_MODULES,
+}
+
+_WORDS = (
+    "capsule", "gemini", "gemtext", "chandra", "peridot", "formatter", "pipeline", "markdown", "document",
+    "heading", "footing", "table", "link", "render", "worker", "queue", "scheduler", "config", "plugin", "moon",
+    "orbit", "signal", "static", "site", "server", "request", "line", "block",
+)
+
+
+@dataclass
+class CorpusSpec:
+    """
+    Describes a synthetic corpus to benchmark against.
+
+    attributes:
+        documents: how many documents to generate
+        blocks_per_document: how many blocks (paragraphs, tables, code blocks...) each document is made of
+        seed: seed for the random generator, the same spec always generates the same corpus
+        frontmatter: whether documents start with a yaml frontmatter
+
+        the remaining fields are the proportion of blocks of each kind, plain paragraphs fill whatever's left.
+        inline_link_rate is per paragraph line rather than per block.
+    """
+
+    documents: int = 50
+    blocks_per_document: int = 200
+    seed: int = 0
+    frontmatter: bool = True
+    tables: float = 0.05
+    bullet_links: float = 0.1
+    code_blocks: float = 0.05
+    jsx: float = 0.05
+    inline_link_rate: float = 0.2
+
+
+def _sentence(rng: random.Random, spec: CorpusSpec, words: int = 12) -> str:
+    text = " ".join(rng.choice(_WORDS) for _ in range(words))
+    if rng.random() < spec.inline_link_rate:
+        text += f" see [{rng.choice(_WORDS)} docs](gemini://example.org/{rng.choice(_WORDS)}.gmi)"
+    if rng.random() < 0.3:
+        text = text.replace(" ", " **", 1) + "**"
+    return text
+
+
+def _block(rng: random.Random, spec: CorpusSpec) -> list[str]:
+    roll = rng.random()
+    if (roll := roll - spec.tables) < 0:
+        rows = [
+            f"| {rng.choice(_WORDS)} | {_sentence(rng, spec, rng.randint(3, 30))} |\n" for _ in range(rng.randint(2, 8))
+        ]
+        return ["| key | value |\n", "| --- | --- |\n", *rows, "\n"]
+    if (roll := roll - spec.bullet_links) < 0:
+        links = [
+            f"- [{rng.choice(_WORDS)}](gemini://example.org/{rng.choice(_WORDS)})\n" for _ in range(rng.randint(1, 6))
+        ]
+        return [*links, "\n"]
+    if (roll := roll - spec.code_blocks) < 0:
+        code = [
+            f"    {rng.choice(_WORDS)} = *{rng.choice(_WORDS)}* {{{rng.randint(0, 99)}}}\n"
+            for _ in range(rng.randint(1, 10))
+        ]
+        return ["```python\n", *code, "```\n", "\n"]
+    if (roll := roll - spec.jsx) < 0:
+        return [
+            "<Note>\n",
+            f"{_sentence(rng, spec)} {{props.{rng.choice(_WORDS)}}}\n",
+            "</Note>\n",
+            "<Image\n",
+            f'  src="/img/{rng.choice(_WORDS)}.png"\n',
+            f'  alt="{rng.choice(_WORDS)}"\n',
+            "/>\n",
+            "\n",
+        ]
+    lines = [f"{_sentence(rng, spec)}\n" for _ in range(rng.randint(1, 5))]
+    if rng.random() < 0.2:
+        lines.insert(0, f"## {rng.choice(_WORDS).title()}\n")
+    return [*lines, "\n"]
+
+
+def generate_document(spec: CorpusSpec, rng: random.Random) -> list[str]:
+    """Generates a single synthetic markdown/MDX document as a list of lines."""
+    document: list[str] = []
+    if spec.frontmatter:
+        document += [
+            "---\n",
+            f"title: {rng.choice(_WORDS).title()} {rng.choice(_WORDS)}\n",
+            f"description: {_sentence(rng, spec, 6)}\n",
+            "date: 2025-01-01\n",
+            "---\n",
+        ]
+    if spec.jsx:
+        document.append("import { Note } from '@components/note'\n")
+    document += [f"# {rng.choice(_WORDS).title()}\n", HEADING_END_MARKER, "\n"]
+    for _ in range(spec.blocks_per_document):
+        document += _block(rng, spec)
+    document += [FOOTING_START_MARKER, f"{_sentence(rng, spec)}\n"]
+    return document
+
+
+def generate_corpus(spec: CorpusSpec) -> list[list[str]]:
+    """Generates every document described by a corpus spec."""
+    rng = random.Random(spec.seed)
+    return [generate_document(spec, rng) for _ in range(spec.documents)]
+
+
+@dataclass
+class BenchResult:
+    """Measurements for one formatter or pipeline over the whole corpus."""
+
+    name: str
+    kind: str
+    lines: int
+    megabytes: float
+    seconds: float
+    lines_per_sec: float
+    mb_per_sec: float
+    peak_alloc_kib: float
+    error: str | None = None
+
+
+@dataclass
+class BenchReport:
+    """A full benchmark run, as saved to JSON."""
+
+    corpus: CorpusSpec
+    results: list[BenchResult] = field(default_factory=list[BenchResult])
+    chandragen_version: str = chandragen.__version__
+    python_version: str = platform.python_version()
+    created_at: str = field(default_factory=lambda: datetime.now(UTC).isoformat())
+
+
+def bench_config(enabled_formatters: list[str]) -> FormatterConfig:
+    """Pipeline config used for benchmarking, with heading and footing settings matching the generated documents."""
+    return FormatterConfig(
+        jobname="bench",
+        enabled_formatters=enabled_formatters,
+        heading="# Benchmark heading\n",
+        heading_end_pattern=HEADING_END_MARKER,
+        footing="benchmark footing\n",
+        footing_start_pattern=FOOTING_START_MARKER,
+    )
+
+
+def _format_corpus(config: FormatterConfig, corpus: list[list[str]]) -> None:
+    for document in corpus:
+        for _line in format_lines(document, config, FormatterFlags()):
+            pass
+
+
+def bench_pipeline(
+    name: str, kind: str, enabled_formatters: list[str], corpus: list[list[str]], repeat: int = 3
+) -> BenchResult:
+    """
+    Runs a pipeline over the corpus and measures it.
+    Timing takes the best of `repeat` runs.
+    Allocations are measured on a separate traced run, so tracing doesn't skew the timing.
+    """
+    config = bench_config(enabled_formatters)
+    lines = sum(len(document) for document in corpus)
+    megabytes = sum(len(line.encode()) for document in corpus for line in document) / 1_000_000
+    try:
+        # warm up, compiles and caches the pipeline
+        _format_corpus(config, corpus[:1])
+        best = float("inf")
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            _format_corpus(config, corpus)
+            best = min(best, time.perf_counter() - start)
+
+        tracemalloc.start()
+        _format_corpus(config, corpus)
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    except Exception as e:
+        tracemalloc.stop()
+        return BenchResult(name, kind, lines, megabytes, 0.0, 0.0, 0.0, 0.0, error=f"{type(e).__name__}: {e}")
+
+    return BenchResult(
+        name=name,
+        kind=kind,
+        lines=lines,
+        megabytes=round(megabytes, 3),
+        seconds=round(best, 6),
+        lines_per_sec=round(lines / best, 1) if best else 0.0,
+        mb_per_sec=round(megabytes / best, 3) if best else 0.0,
+        peak_alloc_kib=round(peak / 1024, 1),
+    )
+
+
+def run_benchmarks(
+    spec: CorpusSpec, formatters: list[str] | None = None, pipelines: bool = True, repeat: int = 3
+) -> BenchReport:
+    """
+    Benchmarks formatters over a synthetic corpus.
+
+    Args:
+        spec: the corpus to generate
+        formatters: names of formatters to benchmark on their own, defaults to every registered formatter
+        pipelines: whether to also benchmark the full pipelines in BENCH_PIPELINES
+        repeat: how many timed runs to take the best of
+    """
+    corpus = generate_corpus(spec)
+    report = BenchReport(corpus=spec)
+    kinds = {entry.name: entry.kind for entry in get_manifest().entries}
+    for name in formatters if formatters is not None else list(kinds):
+        report.results.append(bench_pipeline(name, kinds.get(name, "unknown"), [name], corpus, repeat))
+    if pipelines:
+        for name, enabled in BENCH_PIPELINES.items():
+            report.results.append(bench_pipeline(name, "pipeline", enabled, corpus, repeat))
+    return report
+
+
+def save_report(report: BenchReport, path: Path) -> None:
+    path.write_text(json.dumps(asdict(report), indent=2), encoding="utf-8")
+
+
+def load_report(path: Path) -> dict[str, Any]:
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def render_report(report: BenchReport, baseline: dict[str, Any] | None = None) -> str:
+    """Renders a report as a plain text table, with the speed change against a previous report if one is given."""
+    previous: dict[str, float] = {}
+    if baseline is not None:
+        previous = {result["name"]: result["lines_per_sec"] for result in baseline.get("results", [])}
+
+    rows = [f"{'name':<40} {'kind':<12} {'lines/s':>12} {'MB/s':>8} {'peak KiB':>10}  change"]
+    for result in report.results:
+        if result.error is not None:
+            rows.append(f"{result.name:<40} {result.kind:<12} failed: {result.error}")
+            continue
+        change = ""
+        if previous.get(result.name):
+            change = f"{(result.lines_per_sec / previous[result.name] - 1) * 100:+.1f}%"
+        rows.append(
+            f"{result.name:<40} {result.kind:<12} {result.lines_per_sec:>12,.0f} {result.mb_per_sec:>8.2f} "
+            f"{result.peak_alloc_kib:>10,.1f}  {change}"
+        )
+    return "\n".join(rows)
+
+
+@dataclass
+class CheckResult:
+    """The outcome of one of the --verify checks, eg. whether a pipeline gave the same output as the reference pipeline."""
+
+    name: str
+    ok: bool
+    detail: str = ""
+
+
+def _compare(name: str, enabled_formatters: list[str], documents: list[list[str]]) -> CheckResult:
+    config = bench_config(enabled_formatters)
+    for index, document in enumerate(documents):
+        optimized = list(format_lines(document, config, FormatterFlags()))
+        reference = DocumentFormatter(config, FormatterFlags())
+        reference.plan = reference_pipeline(tuple(enabled_formatters))
+        expected = list(reference.stream_document(document))
+        if optimized != expected:
+            line = next(
+                (number for number, pair in enumerate(zip(optimized, expected, strict=False), 1) if pair[0] != pair[1]),
+                min(len(optimized), len(expected)) + 1,
+            )
+            return CheckResult(name, False, f"document {index} differs from the reference at output line {line}")
+    return CheckResult(name, True)
+
+
+class LiteralSubstitution(SubstitutionFormatter):
+    """A bare literal substitution that never gets registered, for checking fusion on made up mappings."""
+
+    def __init__(self, name: str, mapping: dict[str, str]):
+        super().__init__(name, "", ["text/markdown"])
+        self.substitution = Substitution.literal(mapping)
+
+    @classmethod
+    def create(cls) -> LineFormatter:
+        return cls("literal_substitution", {})
+
+
+def run_substitutions(mappings: list[dict[str, str]], line: str, fuse: bool) -> tuple[str, str]:
+    """Runs a line through literal substitutions with or without fusion, returns what apply and apply_many gave."""
+    formatters: dict[str, LineFormatter] = {
+        f"literal_{index}": LiteralSubstitution(f"literal_{index}", mapping) for index, mapping in enumerate(mappings)
+    }
+    plan = compile_pipeline(tuple(formatters), DispatchTable(line=formatters, multiline={}, preprocessor={}), fuse)
+    flags = FormatterFlags()
+    applied, batched = line, [line]
+    for apply, apply_many in zip(plan.line_formatters, plan.line_batches, strict=True):
+        applied = apply(applied, flags)
+        batched = apply_many(batched, flags)
+    return applied, batched[0]
+
+
+def _compare_fusion(name: str, mappings: list[dict[str, str]], line: str) -> CheckResult:
+    fused = run_substitutions(mappings, line, fuse=True)
+    sequential = run_substitutions(mappings, line, fuse=False)
+    if fused != sequential:
+        return CheckResult(name, False, f"fused {fused[0]!r}, one after the other {sequential[0]!r}")
+    return CheckResult(name, True)
+
+
+def check_equivalence(spec: CorpusSpec) -> list[CheckResult]:
+    """
+    Formats every regression case, and the corpus through every benchmarked pipeline, with and without optimizations.
+    Also runs every fusion case with and without fusion, and checks the in-memory API works without a config,
+    see check_standalone.
+    """
+    results = [
+        _compare(name, enabled, [document.splitlines(keepends=True)])
+        for name, (enabled, document) in REGRESSION_CASES.items()
+    ]
+    results.extend(_compare_fusion(name, mappings, line) for name, (mappings, line) in FUSION_CASES.items())
+    corpus = generate_corpus(spec)
+    results.extend(_compare(name, enabled, corpus) for name, enabled in BENCH_PIPELINES.items())
+    results.append(check_standalone())
+    return results
+
+
+# formats a document the way a library user would, with nothing but chandragen installed
+_STANDALONE_SCRIPT = """
+from chandragen.formatters import FormatterConfig, format_text
+config = FormatterConfig(enabled_formatters=["strip_inline_md_formatting", "convert_inline_links"], peridot=True)
+print(format_text("# Title <<slugify:(text: A B)>>\\nSome **bold** [link](http://a).\\n", config), end="")
+"""
+
+
+def check_standalone() -> CheckResult:
+    """Checks that format_text works in an empty directory without a .env, and doesn't write anything to it."""
+    name = "format_text without a config"
+    with tempfile.TemporaryDirectory() as directory:
+        process = subprocess.run(
+            [sys.executable, "-c", _STANDALONE_SCRIPT], capture_output=True, text=True, cwd=directory, check=False
+        )
+        if process.returncode != 0:
+            return CheckResult(name, False, f"failed: {process.stderr.strip().splitlines()[-1:]}")
+        written = sorted(path.name for path in Path(directory).iterdir())
+        if written:
+            return CheckResult(name, False, f"wrote {', '.join(written)} to the working directory")
+    if "=> http://a link" not in process.stdout:
+        return CheckResult(name, False, f"unexpected output {process.stdout!r}")
+    return CheckResult(name, True)
+
+
+def render_checks(results: list[CheckResult]) -> str:
+    rows = [f"{'check':<30}  status"]
+    rows.extend(f"{result.name:<30}  {'ok' if result.ok else result.detail}" for result in results)
+    return "\n".join(rows)
+
+
+@dataclass
+class StartupResult:
+    """Import time of one startup path, measured with -X importtime."""
+
+    module: str
+    milliseconds: float
+    budget_milliseconds: float
+    forbidden_imports: list[str]
+    # whether importing the module read .env, modules should only ask for the system config once they need it
+    loads_config: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.milliseconds <= self.budget_milliseconds and not self.forbidden_imports and not self.loads_config
+
+
+def measure_import(module: str) -> tuple[float, set[str], bool]:
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+    Returns the cumulative import time of the module in milliseconds, the names of every module it imported,
+    and whether importing it loaded the system config.
+    """
+    script = f"import {module}, chandragen; print(chandragen.loaded_system_config() is not None)"
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True, check=True
+    )
+    milliseconds = 0.0
+    imported: set[str] = set()
+    # lines look like "import time:  self [us] | cumulative | imported package"
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _self_time, cumulative, name = line.removeprefix("import time:").split("|")
+        name = name.strip()
+        imported.add(name)
+        if name == module and cumulative.strip().isdigit():
+            milliseconds = int(cumulative) / 1000
+    return milliseconds, imported, process.stdout.strip() == "True"
+
+
+def check_startup(repeat: int = 3) -> list[StartupResult]:
+    """Measures every startup path in STARTUP_BUDGETS_MS, taking the best of `repeat` runs for each."""
+    results: list[StartupResult] = []
+    for module, budget in STARTUP_BUDGETS_MS.items():
+        runs = [measure_import(module) for _ in range(max(repeat, 1))]
+        _milliseconds, imported, loads_config = runs[0]
+        forbidden = [
+            name
+            for name in STARTUP_FORBIDDEN.get(module, ())
+            if name in imported or any(found.startswith(f"{name}.") for found in imported)
+        ]
+        milliseconds = min(run[0] for run in runs)
+        results.append(StartupResult(module, milliseconds, budget, forbidden, loads_config))
+    return results
+
+
+def render_startup(results: list[StartupResult]) -> str:
+    rows = [f"{'startup path':<30} {'ms':>8} {'budget':>8}  status"]
+    for result in results:
+        problems: list[str] = []
+        if result.milliseconds > result.budget_milliseconds:
+            problems.append("OVER BUDGET")
+        if result.forbidden_imports:
+            problems.append("imports " + ", ".join(result.forbidden_imports))
+        if result.loads_config:
+            problems.append("reads .env on import")
+        status = ", ".join(problems) or "ok"
+        rows.append(f"{result.module:<30} {result.milliseconds:>8.1f} {result.budget_milliseconds:>8.0f}  {status}")
+    return "\n".join(rows)
@@ -1,11 +1,11 @@
 import logging
-from pathlib import Path
 from uuid import UUID
 
 from loguru import logger
+from sqlalchemy import Engine
 from sqlmodel import Session, SQLModel, create_engine
 
-from chandragen import system_config
+import chandragen
 
 # This import is purely to run class decorators
 from chandragen.db import models  #noqa: F401 #pyright:ignore
@@ -25,10 +25,6 @@ class InterceptHandler(logging.Handler):
             depth += 1
         logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
 
-if system_config.log_all_sql:
-    # Redirect SQLAlchemy logs
-    logging.basicConfig(handlers=[InterceptHandler()], level=0, force=True)
-    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
 
 class EntryNotFoundError(Exception):
     """Raised when a database entry cannot be found"""
@@ -36,18 +32,23 @@ class EntryNotFoundError(Exception):
         self.entry_id = entry_id
         super().__init__(f"Entry {self.entry_id} does not exist in the database!")
 
-DATABASE_URL = system_config.db_url
+# The engine is created on first use (persistent), so importing the db package doesn't need a reachable database
+_engine: Engine | None = None
 
-# Create the engine at import time (persistent)
-engine = create_engine(DATABASE_URL, echo=system_config.log_all_sql, pool_pre_ping=True)
+def get_engine() -> Engine:
+    global _engine  # noqa: PLW0603
+    if _engine is None:
+        config = chandragen.system_config
+        if config.log_all_sql:
+            # Redirect SQLAlchemy logs
+            logging.basicConfig(handlers=[InterceptHandler()], level=0, force=True)
+            logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
+        _engine = create_engine(config.db_url, echo=config.log_all_sql, pool_pre_ping=True)
+    return _engine
 
 def init_db():
     """Create all defined tables if they don't exist yet~"""
-    SQLModel.metadata.create_all(engine)
+    SQLModel.metadata.create_all(get_engine())
 
 def get_session() -> Session:
-    return Session(engine)
-
-# Initialize database tables on first import if file doesn't exist yet!
-if not Path("chandragen.db").exists():
-    init_db()
+    return Session(get_engine())
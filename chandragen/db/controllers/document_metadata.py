@@ -0,0 +1,82 @@
+from collections.abc import Callable, Sequence
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from sqlalchemy import nulls_last
+from sqlalchemy.exc import OperationalError, StatementError
+from sqlmodel import Session, col, delete, desc, func, select
+
+from chandragen.db import get_session
+from chandragen.db.models.document_metadata import DocumentMetadataEntry
+
+
+class DocumentMetadataController:
+    def __init__(self, session: Session | None = None):
+        self.session = session or get_session()
+
+    # wraps any db controller call, adds error handling!
+    def _safe_run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        try:
+            return fn(*args, **kwargs)
+        except (OperationalError, StatementError) as e:
+            logger.error(f"database controller call {fn} failed, resetting session and retrying;\n{e}")
+            self.session.rollback()
+            self.session.close()
+            self.session = get_session()
+            # you can try once more after reset
+            return fn(*args, **kwargs)
+
+    def get_entry(self, output_path: Path) -> DocumentMetadataEntry | None:
+        return self._safe_run(lambda: self.session.get(DocumentMetadataEntry, str(output_path)))
+
+    def record_entry(self, entry: DocumentMetadataEntry) -> DocumentMetadataEntry:
+        def run():
+            merged = self.session.merge(entry)
+            self.session.commit()
+            return merged
+
+        return self._safe_run(run)
+
+    def delete_entries(self, output_paths: Sequence[str]) -> None:
+        def run():
+            query = delete(DocumentMetadataEntry).where(col(DocumentMetadataEntry.output_path).in_(output_paths))
+            self.session.exec(query)  # pyright: ignore
+            self.session.commit()
+
+        if output_paths:
+            self._safe_run(run)
+
+    def get_directory_state(self, directory: Path) -> tuple[int, datetime | None]:
+        """
+        Returns how many entries there are for documents rendered under a directory, and when the latest one changed.
+        Both only change when an entry is added, updated or removed, so they're a cheap way to tell whether anything changed.
+        """
+        prefix = f"{directory}/"
+
+        def run():
+            return self.session.exec(
+                select(func.count(), func.max(DocumentMetadataEntry.updated_at)).where(
+                    col(DocumentMetadataEntry.output_path).startswith(prefix, autoescape=True)
+                )
+            ).one()
+
+        count, updated_at = self._safe_run(run)
+        return count, updated_at
+
+    def get_entries_under(self, directory: Path, limit: int | None = None) -> Sequence[DocumentMetadataEntry]:
+        """Returns the entries for documents rendered under a directory, newest first. undated entries go last."""
+        prefix = f"{directory}/"
+
+        def run():
+            query = (
+                select(DocumentMetadataEntry)
+                .where(col(DocumentMetadataEntry.output_path).startswith(prefix, autoescape=True))
+                .order_by(nulls_last(desc(DocumentMetadataEntry.published_at)), DocumentMetadataEntry.output_path)
+            )
+            if limit is not None:
+                query = query.limit(limit)
+            return self.session.exec(query).all()
+
+        return self._safe_run(run)
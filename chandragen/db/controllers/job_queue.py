@@ -5,10 +5,14 @@ from uuid import UUID
 
 from loguru import logger
 from sqlalchemy.exc import OperationalError, StatementError
-from sqlmodel import Session, asc, desc, func, select, text
+from sqlmodel import Session, asc, col, desc, func, select, text, update
 
 from chandragen.db import EntryNotFoundError, get_session
-from chandragen.db.models.job_queue import JobQueueEntry, JobState
+from chandragen.db.models.job_queue import JobQueueEntry, JobResultEntry, JobState
+from chandragen.db.notify import notify_jobs_finished, notify_jobs_queued
+
+# how many jobs a worker tries to claim in one go before it gives up to other workers, and backs off
+CLAIM_ATTEMPTS = 5
 
 
 class JobQueueController:
@@ -55,23 +59,37 @@ class JobQueueController:
         return [job.id for job in jobs]
 
     def claim_next_pending_job(self, worker_id: UUID) -> tuple[UUID, str] | None:  # returns job UUID
-        job = self.session.exec(
-            select(JobQueueEntry)
-            .where(JobQueueEntry.state == JobState.PENDING)
-            .order_by(
-                desc(JobQueueEntry.priority),
-                asc(JobQueueEntry.created_at),
+        """
+        Claims the highest priority pending job for a worker. returns None when the queue is empty,
+        or when other workers took every job it tried for CLAIM_ATTEMPTS times in a row, so the worker backs off.
+        """
+        lost: list[UUID] = []
+        for _ in range(CLAIM_ATTEMPTS):
+            job = self.session.exec(
+                select(JobQueueEntry)
+                .where(JobQueueEntry.state == JobState.PENDING)
+                .where(col(JobQueueEntry.id).not_in(lost))
+                .order_by(
+                    desc(JobQueueEntry.priority),
+                    asc(JobQueueEntry.created_at),
+                )
+                .with_for_update(skip_locked=True)
+            ).first()
+            if job is None:
+                return None
+            # only claim it if it's still pending. SQLite ignores SKIP LOCKED, and every idle worker is woken up
+            # when jobs get queued, so several of them can select the same job at once. the loser tries the next one.
+            claimed = self.session.connection().execute(
+                update(JobQueueEntry)
+                .where(col(JobQueueEntry.id) == job.id)
+                .where(col(JobQueueEntry.state) == JobState.PENDING)
+                .values(state=JobState.IN_PROGRESS, claimed_by=worker_id, started_at=datetime.now(UTC))
             )
-            .with_for_update(skip_locked=True)
-        ).first()
-        if job:
-            job.state = JobState.IN_PROGRESS
-            job.claimed_by = worker_id
-            job.started_at = datetime.now(UTC)
-            self.session.add(job)
             self.session.commit()
-            self.session.refresh(job)
-            return job.id, job.job_type
+            if claimed.rowcount:
+                return job.id, job.job_type
+            lost.append(job.id)
+        logger.debug(f"worker {str(worker_id)[:6]} lost {len(lost)} jobs in a row to other workers, backing off")
         return None
 
     def get_queue_status(
@@ -87,15 +105,28 @@ class JobQueueController:
 
         return pending_count, in_progress_count, ratio
 
+    def get_unfinished_jobs(self, exclude_type: str) -> Sequence[JobQueueEntry]:
+        """Returns the pending and in-progress jobs of every job type but one."""
+        return self._safe_run(
+            lambda: self.session.exec(
+                select(JobQueueEntry)
+                .where(col(JobQueueEntry.state).in_([JobState.PENDING, JobState.IN_PROGRESS]))
+                .where(JobQueueEntry.job_type != exclude_type)
+            ).all()
+        )
+
     def add_job(self, job: JobQueueEntry):
         self.session.add(job)
         self.session.commit()
         self.session.refresh(job)
+        notify_jobs_queued(self.session)
         return job
 
     def add_job_list(self, joblist: list[JobQueueEntry]):
         self.session.add_all(joblist)
         self.session.commit()
+        # one wakeup for the whole batch, workers keep claiming until the queue is empty
+        notify_jobs_queued(self.session)
         return joblist
 
     def get_pending_jobs(self, limit: int = 10) -> Sequence[JobQueueEntry]:
@@ -123,6 +154,7 @@ class JobQueueController:
             self.session.add(job)
             self.session.commit()
             self.session.refresh(job)
+            notify_jobs_queued(self.session)
         return job
 
     def mark_job_complete(self, job_id: UUID):
@@ -132,6 +164,7 @@ class JobQueueController:
             self.session.add(job)
             self.session.commit()
             self.session.refresh(job)
+            notify_jobs_finished(self.session)
         return job
 
     def mark_job_failed(self, job_id: UUID):
@@ -141,6 +174,7 @@ class JobQueueController:
             self.session.add(job)
             self.session.commit()
             self.session.refresh(job)
+            notify_jobs_finished(self.session)
         return job
 
     def delete_completed_jobs(self):
@@ -149,6 +183,19 @@ class JobQueueController:
             self.session.delete(job)
         self.session.commit()
 
+    def set_job_result(self, job_id: UUID, name: str, result_json: str) -> JobResultEntry:
+        def run():
+            result = self.session.merge(JobResultEntry(job_id=job_id, name=name, result_json=result_json))
+            self.session.commit()
+            return result
+
+        return self._safe_run(run)
+
+    def get_job_results_since(self, since: datetime) -> Sequence[JobResultEntry]:
+        return self._safe_run(
+            lambda: self.session.exec(select(JobResultEntry).where(JobResultEntry.created_at >= since)).all()
+        )
+
     def tune_autovacuum(self):
         sql = text("""
             ALTER TABLE job_queue SET (
@@ -0,0 +1,50 @@
+from collections.abc import Callable, Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from sqlalchemy.exc import OperationalError, StatementError
+from sqlmodel import Session, delete, select
+
+from chandragen.db import get_session
+from chandragen.db.models.peridot_dependency import PeridotDependencyEntry
+
+
+class PeridotDependencyController:
+    def __init__(self, session: Session | None = None):
+        self.session = session or get_session()
+
+    # wraps any db controller call, adds error handling!
+    def _safe_run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        try:
+            return fn(*args, **kwargs)
+        except (OperationalError, StatementError) as e:
+            logger.error(f"database controller call {fn} failed, resetting session and retrying;\n{e}")
+            self.session.rollback()
+            self.session.close()
+            self.session = get_session()
+            # you can try once more after reset
+            return fn(*args, **kwargs)
+
+    def get_partials(self, output_path: Path) -> Sequence[PeridotDependencyEntry]:
+        """Returns every partial the page at an output path included the last time it was rendered."""
+        return self._safe_run(
+            lambda: self.session.exec(
+                select(PeridotDependencyEntry).where(PeridotDependencyEntry.output_path == str(output_path))
+            ).all()
+        )
+
+    def set_partials(self, output_path: Path, partials: Mapping[str, str]) -> None:
+        """Replaces the partials recorded for a page with the ones from its latest render, by path and content hash."""
+
+        def run():
+            self.session.exec(  # pyright: ignore
+                delete(PeridotDependencyEntry).where(PeridotDependencyEntry.output_path == str(output_path))  # pyright: ignore
+            )
+            self.session.add_all(
+                PeridotDependencyEntry(output_path=str(output_path), partial_path=path, partial_hash=digest)
+                for path, digest in partials.items()
+            )
+            self.session.commit()
+
+        self._safe_run(run)
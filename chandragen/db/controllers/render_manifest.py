@@ -0,0 +1,54 @@
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from sqlalchemy.exc import OperationalError, StatementError
+from sqlmodel import Session, col, select
+
+from chandragen.db import get_session
+from chandragen.db.models.render_manifest import RenderManifestEntry
+
+
+class RenderManifestController:
+    def __init__(self, session: Session | None = None):
+        self.session = session or get_session()
+
+    # wraps any db controller call, adds error handling!
+    def _safe_run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        try:
+            return fn(*args, **kwargs)
+        except (OperationalError, StatementError) as e:
+            logger.error(f"database controller call {fn} failed, resetting session and retrying;\n{e}")
+            self.session.rollback()
+            self.session.close()
+            self.session = get_session()
+            # you can try once more after reset
+            return fn(*args, **kwargs)
+
+    def get_entry(self, output_path: Path) -> RenderManifestEntry | None:
+        return self._safe_run(lambda: self.session.get(RenderManifestEntry, str(output_path)))
+
+    def find_render(self, input_hash: str, fingerprint: str, exclude: Path | None = None) -> RenderManifestEntry | None:
+        """Finds an existing render of the same input content through the same pipeline, written to another path. volatile renders are left out."""
+
+        def run():
+            query = (
+                select(RenderManifestEntry)
+                .where(RenderManifestEntry.input_hash == input_hash)
+                .where(RenderManifestEntry.fingerprint == fingerprint)
+                .where(col(RenderManifestEntry.volatile).is_(False))
+            )
+            if exclude is not None:
+                query = query.where(RenderManifestEntry.output_path != str(exclude))
+            return self.session.exec(query).first()
+
+        return self._safe_run(run)
+
+    def record_render(self, entry: RenderManifestEntry) -> RenderManifestEntry:
+        def run():
+            merged = self.session.merge(entry)
+            self.session.commit()
+            return merged
+
+        return self._safe_run(run)
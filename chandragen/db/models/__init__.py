@@ -0,0 +1,4 @@
+# Importing every model module registers its tables with SQLModel.metadata, so init_db creates all of them
+from chandragen.db.models import config, document_metadata, job_queue, peridot_dependency, render_manifest
+
+__all__ = ["config", "document_metadata", "job_queue", "peridot_dependency", "render_manifest"]
@@ -0,0 +1,41 @@
+from datetime import UTC, datetime
+
+from sqlmodel import Field, Index, SQLModel
+
+"""
+ChandraGen Document Metadata Models 🏷️
+
+This module defines the `DocumentMetadataEntry` table, which holds the frontmatter
+of every rendered document that has one.
+
+Each entry maps an output path to:
+- The title, description, date and author from the document's frontmatter
+- The date parsed into a timestamp, used to order index pages and feeds
+- Every other frontmatter field, serialized as JSON
+- The hash of the source document it was read from
+
+Formatter jobs keep the table up to date as they render documents, so index jobs
+can build gemlog index pages and Atom feeds without reading a single source file.
+"""
+
+
+class DocumentMetadataEntry(SQLModel, table=True):
+    """Frontmatter of the document rendered to an output path."""
+
+    __tablename__ = "document_metadata"  # pyright:ignore
+    __table_args__ = (Index("ix_document_metadata_published_at", "published_at"),)
+
+    output_path: str = Field(primary_key=True, description="Path the rendered document was written to")
+    input_path: str = Field(description="Path the source document was read from")
+    input_hash: str = Field(description="sha256 of the source document the metadata was read from")
+
+    title: str | None = Field(default=None, description="The title field of the frontmatter")
+    description: str | None = Field(default=None, description="The description field of the frontmatter")
+    author: str | None = Field(default=None, description="The author field of the frontmatter")
+    date: str | None = Field(default=None, description="The date field of the frontmatter, exactly as written")
+    published_at: datetime | None = Field(default=None, description="The date field parsed, None if it isn't ISO 8601")
+    fields_json: str = Field(default="{}", description="Every frontmatter field (JSON string)")
+
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC), index=True, description="When the entry last changed"
+    )
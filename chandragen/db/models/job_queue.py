@@ -70,6 +70,22 @@ class JobQueueEntry(SQLModel, table=True):
     priority: int = Field(default=0, description="Optional priority system for the queue (higher = sooner)")
 
 
+class JobResultEntry(SQLModel, table=True):
+    """
+    Holds the result data a job reported when it finished, eg. formatter profiling stats.
+    Kept in its own table, since completed jobs get purged from the queue by the garbage collector.
+    """
+
+    __tablename__ = "job_results"  # pyright:ignore
+
+    job_id: UUID = Field(primary_key=True, description="ID of the job queue entry that produced the result")
+    name: str = Field(index=True, description="Name of the job that produced the result")
+    result_json: str = Field(description="Serialized job result (JSON string)")
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC), index=True, description="Time the result was recorded"
+    )
+
+
 # Use an SQLAlchemy listener to ensure the table is *unlogged* after creation!
 # This tells postgres that we don't care about persistence with this table, so it won't bother writing it to disk.
 # keeps it going extra fast!!
@@ -0,0 +1,24 @@
+from sqlmodel import Field, SQLModel
+
+"""
+ChandraGen Peridot Dependency Models 🧩
+
+This module defines the `PeridotDependencyEntry` table, the dependency graph between
+rendered pages and the Peridot partials they include.
+
+Each entry maps an output document to one partial it included, directly or through another partial,
+along with the hash of the partial's contents at the time the page was rendered.
+
+Formatter jobs use the graph to tell when a page has to be rendered again even though its own
+source didn't change, so editing a shared partial only rebuilds the pages that include it.
+"""
+
+
+class PeridotDependencyEntry(SQLModel, table=True):
+    """Records that a rendered page included a partial."""
+
+    __tablename__ = "peridot_dependencies"  # pyright:ignore
+
+    output_path: str = Field(primary_key=True, description="Path the page including the partial was rendered to")
+    partial_path: str = Field(primary_key=True, index=True, description="Resolved path of the included partial")
+    partial_hash: str = Field(description="sha256 of the partial's contents when the page was rendered")
@@ -0,0 +1,38 @@
+from datetime import UTC, datetime
+
+from sqlmodel import Field, Index, SQLModel
+
+"""
+ChandraGen Render Manifest Models 🗂️
+
+This module defines the `RenderManifestEntry` table, which remembers what every
+output document was last rendered from.
+
+Each entry maps an output path to:
+- The hash of the input document's contents
+- The fingerprint of the pipeline that rendered it (formatters, versions, flags, heading/footing)
+- The hash and size of the output document that was written
+- Whether the render is volatile, ie. used Peridot substitutions like timestamps whose output changes between renders
+
+Formatter jobs use the manifest to skip files whose input and pipeline haven't
+changed since the last run, and to reuse an identical render of the same input
+that another job already wrote somewhere else. Volatile renders are never skipped or reused.
+"""
+
+
+class RenderManifestEntry(SQLModel, table=True):
+    """Records the last render written to an output path."""
+
+    __tablename__ = "render_manifest"  # pyright:ignore
+    __table_args__ = (Index("ix_render_manifest_input_fingerprint", "input_hash", "fingerprint"),)
+
+    output_path: str = Field(primary_key=True, description="Path the rendered document was written to")
+    input_path: str = Field(description="Path the source document was read from")
+    input_hash: str = Field(description="sha256 of the source document's contents")
+    fingerprint: str = Field(description="Fingerprint of the pipeline config used to render the document")
+    output_hash: str = Field(description="sha256 of the rendered document's contents")
+    output_size: int = Field(description="Size of the rendered document in bytes, used as a cheap staleness check")
+    volatile: bool = Field(
+        default=False, description="Whether the render used impure Peridot substitutions, so it's always re-rendered"
+    )
+    rendered_at: datetime = Field(default_factory=lambda: datetime.now(UTC), description="When the render was written")
@@ -0,0 +1,190 @@
+import select
+import socket
+from collections.abc import Callable
+from contextlib import suppress
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+from sqlalchemy.exc import OperationalError, StatementError
+from sqlmodel import Session, text
+
+from chandragen.db import get_engine
+
+"""
+ChandraGen Job Queue Notifications 🔔
+
+Lets idle workers sleep until there is work for them, instead of polling the job queue.
+
+Whenever jobs are queued (or re-queued for a retry) the controller publishes a wakeup:
+- Postgres: a NOTIFY on the `chandragen_jobs` channel, which every worker LISTENs on with its own connection
+- SQLite: a datagram to every worker's unix socket in a `<database>-wakeup` directory next to the database file,
+  since SQLite is only ever used on a single node
+
+Finished jobs get the same kind of wakeup on a channel of their own, `chandragen_jobs_finished` (or a
+`<database>-finished` directory), for jobs like gemlog indexes that wait on the jobs queued alongside them.
+
+Any other database, or a listener that can't be set up, leaves workers on exponential backoff polling.
+Wakeups carry no data and may be lost or spurious, workers always go back to claiming jobs from the queue
+and keep polling slowly as a fallback, so a missed notification only delays a job rather than losing it.
+"""
+
+JOB_CHANNEL = "chandragen_jobs"
+FINISHED_CHANNEL = "chandragen_jobs_finished"
+
+# suffix of the directory next to a SQLite database holding the sockets of each channel's listeners
+_SOCKET_DIRS = {JOB_CHANNEL: "wakeup", FINISHED_CHANNEL: "finished"}
+
+
+def _wakeup_dir(channel: str = JOB_CHANNEL) -> Path | None:
+    """The directory SQLite listeners of a channel keep their sockets in, None if the database isn't a SQLite file."""
+    url = get_engine().url
+    if url.get_backend_name() != "sqlite" or not hasattr(socket, "AF_UNIX"):
+        return None
+    if not url.database or url.database == ":memory:":
+        return None
+    return Path(f"{url.database}-{_SOCKET_DIRS[channel]}")
+
+
+def _drain_socket(sock: socket.socket) -> None:
+    with suppress(BlockingIOError):
+        while sock.recv(64):
+            pass
+
+
+def _notify_sockets(directory: Path) -> None:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+        sender.setblocking(False)
+        for path in directory.glob("*.sock"):
+            try:
+                sender.sendto(b"\x01", str(path))
+            except BlockingIOError:
+                # the worker's buffer is full of wakeups it hasn't read yet, one more wouldn't change anything
+                continue
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left behind by a worker that was killed
+                path.unlink(missing_ok=True)
+
+
+def _notify(session: Session, channel: str) -> None:
+    if get_engine().dialect.name == "postgresql":
+        session.exec(text(f"NOTIFY {channel}"))  # pyright: ignore
+        session.commit()
+        return
+    directory = _wakeup_dir(channel)
+    if directory is not None and directory.is_dir():
+        _notify_sockets(directory)
+
+
+def notify_jobs_queued(session: Session) -> None:
+    """Wakes idle workers up after jobs were committed to the queue. never raises, workers fall back to polling."""
+    try:
+        _notify(session, JOB_CHANNEL)
+    except (OperationalError, StatementError, OSError) as e:
+        logger.warning(f"could not notify workers about queued jobs, they'll pick them up on their next poll;\n{e}")
+
+
+def notify_jobs_finished(session: Session) -> None:
+    """Wakes up jobs waiting on other jobs after one was marked completed or failed. never raises, waiters poll too."""
+    try:
+        _notify(session, FINISHED_CHANNEL)
+    except (OperationalError, StatementError, OSError) as e:
+        logger.warning(f"could not notify waiting jobs about a finished job, they'll see it on their next check;\n{e}")
+
+
+class JobWaiter:
+    """
+    Job Waiter
+
+    Blocks an idle worker until jobs are queued, it's woken up by wake(), or a timeout passes.
+    Listening on FINISHED_CHANNEL instead, it blocks until a job finishes.
+    Create it in the worker process itself, its connection and sockets can't be shared across a fork.
+
+    Attributes:
+        listening (bool): whether queue notifications are being received, if not wait() only ever times out or gets woken.
+    """
+
+    def __init__(self, name: str, channel: str = JOB_CHANNEL):
+        self.name = name
+        self.channel = channel
+        # a self-pipe, so another thread can interrupt wait() to shut the worker down
+        self._wake_read, self._wake_write = socket.socketpair()
+        self._wake_read.setblocking(False)
+        self._wake_write.setblocking(False)
+        self._listener: Any = None
+        self._drain: Callable[[], None] | None = None
+        self._cleanup: Callable[[], None] | None = None
+        try:
+            self._listen()
+        except Exception as e:  # the driver raises its own exception types once we're past sqlalchemy
+            logger.warning(f"worker {name} could not listen for queued jobs, falling back to polling;\n{e}")
+            self._close_listener()
+
+    @property
+    def listening(self) -> bool:
+        return self._listener is not None
+
+    def _listen(self) -> None:
+        if get_engine().dialect.name == "postgresql":
+            # a connection of its own, detached from the pool so it's really closed rather than reused later
+            raw = get_engine().raw_connection()
+            raw.detach()
+            connection = raw.driver_connection
+            connection.autocommit = True  # pyright: ignore
+            with connection.cursor() as cursor:  # pyright: ignore
+                cursor.execute(f"LISTEN {self.channel}")
+
+            def drain():
+                connection.poll()  # pyright: ignore
+                connection.notifies.clear()  # pyright: ignore
+
+            self._listener, self._drain, self._cleanup = connection, drain, raw.close
+            return
+
+        directory = _wakeup_dir(self.channel)
+        if directory is None:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{self.name}.sock"
+        path.unlink(missing_ok=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._listener = listener
+        self._cleanup = lambda: path.unlink(missing_ok=True)
+        listener.setblocking(False)
+        listener.bind(str(path))
+        self._drain = lambda: _drain_socket(listener)
+
+    def _close_listener(self) -> None:
+        if isinstance(self._listener, socket.socket):
+            self._listener.close()
+        if self._cleanup is not None:
+            self._cleanup()
+        self._listener = self._drain = self._cleanup = None
+
+    def wait(self, timeout: float) -> bool:
+        """Waits up to timeout seconds, returns True if it was woken up early rather than timing out."""
+        watched: list[Any] = [self._wake_read]
+        if self._listener is not None:
+            watched.append(self._listener)
+        readable, _, _ = select.select(watched, [], [], timeout)
+        if self._wake_read in readable:
+            _drain_socket(self._wake_read)
+        if self._listener is not None and self._listener in readable:
+            try:
+                self._drain()  # pyright: ignore
+            except Exception as e:
+                # eg. the database went away, keep the worker going on polling alone
+                logger.warning(f"worker {self.name} lost its job notifications, falling back to polling;\n{e}")
+                self._close_listener()
+        return bool(readable)
+
+    def wake(self) -> None:
+        """Interrupts a wait() from another thread."""
+        # a full buffer means a wakeup is already pending
+        with suppress(OSError):
+            self._wake_write.send(b"\x01")
+
+    def close(self) -> None:
+        self._close_listener()
+        self._wake_read.close()
+        self._wake_write.close()
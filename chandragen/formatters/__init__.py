@@ -1,8 +1,16 @@
-import re
+from collections.abc import Iterable, Iterator
+from copy import deepcopy
+from io import StringIO
+from time import perf_counter
+from typing import TYPE_CHECKING
 
 from loguru import logger
 
-from chandragen.formatters.registry import FORMATTER_REGISTRY, import_builtin_formatters
+from chandragen.formatters.frontmatter import split_frontmatter
+from chandragen.formatters.pipeline import MultilineMatcher, PipelinePlan, get_pipeline
+from chandragen.formatters.profiling import FormatterProfile
+from chandragen.formatters.reader import open_document
+from chandragen.formatters.registry import FORMATTER_REGISTRY
 from chandragen.formatters.types import (
     DocumentPreprocessor,
     FormatterConfig,
@@ -10,11 +18,15 @@ from chandragen.formatters.types import (
     MultilineFormatter,
 )
 from chandragen.formatters.types import FormatterFlags
-from chandragen.plugins import import_all_plugins
+from chandragen.formatters.writer import WriteResult, write_document
 
-# Load modules immediately during import time.
-import_all_plugins()
-import_builtin_formatters()
+if TYPE_CHECKING:
+    from chandragen.peridot.types import RenderContext
+
+# Formatter modules aren't imported up front, pipelines import the ones they need through the formatter manifest.
+
+# Upper bound on how many lines get batched together for apply_many, keeps streaming memory flat
+BATCH_SPAN_LINES = 512
 
 
 class DocumentFormatter:
@@ -24,18 +36,60 @@ class DocumentFormatter:
     args:
         config: A FormatterConfig object describing the pipeline
         flags: A FormatterFlags object containing the initial flag data
+        profile: optional FormatterProfile to record per-formatter timings into. leave it out for the uninstrumented pipeline.
 
     methods:
         format_document:
             takes a list of strings representing an input document, runs it through the pipeline, and returns the results.
+        stream_document:
+            takes any iterable of lines, and lazily yields formatted lines as the pipeline produces them.
+        format_file:
+            streams the config's input file through the pipeline into its output file.
+        reset:
+            clears all per-document state. called automatically at the start of every document,
+            so one formatter can be reused for any number of documents.
+
+    attributes:
+        metadata: the frontmatter of the document being (or last) formatted, captured from the raw input as it streams past.
+            empty if the document doesn't have any.
+        dependencies: resolved path and sha256 of every Peridot partial the document being (or last) formatted included.
+            empty unless the config enables Peridot.
+        volatile: whether the document being (or last) formatted rendered a Peridot substitution that isn't pure,
+            so formatting the same source again can give a different document.
     """
 
-    def __init__(self, config: FormatterConfig, flags: FormatterFlags):
+    def __init__(self, config: FormatterConfig, flags: FormatterFlags, profile: FormatterProfile | None = None):
         logger.debug("starting formatter")
         self.config = config
+        self.initial_flags = deepcopy(flags)
         self.flags = flags
+        self.profile = profile
+        self.plan: PipelinePlan = get_pipeline(config)
+        if profile is not None:
+            self.plan = profile.instrument(self.plan)
+        self.active_multiline: MultilineMatcher | None = None
         self.multiline_buffer: list[str] = []
+        self.batch_span: list[str] = []
         self.output_doc: list[str] = []
+        self.metadata: dict[str, str] = {}
+        self.dependencies: dict[str, str] = {}
+        self.render_context: RenderContext | None = None
+
+    @property
+    def volatile(self) -> bool:
+        return self.render_context is not None and self.render_context.volatile
+
+    def reset(self) -> None:
+        """
+        Puts the formatter back in the state it was created in, so it can format another document.
+        Flags go back to the ones the formatter was created with, and every buffer is emptied.
+        """
+        self.flags = deepcopy(self.initial_flags)
+        self.active_multiline = None
+        self.multiline_buffer.clear()
+        self.batch_span.clear()
+        self.output_doc.clear()
+        self.metadata = {}
 
     def _apply_line_formatters(self, line: str) -> str:
         """
@@ -47,10 +101,9 @@ class DocumentFormatter:
         Returns:
             A string representing the formatted line.
         """
-        for name in self.config.enabled_formatters:
-            formatter = FORMATTER_REGISTRY.line.get(name)
-            if formatter:
-                line = formatter.apply(line, self.flags)
+        flags = self.flags
+        for apply in self.plan.line_formatters:
+            line = apply(line, flags)
         return line
 
     def _apply_preprocessors(self, document: list[str]) -> list[str]:
@@ -63,12 +116,30 @@ class DocumentFormatter:
         Returns:
             The processed document.
         """
-        for formatter in self.config.enabled_formatters:
-            preprocessor = FORMATTER_REGISTRY.preprocessor.get(formatter)
-            if preprocessor:
-                document = preprocessor.apply(document, self.config)
+        for apply in self.plan.preprocessors:
+            document = apply(document, self.config)
         return document
 
+    def _stream_preprocessors(self, lines: Iterable[str]) -> Iterable[str]:
+        """
+        Pre-processes a stream of lines, only buffering the whole document if an enabled pre-processor needs it.
+
+        Args:
+            lines: The lines of the document to be processed.
+
+        Returns:
+            An iterable over the processed lines.
+        """
+        if not self.plan.preprocessors:
+            return lines
+        if self.plan.buffers_document:
+            logger.debug("pipeline contains pre-processors that need the full document, buffering input")
+            return self._apply_preprocessors(list(lines))
+        stream = iter(lines)
+        for apply_stream in self.plan.preprocessor_streams:
+            stream = apply_stream(stream, self.config)
+        return stream
+
     def format_document(self, input_doc: list[str]) -> list[str]:
         """Format Document
 
@@ -80,12 +151,99 @@ class DocumentFormatter:
         Returns:
             list[str]: The formatted document.
         """
-        working_doc: list[str] = self._apply_preprocessors(input_doc)
+        return list(self.stream_document(input_doc))
+
+    def stream_document(self, input_doc: Iterable[str]) -> Iterator[str]:
+        """Stream Document
+
+        Lazily formats an iterable of lines, yielding formatted lines as soon as the pipeline produces them.
+        Only the pre-processors flagged as needing the full document, and open multiline blocks, hold lines in memory.
+
+        Arguments:
+            input_doc (Iterable[str]): The lines of the document to be formatted, eg. an open file.
+
+        Yields:
+            str: The lines of the formatted document.
+        """
+        self.dependencies = {}
+        self.render_context = None
+        if not self.config.peridot:
+            return self._stream_formatted(input_doc)
+        from chandragen.peridot.engine import get_peridot_engine  # noqa: PLC0415
+        from chandragen.peridot.types import RenderContext  # noqa: PLC0415
+
+        # Peridot runs after every formatter, on the finished document
+        self.render_context = RenderContext(self.config, dependencies=self.dependencies)
+        return get_peridot_engine().render_lines(self._stream_formatted(input_doc), self.render_context)
+
+    def _stream_formatted(self, input_doc: Iterable[str]) -> Iterator[str]:
+        self.reset()
+        output = self.output_doc
+        span = self.batch_span
+        self.metadata, lines = split_frontmatter(iter(input_doc))
+        for line in self._stream_preprocessors(lines):
+            if self._can_batch(line):
+                span.append(line)
+                if len(span) < BATCH_SPAN_LINES:
+                    continue
+                self._process_span()
+            else:
+                if span:
+                    self._process_span()
+                self._process_line(line)
+            if output:
+                yield from output
+                output.clear()
+
+        if span:
+            self._process_span()
+        self._finish_document()
+        yield from output
+        output.clear()
+
+    def format_file(self) -> WriteResult:
+        """
+        Streams the config's input file through the pipeline, and atomically writes the result to its output file.
+        Raises ValueError if the config is missing either path.
+        """
+        if self.config.input_path is None or self.config.output_path is None:
+            msg = "input or output path not specified"
+            raise ValueError(msg)
+        # the writer only swaps the output doc in once it's complete
+        with open_document(self.config) as source:
+            return write_document(self.config.output_path, self.stream_document(source))
+
+    def _can_batch(self, line: str) -> bool:
+        """
+        Checks whether a line can join a batch for apply_many.
+        Only plain lines outside of preformatted and multiline blocks are batched,
+        lines that toggle preformatting or look like they start a multiline block go through one at a time.
+        Nothing is batched when a line formatter is stateful, its buffer has to be flushed at the first line
+        that comes out of the formatters blank, which only routing each line as it's formatted gets right.
 
-        for line in working_doc:
-            self._process_line(line)
+        Args:
+            line: the raw line about to be processed
+        """
+        if not self.plan.batches_lines or self.flags.in_preformat or self.flags.in_multiline or line.startswith("```"):
+            return False
+        return self.plan.match_multiline_start(line) is None
 
-        return self.output_doc
+    def _process_span(self) -> None:
+        """
+        Runs the pending batch of lines through every line formatter's apply_many, then routes the results one by one.
+        """
+        span = self.batch_span
+        flags = self.flags
+        working_lines = list(span)
+        for apply_many in self.plan.line_batches:
+            working_lines = apply_many(working_lines, flags)
+        if len(working_lines) != len(span):
+            msg = f"line formatter batch returned {len(working_lines)} lines for {len(span)} input lines"
+            raise ValueError(msg)
+
+        for line, working_line in zip(span, working_lines, strict=True):
+            self._route_line(line, working_line)
+        span.clear()
 
     def _process_line(self, line: str) -> None:
         """
@@ -96,26 +254,43 @@ class DocumentFormatter:
         if line.startswith("```"):
             self.flags.in_preformat = not self.flags.in_preformat
 
-        working_line = self._apply_line_formatters(line)
+        self._route_line(line, self._apply_line_formatters(line))
 
+    def _route_line(self, line: str, working_line: str) -> None:
+        """
+        Sends a formatted line to the output document, or into a multiline block.
+        Args:
+            line (str): the raw line of the document
+            working_line (str): the same line after running through the line formatters
+        """
         if working_line.isspace() and self.flags.buffer_until_empty_line:
             self._flush_buffered_content()
 
-        if not self.flags.in_multiline:
+        if not self.flags.in_multiline and self.plan.multiline_formatters:
             self._check_and_start_multiline(working_line)
 
-        if self.flags.in_multiline and self.flags.active_multiline_formatter:
-            active_formatter = FORMATTER_REGISTRY.multiline.get(self.flags.active_multiline_formatter)
-            if not active_formatter:
-                return
-
-            if re.match(active_formatter.end_pattern, line):
-                self._end_multiline_formatting(active_formatter)
+        active_multiline = self.active_multiline
+        if self.flags.in_multiline and active_multiline:
+            if active_multiline.end.match(line):
+                self._end_multiline_formatting(active_multiline.formatter)
                 return
 
             self.multiline_buffer.append(line)
+            if len(self.multiline_buffer) > self.config.max_multiline_buffer_lines:
+                self._abandon_multiline_formatting()
         else:
-            self.output_doc.append(line)
+            self.output_doc.append(working_line)
+
+    def _finish_document(self) -> None:
+        """
+        Closes out anything still pending once the input runs out.
+        A multiline block that runs to the end of the document is formatted as if it had been terminated,
+        and any lines still waiting for an empty line are flushed.
+        """
+        if self.flags.in_multiline and self.active_multiline:
+            self._end_multiline_formatting(self.active_multiline.formatter)
+        if self.flags.buffer_until_empty_line:
+            self._flush_buffered_content()
 
     def _flush_buffered_content(self) -> None:
         """
@@ -136,12 +311,11 @@ class DocumentFormatter:
         Args:
             line: The current line being processed.
         """
-        for name in self.config.enabled_formatters:
-            formatter = FORMATTER_REGISTRY.multiline.get(name)
-            if formatter and re.match(formatter.start_pattern, line):
-                self.flags.in_multiline = True
-                self.flags.active_multiline_formatter = formatter.name
-                break
+        matcher = self.plan.match_multiline_start(line)
+        if matcher is not None:
+            self.flags.in_multiline = True
+            self.flags.active_multiline_formatter = matcher.formatter.name
+            self.active_multiline = matcher
 
     def _end_multiline_formatting(self, formatter: MultilineFormatter) -> None:
         """
@@ -152,54 +326,114 @@ class DocumentFormatter:
         """
         self.flags.in_multiline = False
         self.flags.active_multiline_formatter = None
-        formatted_buffer = formatter.apply(self.multiline_buffer, self.config, self.flags)
+        self.active_multiline = None
+        if self.profile is None:
+            formatted_buffer = formatter.apply(self.multiline_buffer, self.config, self.flags)
+        else:
+            start = perf_counter()
+            formatted_buffer = formatter.apply(self.multiline_buffer, self.config, self.flags)
+            self.profile.record_multiline(
+                formatter.name, perf_counter() - start, len(self.multiline_buffer), len(formatted_buffer)
+            )
         self.output_doc += formatted_buffer
         self.multiline_buffer.clear()
 
+    def _abandon_multiline_formatting(self) -> None:
+        """
+        Gives up on a multiline block that has grown past the configured buffer cap.
+        The block is treated as unterminated, and the buffered lines are passed through unformatted.
+        """
+        logger.warning(
+            f"multiline block for {self.flags.active_multiline_formatter} exceeded "
+            f"{self.config.max_multiline_buffer_lines} lines without terminating, passing it through unformatted"
+        )
+        self.flags.in_multiline = False
+        self.flags.active_multiline_formatter = None
+        self.active_multiline = None
+        self.output_doc += self.multiline_buffer
+        self.multiline_buffer.clear()
+
+
+def format_lines(
+    lines: Iterable[str], config: FormatterConfig, flags: FormatterFlags | None = None
+) -> Iterator[str]:
+    """
+    Formats a document held in memory, lazily yielding the formatted lines.
+    The pipeline for the config is compiled once and cached, so calling this per request is cheap.
+
+    Args:
+        lines: the lines of the document, each ending in a newline
+        config: the pipeline configuration. input_path and output_path are ignored.
+        flags: initial formatter flags, defaults to a fresh FormatterFlags
+
+    Returns:
+        An iterator over the formatted lines.
+    """
+    formatter = DocumentFormatter(config, flags if flags is not None else FormatterFlags())
+    return formatter.stream_document(lines)
+
+
+def format_text(text: str, config: FormatterConfig, flags: FormatterFlags | None = None) -> str:
+    """
+    Formats a document held in a string and returns the formatted document, without touching the filesystem.
+    Line endings are normalized the same way they are when reading a file.
+    """
+    return "".join(format_lines(StringIO(text, newline=None), config, flags))
+
+
+def format_bytes(
+    data: bytes, config: FormatterConfig, flags: FormatterFlags | None = None, encoding: str = "utf-8"
+) -> bytes:
+    """Formats an encoded document, returning the formatted document in the same encoding."""
+    return format_text(data.decode(encoding), config, flags).encode(encoding)
+
 
 # Function used to run the formatter module on a document.
-def apply_formatting_to_file(config: FormatterConfig) -> bool:
+def apply_formatting_to_file(config: FormatterConfig, profile: FormatterProfile | None = None) -> WriteResult | None:
     """
     Formats a document based on the provided configuration paths.
 
     This function reads a document from the input path specified in
     the configuration, applies formatting to its contents using
-    FormatterConfig settings, and writes the formatted content to the
-    output path. If the input or output path is not specified, it logs
-    an error and returns False.
+    FormatterConfig settings, and atomically writes the formatted content to the
+    output path, leaving the output untouched if it's already identical.
+    If the input or output path is not specified, it logs an error and returns None.
 
     Args:
         config (FormatterConfig): Configuration object containing input
                                   and output file paths and formatting
                                   settings.
+        profile (FormatterProfile | None): records per-formatter timings when given.
 
     Returns:
-        bool: True if the formatting and writing operations are successful,
-              False if there was an error with the input/output paths.
+        WriteResult | None: what was written to the output path,
+              or None if there was an error with the input/output paths.
     """
     if config.input_path is None or config.output_path is None:
         logger.error("Formatter error: input or output path not specified")
-        return False
-
-    # Grab the file, then split it into a 2D list for ease of manipulation
-    with config.input_path.open() as f:
-        input_file = f.readlines()
+        return None
 
     # TODO: implement the formatter flag frontloading logic
     flags = FormatterFlags()
-    # format the input doc and write the results to the output doc
-    formatter = DocumentFormatter(config, flags)
-    gemtext = f"{''.join(formatter.format_document(input_file))}"
-
-    with config.output_path.open("w", encoding="utf-8") as page:
-        page.write(gemtext)
-
-    return True
+    return DocumentFormatter(config, flags, profile).format_file()
 
 
 __all__ = [
+    "FORMATTER_REGISTRY",
+    "DocumentFormatter",
     "DocumentPreprocessor",
+    "FormatterConfig",
+    "FormatterFlags",
+    "FormatterProfile",
     "LineFormatter",
     "MultilineFormatter",
+    "PipelinePlan",
+    "WriteResult",
     "apply_formatting_to_file",
+    "format_bytes",
+    "format_lines",
+    "format_text",
+    "get_pipeline",
+    "open_document",
+    "write_document",
 ]
@@ -0,0 +1,36 @@
+import hashlib
+import json
+from dataclasses import asdict
+from pathlib import Path
+
+import chandragen
+from chandragen.formatters.pipeline import get_pipeline
+from chandragen.formatters.types import FormatterConfig
+
+# config fields that say where a render comes from or goes to, rather than how it's rendered
+_UNFINGERPRINTED_FIELDS = {"jobname", "input_path", "output_path"}
+
+
+def hash_file(path: Path) -> str:
+    """Returns the sha256 hex digest of a file's contents, read in chunks."""
+    with path.open("rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def render_fingerprint(config: FormatterConfig) -> str:
+    """
+    Fingerprints everything about a formatter config that can change the output for a given input:
+    the enabled formatters and their versions, formatter flags, heading/footing settings and so on.
+    Two renders of the same input content with the same fingerprint produce the same document.
+    """
+    settings = {key: value for key, value in asdict(config).items() if key not in _UNFINGERPRINTED_FIELDS}
+    fingerprint = {
+        "chandragen": chandragen.__version__,
+        "formatters": get_pipeline(config).formatter_versions,
+        "settings": settings,
+    }
+    if config.peridot:
+        from chandragen.peridot.engine import get_peridot_engine  # noqa: PLC0415
+
+        fingerprint["peridot"] = get_peridot_engine().handler_versions
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True, default=str).encode()).hexdigest()
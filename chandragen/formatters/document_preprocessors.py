@@ -1,14 +1,22 @@
+from collections.abc import Iterator
+from itertools import islice
+
 from loguru import logger
 
+from chandragen.formatters.frontmatter import FRONTMATTER_FENCE, parse_frontmatter
+from chandragen.formatters.markers import DocumentEdit, DocumentMarker, DocumentView
 from chandragen.formatters.registry import register_preprocessor
-from chandragen.formatters.types import DocumentPreprocessor
+from chandragen.formatters.types import DocumentPreprocessor, MarkerPreprocessor
 from chandragen.formatters.types import FormatterConfig as Config
 
+# frontmatter opens and closes with a line of dashes
+_FRONTMATTER_FENCE = DocumentMarker.startswith(FRONTMATTER_FENCE)
+
 
 # document pre-processors
 # formatters that make changes to the document before running it through the pipeline
 @register_preprocessor
-class StripHeading(DocumentPreprocessor):
+class StripHeading(MarkerPreprocessor):
     def __init__(self):
         super().__init__(
             name="strip_heading",
@@ -21,22 +29,53 @@ class StripHeading(DocumentPreprocessor):
             valid_types=["md", "mdx"],
         )
 
+    # only the lines up to the end of the heading need to be held onto
+    requires_full_document = False
+
     @classmethod
     def create(cls) -> DocumentPreprocessor:
         return cls()
 
-    def apply(self, document: list[str], config: Config) -> list[str]:
+    def plan_edit(self, view: DocumentView, config: Config) -> DocumentEdit | None:
+        if config.heading is None or config.heading_end_pattern is None:
+            logger.warning("Cannot strip heading without defined replacement and ending pattern")
+            return None
+
+        heading_end = view.find(DocumentMarker.exact(config.heading_end_pattern))
+        if heading_end is None:
+            msg = f"heading end pattern {config.heading_end_pattern!r} not found in document"
+            raise ValueError(msg)
+        end = min(max(heading_end + config.heading_strip_offset, 0), len(view))
+        return DocumentEdit(0, end, tuple(config.heading.splitlines(keepends=True)))
+
+    def apply_stream(self, lines: Iterator[str], config: Config) -> Iterator[str]:
         if config.heading is None or config.heading_end_pattern is None:
             logger.warning("Cannot strip heading without defined replacement and ending pattern")
-            return document
-        heading_end = document.index(config.heading_end_pattern) + config.heading_strip_offset
-        del document[0:heading_end]
-        heading = config.heading.splitlines(keepends=True)
-        return heading + document
+            yield from lines
+            return
+
+        heading_lines: list[str] = []
+        for line in lines:
+            heading_lines.append(line)
+            if line == config.heading_end_pattern:
+                break
+        else:
+            msg = f"heading end pattern {config.heading_end_pattern!r} not found in document"
+            raise ValueError(msg)
+
+        heading_end = max(len(heading_lines) - 1 + config.heading_strip_offset, 0)
+        yield from config.heading.splitlines(keepends=True)
+        if heading_end < len(heading_lines):
+            yield from heading_lines[heading_end:]
+        else:
+            # the offset reaches past the end pattern, drop that many more lines from the input
+            for _ in islice(lines, heading_end - len(heading_lines)):
+                pass
+        yield from lines
 
 
 @register_preprocessor
-class StripFooting(DocumentPreprocessor):
+class StripFooting(MarkerPreprocessor):
     def __init__(self):
         super().__init__(
             name="strip_footing",
@@ -53,19 +92,21 @@ class StripFooting(DocumentPreprocessor):
     def create(cls) -> DocumentPreprocessor:
         return cls()
 
-    def apply(self, document: list[str], config: Config) -> list[str]:
+    def plan_edit(self, view: DocumentView, config: Config) -> DocumentEdit | None:
         if config.footing is None or config.footing_start_pattern is None:
             logger.warning("cannot strip footing without defined replacement and starting pattern")
-            return document
-        footer_start = document.index(config.footing_start_pattern) + config.footing_strip_offset
-        del document[footer_start:]
-        footer = config.footing.splitlines(keepends=True)
-        document.extend(footer)
-        return document
+            return None
+
+        footing_start = view.find(DocumentMarker.exact(config.footing_start_pattern))
+        if footing_start is None:
+            msg = f"footing start pattern {config.footing_start_pattern!r} not found in document"
+            raise ValueError(msg)
+        start = max(footing_start + config.footing_strip_offset, 0)
+        return DocumentEdit(start, max(start, len(view)), tuple(config.footing.splitlines(keepends=True)))
 
 
 @register_preprocessor
-class ConvertFrontmatter(DocumentPreprocessor):
+class ConvertFrontmatter(MarkerPreprocessor):
     def __init__(self):
         super().__init__(
             "convert_frontmatter",
@@ -77,50 +118,77 @@ class ConvertFrontmatter(DocumentPreprocessor):
             ["md", "mdx"],
         )
 
+    # the frontmatter sits at the top of the document, everything after it can stream straight through
+    requires_full_document = False
+
     @classmethod
     def create(cls) -> DocumentPreprocessor:
         return cls()
 
-    def apply(self, document: list[str], config: Config) -> list[str]:
-        if not document[0].startswith("---"):
+    @staticmethod
+    def _title_block(frontmatter: dict[str, str]) -> tuple[str, ...]:
+        if "title" not in frontmatter:
+            return ()
+        try:
+            subtitle = frontmatter["description"]
+        except KeyError:
+            subtitle = ""
+        return (
+            f"""
+# {frontmatter["title"]}
+{subtitle}
+{"-" * 20}\n
+""",
+        )
+
+    @staticmethod
+    def _date_block(frontmatter: dict[str, str]) -> tuple[str, ...]:
+        if "date" not in frontmatter:
+            return ()
+        try:
+            by = frontmatter["author"]
+        except KeyError:
+            by = ""
+        return (
+            f"""
+{"-" * 20}
+Written {by} on {frontmatter["date"]}
+            """,
+        )
+
+    def plan_edit(self, view: DocumentView, config: Config) -> DocumentEdit | None:
+        if view.find(_FRONTMATTER_FENCE, 0, 1) is None:
             # This document doesn't have a frontmatter, leave as-is.
-            return document
+            return None
+        closing = view.find(_FRONTMATTER_FENCE, 1)
+        if closing is None:
+            logger.warning("Frontmatter conversion failed!! Frontmatter does not terminate")
+            return None
 
-        frontmatter: dict[str, str] = {}
-        stripped_document: list[str] | None = None
+        frontmatter = parse_frontmatter(view.lines(1, closing))
+        return DocumentEdit(0, closing + 1, self._title_block(frontmatter), self._date_block(frontmatter))
 
-        for index, line in enumerate(document[1:]):
-            if not line.startswith("---"):
-                key, value = line.strip().split(":")
-                frontmatter[key.strip().strip("'").strip('"')] = value.strip().strip("'").strip('"')
-            else:
-                stripped_document = document[2 + index :]
+    def apply_stream(self, lines: Iterator[str], config: Config) -> Iterator[str]:
+        first_line = next(lines, None)
+        if first_line is None:
+            return
+        if not first_line.startswith(FRONTMATTER_FENCE):
+            # This document doesn't have a frontmatter, leave as-is.
+            yield first_line
+            yield from lines
+            return
+
+        frontmatter_lines: list[str] = [first_line]
+        for line in lines:
+            frontmatter_lines.append(line)
+            if line.startswith(FRONTMATTER_FENCE):
                 break
-
-        if stripped_document is None:
+        else:
             logger.warning("Frontmatter conversion failed!! Frontmatter does not terminate")
-            return document
-
-        if "date" in frontmatter:
-            try:
-                by = frontmatter["author"]
-            except KeyError:
-                by = ""
-            stripped_document.append(f"""
-{"-" * 20}
-Written {by} on {frontmatter["date"]}
-            """)
-
-        if "title" in frontmatter:
-            try:
-                subtitle = frontmatter["description"]
-            except KeyError:
-                subtitle = ""
-            header = f"""
-# {frontmatter["title"]}
-{subtitle}
-{"-" * 20}\n
-"""
-            return [header, *stripped_document]
-        return stripped_document
+            yield from frontmatter_lines
+            return
 
+        frontmatter = parse_frontmatter(frontmatter_lines[1:-1])
+        yield from self._title_block(frontmatter)
+        yield from lines
+        yield from self._date_block(frontmatter)
@@ -0,0 +1,61 @@
+from collections.abc import Iterable, Iterator
+from itertools import chain
+from pathlib import Path
+
+"""
+ChandraGen Frontmatter 🏷️
+
+Parses the `key: value` frontmatter block at the top of markdown and mdx documents.
+
+The formatter pipeline captures the frontmatter of every document it formats as the lines stream past,
+so jobs can store a document's title, description, date and author without reading the source a second time.
+"""
+
+# frontmatter opens and closes with a line of dashes
+FRONTMATTER_FENCE = "---"
+# a document opening with a horizontal rule instead of frontmatter stops being searched for a closing fence after this many lines
+MAX_FRONTMATTER_LINES = 256
+
+
+def _unquote(text: str) -> str:
+    return text.strip().strip("'").strip('"')
+
+
+def parse_frontmatter(lines: Iterable[str]) -> dict[str, str]:
+    """Parses the key: value lines between the frontmatter fences. lines without a colon are skipped."""
+    frontmatter: dict[str, str] = {}
+    for line in lines:
+        key, colon, value = line.partition(":")
+        if colon:
+            frontmatter[_unquote(key)] = _unquote(value)
+    return frontmatter
+
+
+def split_frontmatter(lines: Iterator[str]) -> tuple[dict[str, str], Iterator[str]]:
+    """
+    Reads the frontmatter off the top of a stream of lines.
+    Returns the parsed frontmatter, empty if the document doesn't have any,
+    and an iterator over the whole document, frontmatter included, that picks up where the stream left off.
+    """
+    first_line = next(lines, None)
+    if first_line is None:
+        return {}, lines
+    if not first_line.startswith(FRONTMATTER_FENCE):
+        return {}, chain((first_line,), lines)
+
+    head = [first_line]
+    for line in lines:
+        head.append(line)
+        if line.startswith(FRONTMATTER_FENCE):
+            return parse_frontmatter(head[1:-1]), chain(head, lines)
+        if len(head) > MAX_FRONTMATTER_LINES:
+            break
+    # unterminated, this isn't frontmatter
+    return {}, chain(head, lines)
+
+
+def read_frontmatter(path: Path) -> dict[str, str]:
+    """Reads the frontmatter of a document on disk, only reading as far as the closing fence."""
+    with path.open(encoding="utf-8", newline=None) as file:
+        frontmatter, _lines = split_frontmatter(iter(file))
+    return frontmatter
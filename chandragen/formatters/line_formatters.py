@@ -2,7 +2,8 @@ import re
 
 from chandragen.formatters.registry import register_line_formatter
 from chandragen.formatters.types import FormatterFlags as Flags
-from chandragen.formatters.types import LineFormatter
+from chandragen.formatters.types import LineFormatter, Substitution, SubstitutionFormatter
+from chandragen.formatters.utils import transform_joined_lines
 
 
 # Internal line formatters:
@@ -22,15 +23,19 @@ class StripInlineMarkdown(LineFormatter):
             ["md", "mdx"],
         )
 
+    stateless = True
+
+    inline_md_replacements: dict[str, str]
+    inline_md_pattern: re.Pattern[str]
+    inline_md_batch_pattern: re.Pattern[str]
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
 
-    def apply(self, line: str, flags: Flags) -> str:
-        if flags.in_preformat:
-            return line
+    def prepare(self) -> None:
         # set up a regex method to remove inline markdown
-        inline_md_replacements = {
+        self.inline_md_replacements = {
             "*": "",
             "**": "",
             "***": "",
@@ -38,9 +43,29 @@ class StripInlineMarkdown(LineFormatter):
             "__": "",
             "___": "",
         }
-        inline_md_pattern = re.compile("|".join(re.escape(old) for old in inline_md_replacements))
+        self.inline_md_pattern = re.compile("|".join(re.escape(old) for old in self.inline_md_replacements))
+        # batch version of the same pattern, the "keep" group skips over the first two characters of every line
+        self.inline_md_batch_pattern = re.compile(
+            r"(?m)(?P<keep>^[^\n]{0,2})|" + "|".join(re.escape(old) for old in self.inline_md_replacements)
+        )
+
+    def apply(self, line: str, flags: Flags) -> str:
+        if flags.in_preformat:
+            return line
+        replacements = self.inline_md_replacements
         # regex it all out
-        return f"{line[0:2]}{inline_md_pattern.sub(lambda match: inline_md_replacements[match.group(0)], line[2:])}"
+        return f"{line[0:2]}{self.inline_md_pattern.sub(lambda match: replacements[match.group(0)], line[2:])}"
+
+    def apply_many(self, lines: list[str], flags: Flags) -> list[str]:
+        if flags.in_preformat:
+            return lines
+        replacements = self.inline_md_replacements
+
+        def replace(match: re.Match[str]) -> str:
+            keep = match.group("keep")
+            return keep if keep is not None else replacements[match.group(0)]
+
+        return transform_joined_lines(lines, lambda text: self.inline_md_batch_pattern.sub(replace, text))
 
 
 @register_line_formatter
@@ -56,6 +81,8 @@ class StripHTMLComments(LineFormatter):
             ["md", "mdx"],
         )
 
+    stateless = True
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
@@ -80,6 +107,8 @@ class ConvertBulletPointLinks(LineFormatter):
             ["md", "mdx"],
         )
 
+    stateless = True
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
@@ -108,17 +137,21 @@ class ConvertInlineLinks(LineFormatter):
             ["md", "mdx"],
         )
 
+    link_regex: re.Pattern[str]
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
 
+    def prepare(self) -> None:
+        self.link_regex = re.compile(r"\[(?P<label>[^\\]+)\]\((?P<url>[^)]+)\)")
+
     def apply(self, line: str, flags: Flags) -> str:
         if line.startswith("- ["):
             # This is a bullet point link, there's a dedicated formatter for those. leave it alone.
             return line
-        link_regex = re.compile(r"\[(?P<label>[^\\]+)\]\((?P<url>[^)]+)\)")
         matches: list[tuple[str, str, int, int]] = []
-        for match in link_regex.finditer(line):
+        for match in self.link_regex.finditer(line):
             label = match.group("label")
             url = match.group("url")
             start = match.start()
@@ -152,6 +185,8 @@ class NormalizeCodeBlocks(LineFormatter):
             ["md", "mdx"],
         )
 
+    stateless = True
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
@@ -174,6 +209,8 @@ class StripImportsExports(LineFormatter):
             ["mdx"],
         )
 
+    stateless = True
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
@@ -199,6 +236,8 @@ class StripJSXTags(LineFormatter):
             ["mdx"],
         )
 
+    stateless = True
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
@@ -211,7 +250,7 @@ class StripJSXTags(LineFormatter):
 
 
 @register_line_formatter
-class StripJSXExpressions(LineFormatter):
+class StripJSXExpressions(SubstitutionFormatter):
     def __init__(self):
         super().__init__(
             "strip_jsx_expressions",
@@ -225,13 +264,12 @@ class StripJSXExpressions(LineFormatter):
             ["mdx"],
         )
 
+    substitution = Substitution.regex(r"{.*?}", "")
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
 
-    def apply(self, line: str, flags: Flags) -> str:
-        return re.sub(r"{.*?}", "", line)
-
 
 @register_line_formatter
 class ConvertKnownMDXComponents(LineFormatter):
@@ -246,12 +284,29 @@ class ConvertKnownMDXComponents(LineFormatter):
             ["mdx"],
         )
 
+    stateless = True
+    # tags get replaced one after the other, stripping </Note> out of <Warn</Note>ing> leaves a <Warning> to convert.
+    # fusing them into one pass would change that, so this stays an imperative formatter
+    version = 2
+
+    component_map: tuple[tuple[str, str], ...]
+
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
 
+    def prepare(self) -> None:
+        self.component_map = tuple(
+            {"<Note>": "NOTE:", "</Note>": "", "<Warning>": "WARNING:", "</Warning>": ""}.items()
+        )
+
+    def convert(self, text: str) -> str:
+        for jsx, gem in self.component_map:
+            text = text.replace(jsx, gem)
+        return text
+
     def apply(self, line: str, flags: Flags) -> str:
-        component_map = {"<Note>": "NOTE:", "</Note>": "", "<Warning>": "WARNING:", "</Warning>": ""}
-        for jsx, gem in component_map.items():
-            line = line.replace(jsx, gem)
-        return line
+        return self.convert(line)
+
+    def apply_many(self, lines: list[str], flags: Flags) -> list[str]:
+        return transform_joined_lines(lines, self.convert)
@@ -0,0 +1,235 @@
+import json
+import sys
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from loguru import logger
+
+import chandragen
+import chandragen.plugins
+from chandragen.formatters.registry import FORMATTER_REGISTRY, import_builtin_formatters, import_formatter_module
+from chandragen.formatters.types import DocumentPreprocessor, LineFormatter, MultilineFormatter
+from chandragen.formatters.writer import write_document
+from chandragen.plugins import external_plugin_files, import_all_plugins
+
+"""
+ChandraGen Formatter Manifest 📇
+
+A generated index of every available formatter: its name, kind, priority, description and the module it lives in.
+It's built by importing every formatter module once, then cached as JSON in the cache directory,
+so listing formatters doesn't need to import any of them, and pipelines only import the modules they actually use.
+It also records which modules register Peridot substitution handlers, so Peridot only imports the plugins defining one.
+When no system config is loaded, eg. chandragen used as a library through format_text, the manifest is built in-process
+and never written anywhere, so formatting in memory doesn't need a .env or touch the filesystem.
+
+The manifest records the size and mtime of every formatter and plugin source file,
+and gets rebuilt whenever any of them change, or plugins are added or removed.
+"""
+
+MANIFEST_FILENAME = "formatter_manifest.json"
+
+
+@dataclass(frozen=True)
+class FormatterManifestEntry:
+    """
+    Everything about a formatter that can be known without importing it.
+
+    attributes:
+        name: the formatter name
+        kind: line, multiline or preprocessor
+        priority: the formatter priority
+        version: the formatter version
+        description: the formatter description
+        valid_types: the file types the formatter supports
+        module: name of the module the formatter is defined in
+        path: source file of the module, for plugins loaded from the external plugins directory. None for importable modules.
+        start_pattern: the start regex of a multiline formatter
+        end_pattern: the end regex of a multiline formatter
+    """
+
+    name: str
+    kind: str
+    priority: int
+    version: int
+    description: str
+    valid_types: list[str]
+    module: str
+    path: str | None = None
+    start_pattern: str | None = None
+    end_pattern: str | None = None
+
+
+@dataclass(frozen=True)
+class HandlerManifestEntry:
+    """
+    A Peridot substitution handler, and the module registering it.
+
+    attributes:
+        name: the handler name
+        module: name of the module the handler is defined in
+        path: source file of the module, for plugins loaded from the external plugins directory. None for importable modules.
+    """
+
+    name: str
+    module: str
+    path: str | None = None
+
+
+@dataclass
+class FormatterManifest:
+    """
+    The generated index of available formatters.
+
+    attributes:
+        chandragen_version: the chandragen version that built the manifest
+        sources: [mtime_ns, size] of every formatter and plugin source file, by path
+        entries: every registered formatter, in registration order
+        handlers: every substitution handler registered by importing the formatter modules and plugins
+    """
+
+    chandragen_version: str
+    sources: dict[str, list[int]]
+    entries: list[FormatterManifestEntry] = field(default_factory=list[FormatterManifestEntry])
+    handlers: list[HandlerManifestEntry] = field(default_factory=list[HandlerManifestEntry])
+
+    def find(self, name: str) -> list[FormatterManifestEntry]:
+        """Returns every formatter registered under a name, there can be one per kind."""
+        return [entry for entry in self.entries if entry.name == name]
+
+    def by_kind(self, kind: str) -> list[FormatterManifestEntry]:
+        """Returns the formatters of one kind in priority order, the same order the dispatch table uses."""
+        return sorted((entry for entry in self.entries if entry.kind == kind), key=lambda entry: entry.priority)
+
+    def names(self) -> set[str]:
+        return {entry.name for entry in self.entries}
+
+    def is_current(self) -> bool:
+        """Checks whether the manifest still describes the formatter and plugin sources on disk."""
+        return self.chandragen_version == chandragen.__version__ and self.sources == formatter_sources()
+
+
+def formatter_sources() -> dict[str, list[int]]:
+    """Stats every source file formatters can come from: the builtin formatter modules, and bundled and external plugins."""
+    paths = [
+        *Path(__file__).parent.glob("*.py"),
+        *Path(chandragen.plugins.__file__ or "").parent.glob("*.py"),
+        *external_plugin_files(),
+    ]
+    sources: dict[str, list[int]] = {}
+    for path in sorted(paths):
+        stat = path.stat()
+        sources[str(path)] = [stat.st_mtime_ns, stat.st_size]
+    return sources
+
+
+def _plugin_path(module_name: str) -> str | None:
+    """The source file of a module, if it's an external plugin. those can only be imported from their path."""
+    module_file = getattr(sys.modules.get(module_name), "__file__", None)
+    return module_file if module_file is not None and Path(module_file) in external_plugin_files() else None
+
+
+def _entry(kind: str, formatter: LineFormatter | MultilineFormatter | DocumentPreprocessor) -> FormatterManifestEntry:
+    module_name = type(formatter).__module__
+    multiline = isinstance(formatter, MultilineFormatter)
+    return FormatterManifestEntry(
+        name=formatter.name,
+        kind=kind,
+        priority=formatter.priority,
+        version=formatter.version,
+        description=formatter.description,
+        valid_types=list(formatter.valid_types),
+        module=module_name,
+        path=_plugin_path(module_name),
+        start_pattern=formatter.start_pattern if multiline else None,
+        end_pattern=formatter.end_pattern if multiline else None,
+    )
+
+
+def build_manifest() -> FormatterManifest:
+    """Imports every formatter module and plugin, and indexes the formatters and substitution handlers they register."""
+    from chandragen.peridot.registry import BUILTIN_HANDLER_MODULE, HANDLER_REGISTRY  # noqa: PLC0415
+
+    sources = formatter_sources()
+    import_all_plugins()
+    import_builtin_formatters()
+
+    manifest = FormatterManifest(chandragen.__version__, sources)
+    manifest.entries += [_entry("line", formatter) for formatter in FORMATTER_REGISTRY.line.values()]
+    manifest.entries += [_entry("multiline", formatter) for formatter in FORMATTER_REGISTRY.multiline.values()]
+    manifest.entries += [_entry("preprocessor", formatter) for formatter in FORMATTER_REGISTRY.preprocessor.values()]
+    for handler in HANDLER_REGISTRY.values():
+        module_name = type(handler).__module__
+        # the builtin handlers are always imported by Peridot itself, and only registered here if it was already in use
+        if module_name == BUILTIN_HANDLER_MODULE:
+            continue
+        manifest.handlers.append(HandlerManifestEntry(handler.name, module_name, _plugin_path(module_name)))
+    return manifest
+
+
+def manifest_path() -> Path | None:
+    """Where the manifest is cached, None when no system config is loaded."""
+    config = chandragen.loaded_system_config()
+    return None if config is None else config.cache_dir / MANIFEST_FILENAME
+
+
+def save_manifest(manifest: FormatterManifest, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_document(path, [json.dumps(asdict(manifest), indent=2)])
+
+
+def read_manifest(path: Path) -> FormatterManifest | None:
+    """Reads a cached manifest, returning None if there isn't one or it can't be parsed."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        entries = [FormatterManifestEntry(**entry) for entry in data.pop("entries")]
+        handlers = [HandlerManifestEntry(**entry) for entry in data.pop("handlers")]
+        return FormatterManifest(**data, entries=entries, handlers=handlers)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError, KeyError) as e:
+        logger.debug(f"ignoring unreadable formatter manifest {path}: {e}")
+        return None
+
+
+# The manifest is loaded at most once per process
+_manifest: FormatterManifest | None = None
+
+
+def get_manifest() -> FormatterManifest:
+    """
+    Returns the formatter manifest, reading it from the cache directory if it's current,
+    or rebuilding (and caching) it if it's missing or stale. without a system config it's always built in-process.
+    """
+    global _manifest  # noqa: PLW0603
+    if _manifest is not None:
+        return _manifest
+
+    path = manifest_path()
+    if path is None:
+        _manifest = build_manifest()
+        return _manifest
+    manifest = read_manifest(path)
+    if manifest is None or not manifest.is_current():
+        logger.debug("formatter manifest is missing or stale, rebuilding it")
+        manifest = build_manifest()
+        try:
+            save_manifest(manifest, path)
+        except OSError as e:
+            logger.warning(f"could not cache the formatter manifest at {path}: {e}")
+    _manifest = manifest
+    return manifest
+
+
+def load_formatters(names: Iterable[str]) -> None:
+    """Imports only the modules providing the named formatters. unknown names are left for the pipeline to report."""
+    manifest = get_manifest()
+    for name in names:
+        for entry in manifest.find(name):
+            import_formatter_module(entry.module, entry.path)
+
+
+def load_handler_modules() -> None:
+    """Imports the formatter and plugin modules that register Peridot substitution handlers."""
+    for entry in get_manifest().handlers:
+        import_formatter_module(entry.module, entry.path)
@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from itertools import islice
+
+"""
+ChandraGen Document Markers 🔖
+
+Building blocks for marker pre-processors: pre-processors that find a few marker lines in a document
+(a heading end, frontmatter fences, a footing start...) and replace or append whole runs of lines around them.
+
+Each edit is planned against a DocumentView, which tracks edits as a chain of segments instead of copying lines around,
+so a whole run of marker pre-processors only has to build the output document once.
+"""
+
+
+@dataclass(frozen=True)
+class DocumentMarker:
+    """
+    A line a marker pre-processor looks for in a document.
+
+    attributes:
+        line: matches lines equal to it, line ending included. exact markers are searched for at C speed with list.index.
+        prefix: matches lines starting with it
+        pattern: regex matching at the start of the line
+
+    Use DocumentMarker.exact, DocumentMarker.startswith or DocumentMarker.regex to build one.
+    """
+
+    line: str | None = None
+    prefix: str | None = None
+    pattern: str | None = None
+
+    @classmethod
+    def exact(cls, line: str) -> DocumentMarker:
+        return cls(line=line)
+
+    @classmethod
+    def startswith(cls, prefix: str) -> DocumentMarker:
+        return cls(prefix=prefix)
+
+    @classmethod
+    def regex(cls, pattern: str) -> DocumentMarker:
+        return cls(pattern=pattern)
+
+    def matches(self, line: str) -> bool:
+        if self.line is not None:
+            return line == self.line
+        if self.prefix is not None:
+            return line.startswith(self.prefix)
+        return self.pattern is not None and re.match(self.pattern, line) is not None
+
+    def search(self, lines: list[str] | tuple[str, ...], start: int, end: int) -> int | None:
+        """Returns the index of the first line in lines[start:end] the marker matches, or None if there isn't one."""
+        if self.line is not None:
+            try:
+                return lines.index(self.line, start, end)
+            except ValueError:
+                return None
+        for index in range(start, min(end, len(lines))):
+            if self.matches(lines[index]):
+                return index
+        return None
+
+
+@dataclass(frozen=True)
+class DocumentEdit:
+    """
+    A change a marker pre-processor makes to a document: a range of lines replaced, and lines added to the end.
+
+    attributes:
+        start: index of the first line replaced
+        end: index of the line after the last one replaced. start == end inserts lines without removing any.
+        replacement: the lines put in place of the range
+        appended: lines added after the last line of the document
+    """
+
+    start: int
+    end: int
+    replacement: tuple[str, ...] = ()
+    appended: tuple[str, ...] = ()
+
+
+# a run of lines of the original document, or lines inserted by an edit
+Segment = range | tuple[str, ...]
+
+
+class DocumentView:
+    """
+    A document with marker pre-processor edits applied to it lazily.
+
+    The view is a chain of segments, each either a range of lines of the original document or a tuple of lines an edit inserted.
+    Edits only rearrange segments and marker searches run straight over the original list,
+    so no matter how many edits are made the document is only copied once, when build is called.
+    Indexes passed to and returned by the view are always positions in the edited document.
+    """
+
+    def __init__(self, document: list[str]):
+        self.document = document
+        self.segments: list[Segment] = [range(len(document))] if document else []
+
+    def __len__(self) -> int:
+        return sum(len(segment) for segment in self.segments)
+
+    def find(self, marker: DocumentMarker, start: int = 0, end: int | None = None) -> int | None:
+        """Returns the index of the first line from start up to (but not including) end that the marker matches, or None."""
+        offset = 0
+        for segment in self.segments:
+            size = len(segment)
+            if end is not None and offset >= end:
+                break
+            if start < offset + size:
+                low = max(start - offset, 0)
+                high = size if end is None else min(end - offset, size)
+                if isinstance(segment, range):
+                    index = marker.search(self.document, segment.start + low, segment.start + high)
+                    if index is not None:
+                        return offset + index - segment.start
+                else:
+                    index = marker.search(segment, low, high)
+                    if index is not None:
+                        return offset + index
+            offset += size
+        return None
+
+    def lines(self, start: int, end: int) -> list[str]:
+        """Returns a copy of the lines from start up to (but not including) end."""
+        result: list[str] = []
+        offset = 0
+        for segment in self.segments:
+            if offset >= end:
+                break
+            size = len(segment)
+            low = max(start - offset, 0)
+            high = min(end - offset, size)
+            if low < high:
+                if isinstance(segment, range):
+                    result += self.document[segment.start + low : segment.start + high]
+                else:
+                    result += segment[low:high]
+            offset += size
+        return result
+
+    def apply(self, edit: DocumentEdit) -> None:
+        """Applies an edit to the view."""
+        segments: list[Segment] = []
+        offset = 0
+        inserted = False
+        for segment in self.segments:
+            size = len(segment)
+            segments.append(segment[: max(edit.start - offset, 0)])
+            if not inserted and edit.start <= offset + size:
+                segments.append(edit.replacement)
+                inserted = True
+            segments.append(segment[max(edit.end - offset, 0) :])
+            offset += size
+        if not inserted:
+            segments.append(edit.replacement)
+        segments.append(edit.appended)
+        self.segments = [segment for segment in segments if segment]
+
+    def build(self) -> list[str]:
+        """Builds the edited document. Returns the original list untouched if no edit changed anything."""
+        if len(self.segments) == 1 and self.segments[0] == range(len(self.document)):
+            return self.document
+        result: list[str] = []
+        for segment in self.segments:
+            if isinstance(segment, range):
+                result += islice(self.document, segment.start, segment.stop)
+            else:
+                result += segment
+        return result
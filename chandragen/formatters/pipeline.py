@@ -0,0 +1,371 @@
+from __future__ import annotations
+
+import re
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field, replace
+
+from loguru import logger
+
+from chandragen.formatters.manifest import load_formatters
+from chandragen.formatters.markers import DocumentView
+from chandragen.formatters.registry import FORMATTER_REGISTRY
+from chandragen.formatters.types import (
+    DispatchTable,
+    DocumentPreprocessor,
+    FormatterConfig,
+    FormatterFlags,
+    LineFormatter,
+    MarkerPreprocessor,
+    MultilineFormatter,
+    Substitution,
+)
+from chandragen.formatters.utils import transform_joined_lines
+
+LineApply = Callable[[str, FormatterFlags], str]
+LineBatchApply = Callable[[list[str], FormatterFlags], list[str]]
+PreprocessorApply = Callable[[list[str], FormatterConfig], list[str]]
+PreprocessorStream = Callable[[Iterator[str], FormatterConfig], Iterator[str]]
+
+
+@dataclass(frozen=True)
+class MultilineMatcher:
+    """A multiline formatter bundled with its precompiled start and end patterns."""
+
+    formatter: MultilineFormatter
+    start: re.Pattern[str]
+    end: re.Pattern[str]
+
+
+@dataclass(frozen=True)
+class FusedSubstitution:
+    """
+    Adjacent literal substitution formatters merged into one combined matcher, so they cost a single pass per line.
+    Each substitution becomes a named group of one alternation.
+    Formatters are only fused when that provably gives the same output as running them in order, see _can_fuse.
+    """
+
+    names: tuple[str, ...]
+    substitutions: tuple[Substitution, ...]
+    pattern: re.Pattern[str]
+
+    def replace(self, match: re.Match[str]) -> str:
+        # group names are "s<index into substitutions>", see _fuse_substitutions
+        return self.substitutions[int(str(match.lastgroup)[1:])].replace(match)
+
+    def substitute(self, text: str) -> str:
+        return self.pattern.sub(self.replace, text)
+
+    def apply(self, line: str, flags: FormatterFlags) -> str:
+        return self.substitute(line)
+
+    def apply_many(self, lines: list[str], flags: FormatterFlags) -> list[str]:
+        return transform_joined_lines(lines, self.substitute)
+
+
+@dataclass(frozen=True)
+class FusedPreprocessor:
+    """
+    Adjacent marker pre-processors run as a single stage.
+    Every member plans its edit against the same DocumentView in pipeline order, so each one sees exactly the document
+    it would have seen running on its own, and the output document is only built once, after the last edit.
+    """
+
+    names: tuple[str, ...]
+    preprocessors: tuple[MarkerPreprocessor, ...]
+
+    def apply(self, document: list[str], config: FormatterConfig) -> list[str]:
+        view = DocumentView(document)
+        for preprocessor in self.preprocessors:
+            edit = preprocessor.plan_edit(view, config)
+            if edit is not None:
+                view.apply(edit)
+        return view.build()
+
+
+@dataclass(frozen=True)
+class PipelinePlan:
+    """
+    A compiled formatting pipeline for a single list of enabled formatters.
+
+    Resolving formatter names against the dispatch table only happens once, when the plan is built.
+    Within each kind, formatters run in priority order, formatters sharing a priority run in the order they were enabled.
+    The document formatter then walks these tuples directly instead of hitting the registry for every line.
+
+    attributes:
+        key: the enabled formatter names the plan was compiled from
+        preprocessors: bound apply methods of the enabled document pre-processors, in pipeline order.
+            adjacent marker pre-processors are fused into a single FusedPreprocessor stage.
+        preprocessor_streams: bound apply_stream methods of the same pre-processors
+        buffers_document: whether any enabled pre-processor needs the full document, forcing streams to buffer it
+        line_formatters: bound apply methods of the enabled line formatters, in pipeline order.
+            adjacent literal substitutions are fused into a single FusedSubstitution stage, when that can't change the output.
+        line_batches: bound apply_many methods of the same line formatter stages
+        batches_lines: whether every line formatter is stateless, so lines can go through apply_many in batches.
+            stateful formatters like convert_inline_links run a line at a time, interleaved with routing,
+            since what they buffer has to be flushed at the first line that comes out blank.
+        multiline_formatters: the enabled multiline formatters with their compiled patterns, in pipeline order
+        multiline_start: the multiline start patterns merged into one alternation of named groups,
+            or None if there are no multiline formatters or the patterns can't be merged
+        multiline_unmerged: indexes of the multiline formatters whose start patterns were left out of multiline_start
+        unknown: enabled names that didn't resolve to any registered formatter
+        formatter_versions: (name, version) of every resolved formatter, in pipeline order. used to fingerprint renders.
+        table: the dispatch table the plan was compiled against
+    """
+
+    key: tuple[str, ...]
+    preprocessors: tuple[PreprocessorApply, ...]
+    preprocessor_streams: tuple[PreprocessorStream, ...]
+    buffers_document: bool
+    line_formatters: tuple[LineApply, ...]
+    line_batches: tuple[LineBatchApply, ...]
+    batches_lines: bool
+    multiline_formatters: tuple[MultilineMatcher, ...]
+    multiline_start: re.Pattern[str] | None
+    multiline_unmerged: tuple[int, ...]
+    unknown: tuple[str, ...]
+    formatter_versions: tuple[tuple[str, int], ...]
+    table: DispatchTable = field(repr=False)
+
+    def match_multiline_start(self, line: str) -> MultilineMatcher | None:
+        """Finds the first multiline formatter, in pipeline order, whose start pattern matches the line."""
+        if self.multiline_start is None:
+            # the patterns couldn't be merged, so check them one by one
+            for matcher in self.multiline_formatters:
+                if matcher.start.match(line):
+                    return matcher
+            return None
+
+        match = self.multiline_start.match(line)
+        # group names are "m<index into multiline_formatters>", see _merge_start_patterns
+        found = None if match is None or match.lastgroup is None else int(match.lastgroup[1:])
+        # patterns left out of the merge still win when they come earlier in the pipeline
+        for index in self.multiline_unmerged:
+            if found is not None and index > found:
+                break
+            if self.multiline_formatters[index].start.match(line):
+                return self.multiline_formatters[index]
+        return None if found is None else self.multiline_formatters[found]
+
+
+# a numeric backreference, \1, or a conditional on a numbered group, (?(1)...)
+_NUMBERED_REFERENCE = re.compile(r"\\[1-9]|\(\?\(\d")
+
+
+def _merge_start_patterns(matchers: tuple[MultilineMatcher, ...]) -> tuple[re.Pattern[str] | None, tuple[int, ...]]:
+    """
+    Merges multiline start patterns into a single alternation, so one scan per line picks the formatter.
+    Alternatives are tried left to right, which keeps the first-match-wins order of the pipeline.
+
+    Wrapping a pattern in a group renumbers the groups inside it, so patterns referring to their groups by number
+    are left out of the merge and matched on their own.
+    Returns the merged pattern and the indexes of the patterns left out. the pattern is None when there's nothing
+    to merge, or when the patterns can't live inside one regex (eg. clashing group names or inline global flags),
+    in which case they're all matched one at a time.
+    """
+    mergeable = [
+        index for index, matcher in enumerate(matchers) if not _NUMBERED_REFERENCE.search(matcher.start.pattern)
+    ]
+    unmerged = tuple(index for index in range(len(matchers)) if index not in mergeable)
+    if not mergeable:
+        return None, unmerged
+    alternation = "|".join(f"(?P<m{index}>{matchers[index].start.pattern})" for index in mergeable)
+    try:
+        return re.compile(alternation), unmerged
+    except re.error as e:
+        logger.debug(f"could not merge multiline start patterns, matching them individually: {e}")
+        return None, unmerged
+
+
+def _fuse_substitutions(formatters: list[LineFormatter]) -> FusedSubstitution | None:
+    """Merges the substitutions of several literal formatters into one alternation, or returns None if they can't share a regex."""
+    substitutions = tuple(formatter.substitution for formatter in formatters if formatter.substitution is not None)
+    alternation = "|".join(f"(?P<s{index}>{substitution.pattern})" for index, substitution in enumerate(substitutions))
+    try:
+        pattern = re.compile(alternation)
+    except re.error as e:
+        logger.debug(f"could not fuse substitutions of {[formatter.name for formatter in formatters]}: {e}")
+        return None
+    return FusedSubstitution(tuple(formatter.name for formatter in formatters), substitutions, pattern)
+
+
+def _overlaps(first: str, second: str) -> bool:
+    """Checks whether two strings can share text: one holding the other, or one ending with the start of the other."""
+    if first in second or second in first:
+        return True
+    return any(first.endswith(second[:size]) or second.endswith(first[:size]) for size in range(1, len(second)))
+
+
+def _can_fuse(group: list[LineFormatter], substitution: Substitution) -> bool:
+    """
+    Checks that a substitution can join a fused group with the same result as running after each of its members.
+    Only literal substitutions are fused, and only when that's provably the same:
+    - none of its keys overlap a key of an earlier member, so a single leftmost-match scan finds every match each
+      member would have found on its own
+    - none of its keys overlap text an earlier member inserts, so it can't match inside or across that text
+    - no earlier member replaces a key with nothing, which could join the text around it into a new match
+    """
+    if substitution.mapping is None:
+        return False
+    for formatter in group:
+        earlier = formatter.substitution
+        if earlier is None or earlier.mapping is None:
+            return False
+        for key in substitution.mapping:
+            if any(_overlaps(key, other) for other in earlier.mapping):
+                return False
+            if any(not inserted or _overlaps(key, inserted) for inserted in earlier.mapping.values()):
+                return False
+    return True
+
+
+def _line_stages(formatters: list[LineFormatter], fuse: bool = True) -> list[tuple[LineApply, LineBatchApply]]:
+    """Turns the enabled line formatters into (apply, apply_many) stages, fusing runs of adjacent literal substitutions."""
+    stages: list[tuple[LineApply, LineBatchApply]] = []
+    group: list[LineFormatter] = []
+
+    def close_group() -> None:
+        fused = _fuse_substitutions(group) if fuse and len(group) > 1 else None
+        if fused is not None:
+            logger.debug(f"fused substitutions of {', '.join(fused.names)} into a single pass")
+            stages.append((fused.apply, fused.apply_many))
+        else:
+            stages.extend((formatter.apply, formatter.apply_many) for formatter in group)
+        group.clear()
+
+    for formatter in formatters:
+        if formatter.substitution is None:
+            close_group()
+            stages.append((formatter.apply, formatter.apply_many))
+            continue
+        if group and not _can_fuse(group, formatter.substitution):
+            close_group()
+        group.append(formatter)
+    close_group()
+    return stages
+
+
+def _priority(formatter: LineFormatter | MultilineFormatter | DocumentPreprocessor) -> int:
+    return formatter.priority
+
+
+def _preprocessor_stages(preprocessors: list[DocumentPreprocessor], fuse: bool = True) -> list[PreprocessorApply]:
+    """Turns the enabled pre-processors into apply stages, fusing runs of adjacent marker pre-processors."""
+    stages: list[PreprocessorApply] = []
+    group: list[MarkerPreprocessor] = []
+
+    def close_group() -> None:
+        if fuse and len(group) > 1:
+            fused = FusedPreprocessor(tuple(preprocessor.name for preprocessor in group), tuple(group))
+            logger.debug(f"fused pre-processors {', '.join(fused.names)} into a single pass")
+            stages.append(fused.apply)
+        else:
+            stages.extend(preprocessor.apply for preprocessor in group)
+        group.clear()
+
+    for preprocessor in preprocessors:
+        if isinstance(preprocessor, MarkerPreprocessor):
+            group.append(preprocessor)
+        else:
+            close_group()
+            stages.append(preprocessor.apply)
+    close_group()
+    return stages
+
+
+# Plans are cached per process, so every worker compiles a given pipeline at most once.
+_PIPELINE_CACHE: dict[tuple[str, ...], PipelinePlan] = {}
+
+
+def compile_pipeline(
+    enabled_formatters: tuple[str, ...], table: DispatchTable | None = None, fuse: bool = True
+) -> PipelinePlan:
+    """
+    Resolves a list of formatter names against the dispatch table and builds a pipeline plan from them.
+    When no table is given, the modules providing the formatters get loaded and the registry's current table is used.
+    fuse=False keeps every formatter in a stage of its own.
+    """
+    if table is None:
+        load_formatters(enabled_formatters)
+        table = FORMATTER_REGISTRY.freeze()
+    preprocessors: list[DocumentPreprocessor] = []
+    line_formatters: list[LineFormatter] = []
+    multiline_formatters: list[MultilineFormatter] = []
+    unknown: list[str] = []
+
+    for name in enabled_formatters:
+        found = False
+        if name in table.preprocessor:
+            preprocessors.append(table.preprocessor[name])
+            found = True
+        if name in table.line:
+            line_formatters.append(table.line[name])
+            found = True
+        if name in table.multiline:
+            multiline_formatters.append(table.multiline[name])
+            found = True
+        if not found:
+            unknown.append(name)
+
+    # sorts are stable, so formatters sharing a priority keep the order they were enabled in
+    preprocessors.sort(key=_priority)
+    line_formatters.sort(key=_priority)
+    multiline_formatters.sort(key=_priority)
+
+    for formatter in (*preprocessors, *line_formatters, *multiline_formatters):
+        formatter.prepare()
+
+    if unknown:
+        logger.warning(f"Formatters not found while compiling pipeline: {', '.join(unknown)}")
+
+    multiline_matchers = tuple(
+        MultilineMatcher(formatter, re.compile(formatter.start_pattern), re.compile(formatter.end_pattern))
+        for formatter in multiline_formatters
+    )
+
+    line_stages = _line_stages(line_formatters, fuse)
+    multiline_start, multiline_unmerged = _merge_start_patterns(multiline_matchers)
+
+    return PipelinePlan(
+        key=enabled_formatters,
+        preprocessors=tuple(_preprocessor_stages(preprocessors, fuse)),
+        preprocessor_streams=tuple(preprocessor.apply_stream for preprocessor in preprocessors),
+        buffers_document=any(preprocessor.requires_full_document for preprocessor in preprocessors),
+        line_formatters=tuple(apply for apply, _apply_many in line_stages),
+        line_batches=tuple(apply_many for _apply, apply_many in line_stages),
+        batches_lines=all(formatter.stateless for formatter in line_formatters),
+        multiline_formatters=multiline_matchers,
+        multiline_start=multiline_start,
+        multiline_unmerged=multiline_unmerged,
+        unknown=tuple(unknown),
+        formatter_versions=tuple(
+            (formatter.name, formatter.version)
+            for formatter in (*preprocessors, *line_formatters, *multiline_formatters)
+        ),
+        table=table,
+    )
+
+
+def get_pipeline(config: FormatterConfig) -> PipelinePlan:
+    """
+    Returns the cached pipeline plan for a config's enabled formatters, compiling it on first use.
+    Only the modules providing the enabled formatters get imported.
+    """
+    key = tuple(config.enabled_formatters)
+    plan = _PIPELINE_CACHE.get(key)
+    # plans compiled before another formatter module got loaded (thawing the registry) are stale
+    if plan is None or plan.table is not FORMATTER_REGISTRY.table:
+        logger.debug(f"compiling formatter pipeline {key}")
+        load_formatters(key)
+        plan = compile_pipeline(key, FORMATTER_REGISTRY.freeze())
+        _PIPELINE_CACHE[key] = plan
+    return plan
+
+
+def reference_pipeline(enabled_formatters: tuple[str, ...]) -> PipelinePlan:
+    """
+    Compiles a plan without fusion or batching, running every formatter on its own, a line at a time.
+    Those optimizations must never change the output, so this is what the regular plan gets verified against.
+    Never cached, it's only meant for checks.
+    """
+    load_formatters(enabled_formatters)
+    return replace(compile_pipeline(enabled_formatters, FORMATTER_REGISTRY.freeze(), fuse=False), batches_lines=False)
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass, field, replace
+from time import perf_counter
+from typing import Any
+
+from chandragen.formatters.pipeline import (
+    LineApply,
+    LineBatchApply,
+    PipelinePlan,
+    PreprocessorApply,
+    PreprocessorStream,
+)
+from chandragen.formatters.types import FormatterConfig, FormatterFlags
+
+
+@dataclass
+class FormatterTiming:
+    """
+    Cumulative measurements for a single formatter (or fused group of line formatters).
+
+    attributes:
+        name: the formatter name
+        kind: line, multiline or preprocessor
+        calls: how many times the formatter was invoked. batched line formatter calls count once per batch.
+        seconds: total time spent inside the formatter, not counting time spent in earlier pipeline stages
+        lines_in: how many lines were handed to the formatter
+        lines_out: how many lines the formatter returned
+        lines_changed: how many lines a line formatter returned modified. always 0 for other kinds.
+    """
+
+    name: str
+    kind: str
+    calls: int = 0
+    seconds: float = 0.0
+    lines_in: int = 0
+    lines_out: int = 0
+    lines_changed: int = 0
+
+    def merge(self, other: FormatterTiming) -> None:
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.lines_in += other.lines_in
+        self.lines_out += other.lines_out
+        self.lines_changed += other.lines_changed
+
+
+@dataclass
+class FormatterProfile:
+    """
+    Per-formatter timings collected while formatting one or more documents.
+    Passing a profile to DocumentFormatter swaps in instrumented copies of the pipeline callables,
+    without one the pipeline runs exactly as it would otherwise, so profiling costs nothing when it's off.
+    """
+
+    timings: dict[str, FormatterTiming] = field(default_factory=dict[str, FormatterTiming])
+
+    def timing(self, name: str, kind: str) -> FormatterTiming:
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = FormatterTiming(name, kind)
+        return timing
+
+    def merge(self, other: FormatterProfile) -> None:
+        for timing in other.timings.values():
+            self.timing(timing.name, timing.kind).merge(timing)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"formatter_timings": [asdict(timing) for timing in self.timings.values()]}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> FormatterProfile:
+        profile = cls()
+        for timing in data.get("formatter_timings", []):
+            profile.timings[timing["name"]] = FormatterTiming(**timing)
+        return profile
+
+    def render(self) -> str:
+        """Renders the profile as a plain text table, slowest formatters first."""
+        header = f"{'formatter':<40} {'kind':<12} {'seconds':>10} {'calls':>10} {'lines in':>10} {'changed':>10}"
+        rows = [
+            f"{timing.name:<40} {timing.kind:<12} {timing.seconds:>10.4f} {timing.calls:>10,} "
+            f"{timing.lines_in:>10,} {timing.lines_changed:>10,}"
+            for timing in sorted(self.timings.values(), key=lambda timing: timing.seconds, reverse=True)
+        ]
+        return "\n".join([header, *rows])
+
+    def instrument(self, plan: PipelinePlan) -> PipelinePlan:
+        """Returns a copy of a pipeline plan whose callables record their timings into this profile."""
+        return replace(
+            plan,
+            preprocessors=tuple(self._wrap_preprocessor(apply) for apply in plan.preprocessors),
+            preprocessor_streams=tuple(self._wrap_stream(apply_stream) for apply_stream in plan.preprocessor_streams),
+            line_formatters=tuple(self._wrap_line(apply) for apply in plan.line_formatters),
+            line_batches=tuple(self._wrap_batch(apply_many) for apply_many in plan.line_batches),
+        )
+
+    def record_multiline(self, name: str, seconds: float, lines_in: int, lines_out: int) -> None:
+        timing = self.timing(name, "multiline")
+        timing.calls += 1
+        timing.seconds += seconds
+        timing.lines_in += lines_in
+        timing.lines_out += lines_out
+
+    def _wrap_line(self, apply: LineApply) -> LineApply:
+        timing = self.timing(_stage_name(apply), "line")
+
+        def timed(line: str, flags: FormatterFlags) -> str:
+            start = perf_counter()
+            result = apply(line, flags)
+            timing.seconds += perf_counter() - start
+            timing.calls += 1
+            timing.lines_in += 1
+            timing.lines_out += 1
+            timing.lines_changed += result != line
+            return result
+
+        return timed
+
+    def _wrap_batch(self, apply_many: LineBatchApply) -> LineBatchApply:
+        timing = self.timing(_stage_name(apply_many), "line")
+
+        def timed(lines: list[str], flags: FormatterFlags) -> list[str]:
+            start = perf_counter()
+            result = apply_many(lines, flags)
+            timing.seconds += perf_counter() - start
+            timing.calls += 1
+            timing.lines_in += len(lines)
+            timing.lines_out += len(result)
+            timing.lines_changed += sum(old != new for old, new in zip(lines, result, strict=False))
+            return result
+
+        return timed
+
+    def _wrap_preprocessor(self, apply: PreprocessorApply) -> PreprocessorApply:
+        timing = self.timing(_stage_name(apply), "preprocessor")
+
+        def timed(document: list[str], config: FormatterConfig) -> list[str]:
+            lines_in = len(document)
+            start = perf_counter()
+            result = apply(document, config)
+            timing.seconds += perf_counter() - start
+            timing.calls += 1
+            timing.lines_in += lines_in
+            timing.lines_out += len(result)
+            return result
+
+        return timed
+
+    def _wrap_stream(self, apply_stream: PreprocessorStream) -> PreprocessorStream:
+        timing = self.timing(_stage_name(apply_stream), "preprocessor")
+
+        def timed(lines: Iterator[str], config: FormatterConfig) -> Iterator[str]:
+            upstream = _TimedIterator(lines)
+            stream = apply_stream(upstream, config)
+            timing.calls += 1
+            while True:
+                upstream_seconds = upstream.seconds
+                start = perf_counter()
+                line = next(stream, None)
+                # leave out the time spent pulling lines from earlier stages, those get their own timings
+                timing.seconds += perf_counter() - start - (upstream.seconds - upstream_seconds)
+                if line is None:
+                    break
+                timing.lines_out += 1
+                yield line
+            timing.lines_in += upstream.count
+
+        return timed
+
+
+class _TimedIterator:
+    """Wraps an iterator, counting the items pulled from it and the time spent producing them."""
+
+    def __init__(self, iterator: Iterator[str]):
+        self.iterator = iterator
+        self.count = 0
+        self.seconds = 0.0
+
+    def __iter__(self) -> _TimedIterator:
+        return self
+
+    def __next__(self) -> str:
+        start = perf_counter()
+        try:
+            item = next(self.iterator)
+        finally:
+            self.seconds += perf_counter() - start
+        self.count += 1
+        return item
+
+
+def _stage_name(stage: Any) -> str:
+    """Names a pipeline callable after the formatter it's bound to, or the formatters a fused stage was built from."""
+    owner = getattr(stage, "__self__", None)
+    names = getattr(owner, "names", None)
+    if names is not None:
+        return "+".join(names)
+    return getattr(owner, "name", getattr(stage, "__qualname__", repr(stage)))
@@ -0,0 +1,102 @@
+import mmap
+from collections.abc import Generator, Iterable
+from contextlib import contextmanager
+
+from loguru import logger
+
+from chandragen.formatters.types import FormatterConfig
+
+# Files at least this big get memory-mapped when the input mode is "auto"
+MMAP_THRESHOLD_BYTES = 64 * 1024 * 1024
+# How much of a mapped file gets decoded at once
+MMAP_SPAN_BYTES = 1024 * 1024
+
+INPUT_MODES = ("auto", "stream", "mmap")
+
+
+def iter_mapped_lines(mapped: mmap.mmap, encoding: str = "utf-8") -> Generator[str]:
+    """
+    Yields the lines of a memory-mapped file, decoding it lazily one span of whole lines at a time.
+    Spans are decoded straight from a memoryview of the mapping, and pages that have been read are handed back to the OS,
+    so memory use stays flat no matter how big the file is. "\r\n" and "\r" line endings are normalized to "\n",
+    matching what text-mode files hand out.
+
+    Args:
+        mapped: the mapping to read lines from
+        encoding: text encoding of the file
+    """
+    size = len(mapped)
+    if hasattr(mapped, "madvise"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    view = memoryview(mapped)
+    try:
+        start = 0
+        released = 0
+        while start < size:
+            # spans always end right after a newline, so they never split a character or a "\r\n" pair
+            end = mapped.rfind(b"\n", start, start + MMAP_SPAN_BYTES) + 1
+            if end == 0:
+                end = mapped.find(b"\n", start + MMAP_SPAN_BYTES) + 1 or size
+            text = str(view[start:end], encoding)
+            if "\r" in text:
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+            lines = text.split("\n")
+            last = lines.pop()
+            for line in lines:
+                yield f"{line}\n"
+            if last:
+                yield last
+            start = end
+
+            # let go of the pages we're done with, madvise needs page-aligned ranges
+            done = start - start % mmap.PAGESIZE
+            if done > released and hasattr(mmap, "MADV_DONTNEED"):
+                mapped.madvise(mmap.MADV_DONTNEED, released, done - released)
+                released = done
+    finally:
+        view.release()
+
+
+@contextmanager
+def open_document(config: FormatterConfig) -> Generator[Iterable[str]]:
+    """
+    Opens the config's input document as an iterable of lines, for DocumentFormatter.stream_document.
+
+    config.input_mode picks how the file gets read:
+        stream: a regular text-mode file, read through a buffer
+        mmap: memory-map the file, and decode lines lazily from the mapping. keeps peak memory flat for huge inputs.
+        auto: mmap for files of at least MMAP_THRESHOLD_BYTES, stream for everything else.
+
+    Args:
+        config: formatter config with an input path set
+
+    Raises:
+        ValueError: if the input path is missing or the input mode is unknown
+    """
+    path = config.input_path
+    if path is None:
+        msg = "input path not specified"
+        raise ValueError(msg)
+    mode = config.input_mode
+    if mode not in INPUT_MODES:
+        msg = f"unknown input mode {mode!r}, expected one of {', '.join(INPUT_MODES)}"
+        raise ValueError(msg)
+
+    size = path.stat().st_size
+    if mode == "auto":
+        mode = "mmap" if size >= MMAP_THRESHOLD_BYTES else "stream"
+    # empty files can't be mapped, and there's nothing to save on them anyway
+    if mode == "stream" or size == 0:
+        with path.open(encoding="utf-8") as source:
+            yield source
+        return
+
+    logger.debug(f"memory-mapping {size} byte input {path}")
+    with path.open("rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        lines = iter_mapped_lines(mapped)
+        try:
+            yield lines
+        finally:
+            # drop the generator's memoryview before the mapping gets closed
+            lines.close()
+
@@ -1,53 +1,59 @@
 import importlib
 import pkgutil
-from typing import Any
+from pathlib import Path
 
-
-from chandragen.formatters import __path__
 from chandragen.formatters.types import (
     DocumentPreprocessor,
+    FormatterKind,
     FormatterRegistry,
     LineFormatter,
     MultilineFormatter,
 )
+from chandragen.plugins import import_external_plugin
 
 Formatter = type[LineFormatter | DocumentPreprocessor | MultilineFormatter]
 
 
+BUILTIN_FORMATTER_PACKAGE = "chandragen.formatters"
+
+
+def builtin_formatter_modules() -> list[str]:
+    """Names of every module in the builtin formatter package."""
+    package_path = Path(__file__).parent
+    return [f"{BUILTIN_FORMATTER_PACKAGE}.{modname}" for _finder, modname, _ispkg in pkgutil.iter_modules([str(package_path)])]
+
+
 def import_builtin_formatters() -> None:
     """Uses importlib to locate and import all formatter modules"""
-    for _finder, modname, _ispkg in pkgutil.iter_modules(__path__):
-        full_name = f"{__name__}.{modname}"
-        importlib.import_module(full_name)
+    for module_name in builtin_formatter_modules():
+        importlib.import_module(module_name)
+
+
+def import_formatter_module(module_name: str, path: str | None = None) -> None:
+    """
+    Imports the module a formatter is defined in, registering its formatters.
+    Modules from the external plugins directory aren't importable by name, so they're loaded from their path.
+    """
+    if path is None:
+        importlib.import_module(module_name)
+        return
+    import_external_plugin(Path(path))
 
 
 FORMATTER_REGISTRY: FormatterRegistry = FormatterRegistry()
 
 
-def register_formatter(registry_dict: dict[str, Any]):
-    """decorate that adds a formatter to the registry at import time"""
+def register_formatter(kind: FormatterKind):
+    """decorator that adds a formatter to the registry at import time. registration only appends, sorting waits for the freeze."""
 
     def decorator(cls: Formatter):
-        instance = cls.create()
-        registry_dict[instance.name] = instance
-        # Automatically sort by priority after adding
-        sort_registry_by_priority(registry_dict)
+        FORMATTER_REGISTRY.register(kind, cls.create())
         return cls
 
     return decorator
 
 
 # Decorators for each type
-register_line_formatter = register_formatter(FORMATTER_REGISTRY.line)
-register_multiline_formatter = register_formatter(FORMATTER_REGISTRY.multiline)
-register_preprocessor = register_formatter(FORMATTER_REGISTRY.preprocessor)
-
-
-def sort_registry_by_priority(registry_dict: dict[str, Any]) -> None:
-    """Uses the formatter priority value to sort the registry"""
-    # Create a sorted list of tuples from the dictionary items sorted by priority
-    sorted_items = sorted(registry_dict.items(), key=lambda item: item[1].priority)
-
-    # Clear the dictionary and reload it in sorted order
-    registry_dict.clear()
-    registry_dict.update(sorted_items)
+register_line_formatter = register_formatter("line")
+register_multiline_formatter = register_formatter("multiline")
+register_preprocessor = register_formatter("preprocessor")
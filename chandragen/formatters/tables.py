@@ -0,0 +1,256 @@
+import re
+import unicodedata
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from functools import cache
+
+"""
+ChandraGen Table Engine 📐
+
+Parses markdown tables with any number of columns, and renders them as unicode box-drawing tables
+that fit a given number of text columns.
+
+Widths are measured in terminal cells rather than characters, so CJK text and emoji
+(which take up two cells) and combining marks (which take up none) line up correctly.
+Everything runs in a single pass over the rows, so huge tables render in linear time.
+"""
+
+# splits a table row on pipes, leaving escaped "\|" pipes inside cells alone
+_CELL_SPLIT = re.compile(r"(?<!\\)\|")
+_SEPARATOR_CELL = re.compile(r"^:?-+:?$")
+
+
+@cache
+def char_width(char: str) -> int:
+    """Returns how many terminal cells a character takes up: 0 for combining and zero-width marks, 2 for wide ones."""
+    # combining marks, zero width joiners, variation selectors and emoji skin tones don't take up any space of their own
+    if unicodedata.category(char) in {"Mn", "Me", "Cf"} or "\U0001f3fb" <= char <= "\U0001f3ff":
+        return 0
+    if unicodedata.east_asian_width(char) in {"W", "F"}:
+        return 2
+    return 1
+
+
+def text_width(text: str) -> int:
+    """Returns the display width of a string in terminal cells."""
+    if text.isascii():
+        return len(text)
+    width = 0
+    joined = False
+    for char in text:
+        # characters glued on with a zero width joiner render as part of the emoji before them
+        if not joined:
+            width += char_width(char)
+        joined = char == "\u200d"
+    return width
+
+
+def wrap_text(text: str, width: int) -> list[str]:
+    """
+    Greedily word-wraps text so no line is wider than width cells.
+    Words wider than a whole line get split between characters. Always returns at least one line.
+    """
+    lines: list[str] = []
+    current: list[str] = []
+    current_width = 0
+    for word in text.split():
+        word_width = text_width(word)
+        if word_width > width:
+            # flush what we have, then break the word up on its own
+            if current:
+                lines.append(" ".join(current))
+                current, current_width = [], 0
+            chunk: list[str] = []
+            chunk_width = 0
+            for char in word:
+                w = char_width(char)
+                if chunk_width + w > width and chunk:
+                    lines.append("".join(chunk))
+                    chunk, chunk_width = [], 0
+                chunk.append(char)
+                chunk_width += w
+            current, current_width = ["".join(chunk)], chunk_width
+            continue
+        needed = word_width if not current else current_width + 1 + word_width
+        if needed > width:
+            lines.append(" ".join(current))
+            current, current_width = [word], word_width
+        else:
+            current.append(word)
+            current_width = needed
+    if current or not lines:
+        lines.append(" ".join(current))
+    return lines
+
+
+@dataclass
+class Table:
+    """
+    A parsed table.
+
+    attributes:
+        header: the cells of the header row
+        alignments: per column alignment, "left", "right" or "center"
+        rows: the cells of every body row. rows may have fewer cells than there are columns.
+    """
+
+    header: list[str]
+    alignments: list[str]
+    rows: list[list[str]]
+
+    @property
+    def column_count(self) -> int:
+        return max(len(self.header), *(len(row) for row in self.rows)) if self.rows else len(self.header)
+
+
+def parse_row(line: str) -> list[str]:
+    """Splits a markdown table row into its stripped cells."""
+    line = line.strip()
+    line = line.removeprefix("|")
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in _CELL_SPLIT.split(line)]
+
+
+def _alignment(cell: str) -> str:
+    if cell.startswith(":") and cell.endswith(":"):
+        return "center"
+    if cell.endswith(":"):
+        return "right"
+    return "left"
+
+
+def parse_table(lines: Iterable[str]) -> Table:
+    """
+    Parses the lines of a markdown table. The first row is the header,
+    a separator row of dashes sets the column alignments and is otherwise dropped.
+    """
+    header: list[str] | None = None
+    alignments: list[str] = []
+    rows: list[list[str]] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        cells = parse_row(line)
+        if header is None:
+            header = cells
+        elif not alignments and not rows and all(_SEPARATOR_CELL.match(cell) for cell in cells):
+            alignments = [_alignment(cell) for cell in cells]
+        else:
+            rows.append(cells)
+    return Table(header or [], alignments, rows)
+
+
+def column_widths(natural: list[int], available: int) -> list[int]:
+    """
+    Shares the available text columns out between table columns.
+    Columns that fit within an even share keep their natural width, the rest split whatever's left evenly.
+    Leftover space goes to the last column, so the table always fills the available width.
+    """
+    count = len(natural)
+    widths = [0] * count
+    remaining = list(range(count))
+    budget = available
+    while remaining:
+        share = budget // len(remaining)
+        fitting = [index for index in remaining if natural[index] <= share]
+        if not fitting:
+            extra = budget % len(remaining)
+            for position, index in enumerate(remaining):
+                # two cells is the least that still fits any single character, wide ones included
+                widths[index] = max(share + (position < extra), 2)
+            return widths
+        for index in fitting:
+            widths[index] = natural[index]
+            budget -= natural[index]
+        remaining = [index for index in remaining if natural[index] > share]
+    widths[-1] += max(budget, 0)
+    return widths
+
+
+def _pad(text: str, width: int, alignment: str) -> str:
+    padding = width - text_width(text)
+    if padding <= 0:
+        return text
+    if alignment == "right":
+        return " " * padding + text
+    if alignment == "center":
+        left = padding // 2
+        return " " * left + text + " " * (padding - left)
+    return text + " " * padding
+
+
+def _render_row(cells: list[str], widths: list[int], alignments: list[str]) -> Iterator[str]:
+    wrapped = [wrap_text(cell, width) for cell, width in zip(cells, widths, strict=True)]
+    height = max(len(lines) for lines in wrapped)
+    for line_index in range(height):
+        parts = ["│"]
+        for lines, width, alignment in zip(wrapped, widths, alignments, strict=True):
+            parts.append(" ")
+            parts.append(_pad(lines[line_index] if line_index < len(lines) else "", width, alignment))
+            parts.append(" │")
+        parts.append("\n")
+        yield "".join(parts)
+
+
+def render_rows(rows: Iterable[list[str]], widths: list[int], alignments: list[str]) -> Iterator[str]:
+    """
+    Renders body rows with fixed column widths, with a blank spacer line after each row for readability.
+    Rows are rendered one at a time, so this also works on rows streamed from elsewhere.
+    """
+    count = len(widths)
+    spacer = "".join(["│", *(f"{' ' * (width + 2)}│" for width in widths), "\n"])
+    for row in rows:
+        cells = row[:count] + [""] * (count - len(row))
+        yield from _render_row(cells, widths, alignments)
+        yield spacer
+
+
+def border(widths: list[int], left: str, middle: str, right: str) -> str:
+    """Draws a horizontal border line, eg. border(widths, "┌", "┬", "┐") for the top of the table."""
+    return f"{left}{middle.join('─' * (width + 2) for width in widths)}{right}\n"
+
+
+def measure_columns(natural: list[int], rows: Iterable[list[str]]) -> list[int]:
+    """
+    Widens natural column widths in place so every cell in rows fits, and returns them.
+    Only keeps one width per column, so it measures streamed rows in constant memory. cells past the last column are ignored.
+    """
+    count = len(natural)
+    for row in rows:
+        for index, cell in enumerate(row[:count]):
+            natural[index] = max(natural[index], text_width(cell))
+    return natural
+
+
+def stream_table(
+    header: list[str], alignments: list[str], natural: list[int], rows: Iterable[list[str]], total_width: int
+) -> Iterator[str]:
+    """
+    Lazily renders a table line by line, so rows can be streamed in from elsewhere without holding the table in memory.
+    Column widths are shared out from the natural widths up front, cells that turn out wider than their column get wrapped.
+    """
+    count = len(header)
+    # every column takes up 3 cells of borders and padding, plus the closing border
+    widths = column_widths(natural, total_width - 3 * count - 1)
+    yield "```\n"
+    yield border(widths, "┌", "┬", "┐")
+    yield from _render_row(header, widths, alignments)
+    yield border(widths, "├", "┼", "┤")
+    yield from render_rows(rows, widths, alignments)
+    yield border(widths, "└", "┴", "┘")
+    yield "```\n"
+
+
+def render_table(table: Table, total_width: int) -> list[str]:
+    """
+    Renders a table as a preformatted gemtext block of unicode box-drawing lines,
+    at most total_width cells wide unless there are too many columns to fit even two cells each.
+    """
+    count = table.column_count
+    if count == 0:
+        return []
+    header = table.header + [""] * (count - len(table.header))
+    alignments = table.alignments[:count] + ["left"] * (count - len(table.alignments))
+    natural = measure_columns([max(text_width(cell), 1) for cell in header], table.rows)
+    return list(stream_table(header, alignments, natural, table.rows, total_width))
@@ -1,8 +1,15 @@
 from __future__ import annotations
 
+import re
 from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator, Mapping
 from dataclasses import dataclass, field
 from pathlib import Path
+from types import MappingProxyType
+from typing import Literal
+
+from chandragen.formatters.markers import DocumentEdit, DocumentView
+from chandragen.formatters.utils import transform_joined_lines
 
 
 @dataclass
@@ -34,12 +41,25 @@ class LineFormatter(ABC):
         Description: multi-line string that will be presented to the end user when they query the formatter metadata.
         valid_types: list of mimetypes supported by the formatter module. currently unimplemented.
         priority: defines the order formatters will be run in. see documentation for what values mean.
+        stateless: class-level flag, True if apply only looks at the line and in_preformat, and never touches the flags.
+            lets the pipeline batch lines across paragraph breaks. formatters that buffer lines (eg. for the next empty line) must leave it False.
+        substitution: class-level Substitution declaring the formatter's whole transformation, or None for imperative formatters.
+            adjacent literal substitutions that can't interact get fused by the pipeline into a single pass per line. see SubstitutionFormatter.
+        version: class-level integer, bump it whenever a change to the formatter changes its output.
+            it's part of the pipeline fingerprint, so bumping it invalidates cached renders.
 
     Methods:
         create: class method that generates the formatter instance
+        prepare: called once whenever a pipeline using the formatter is compiled. precompiled regexes and lookup tables should be built here.
         apply: runs the formatter logic. called when the formatter is invoked, must take the line, config, and flags then return the formatted line.
+        apply_many: batch version of apply, called with runs of consecutive lines outside of preformatted and multiline blocks.
+            must return exactly one line per input line. falls back to calling apply on each line unless overridden.
     """
 
+    stateless: bool = False
+    substitution: Substitution | None = None
+    version: int = 1
+
     def __init__(self, name: str, description: str, valid_types: list[str], priority: int = 255):
         self.name: str = name
         self.description: str = description
@@ -51,10 +71,80 @@ class LineFormatter(ABC):
     def create(cls) -> LineFormatter:
         pass
 
+    def prepare(self) -> None:
+        """Build any per-pipeline state (compiled patterns, lookup tables) once instead of on every apply call."""
+        return
+
     @abstractmethod
     def apply(self, line: str, flags: FormatterFlags) -> str:
         pass
 
+    def apply_many(self, lines: list[str], flags: FormatterFlags) -> list[str]:
+        return [self.apply(line, flags) for line in lines]
+
+
+@dataclass(frozen=True)
+class Substitution:
+    """
+    Declarative description of a pure text substitution, for line formatters that don't need any custom logic.
+
+    attributes:
+        pattern: regex matching the text to replace. must not match across lines, or depend on where the line starts.
+        replacement: literal text every match gets replaced with
+        mapping: for literal substitutions, maps each matched string to its replacement. replacement is ignored when set.
+
+    Use Substitution.literal or Substitution.regex to build one.
+    """
+
+    pattern: str
+    replacement: str = ""
+    mapping: dict[str, str] | None = None
+
+    @classmethod
+    def literal(cls, mapping: dict[str, str]) -> Substitution:
+        """Replaces every occurrence of each key in the mapping with its value, longest keys first."""
+        keys = sorted(mapping, key=len, reverse=True)
+        return cls(pattern="|".join(re.escape(key) for key in keys), mapping=dict(mapping))
+
+    @classmethod
+    def regex(cls, pattern: str, replacement: str = "") -> Substitution:
+        """Replaces every match of the pattern with the literal replacement text."""
+        return cls(pattern=pattern, replacement=replacement)
+
+    def replace(self, match: re.Match[str]) -> str:
+        """Returns the replacement text for a match of the pattern."""
+        if self.mapping is not None:
+            return self.mapping[match.group(0)]
+        return self.replacement
+
+
+class SubstitutionFormatter(LineFormatter):
+    """
+    Line formatter whose transformation is fully described by its substitution class attribute.
+    apply and apply_many are provided, subclasses only need to set substitution and implement create.
+    subclasses overriding prepare must call super().prepare().
+    """
+
+    stateless = True
+    substitution_pattern: re.Pattern[str]
+    substitution_replace: Callable[[re.Match[str]], str]
+
+    def prepare(self) -> None:
+        if self.substitution is None:
+            msg = f"{self.name} is a SubstitutionFormatter without a substitution"
+            raise TypeError(msg)
+        self.substitution_pattern = re.compile(self.substitution.pattern)
+        self.substitution_replace = self.substitution.replace
+
+    def substitute(self, text: str) -> str:
+        return self.substitution_pattern.sub(self.substitution_replace, text)
+
+    def apply(self, line: str, flags: FormatterFlags) -> str:
+        return self.substitute(line)
+
+    def apply_many(self, lines: list[str], flags: FormatterFlags) -> list[str]:
+        return transform_joined_lines(lines, self.substitute)
+
 
 class MultilineFormatter(ABC):
     """
@@ -67,12 +157,16 @@ class MultilineFormatter(ABC):
         start_pattern: regex used to match the beginning of a multiline object
         end_pattern: regex used to match the end of a multiline object
         priority: defines the order formatters will be run in. see documentation for what values mean.
+        version: class-level integer, bump it whenever a change to the formatter changes its output.
 
     Methods:
         create: class method that generates the formatter instance
+        prepare: called once whenever a pipeline using the formatter is compiled. precompiled regexes and lookup tables should be built here.
         apply: runs the formatter logic. called when the formatter is invoked, must take the set of lines, config, and flags then return the formatted set of lines.
     """
 
+    version: int = 1
+
     def __init__(
         self,
         name: str,
@@ -94,6 +188,10 @@ class MultilineFormatter(ABC):
     def create(cls) -> MultilineFormatter:
         pass
 
+    def prepare(self) -> None:
+        """Build any per-pipeline state (compiled patterns, lookup tables) once instead of on every apply call."""
+        return
+
     @abstractmethod
     def apply(self, buffer: list[str], config: FormatterConfig, flags: FormatterFlags) -> list[str]:
         pass
@@ -108,12 +206,21 @@ class DocumentPreprocessor(ABC):
         Description: multi-line string that will be presented to the end user when they query the formatter metadata.
         valid_types: list of mimetypes supported by the formatter module. currently unimplemented.
         priority: defines the order formatters will be run in. see documentation for what values mean.
+        requires_full_document: class-level flag, True if the pre-processor can only work on the whole document at once.
+            streaming pipelines buffer the entire input when any enabled pre-processor sets this.
+        version: class-level integer, bump it whenever a change to the formatter changes its output.
 
     Methods:
         create: class method that generates the formatter instance
+        prepare: called once whenever a pipeline using the formatter is compiled. precompiled regexes and lookup tables should be built here.
         apply: runs the formatter logic. called when the formatter is invoked, must take the document and config, then return the formatted document.
+        apply_stream: streaming version of apply, takes an iterator of lines and yields the processed lines.
+            pre-processors that set requires_full_document to False must override it.
     """
 
+    requires_full_document: bool = True
+    version: int = 1
+
     def __init__(self, name: str, description: str, valid_types: list[str], priority: int = 255):
         self.name: str = name
         self.description: str = description
@@ -125,10 +232,67 @@ class DocumentPreprocessor(ABC):
     def create(cls) -> DocumentPreprocessor:
         pass
 
+    def prepare(self) -> None:
+        """Build any per-pipeline state (compiled patterns, lookup tables) once instead of on every apply call."""
+        return
+
     @abstractmethod
     def apply(self, document: list[str], config: FormatterConfig) -> list[str]:
         pass
 
+    def apply_stream(self, lines: Iterator[str], config: FormatterConfig) -> Iterator[str]:
+        # By default the whole document gets collected and handed to apply
+        yield from self.apply(list(lines), config)
+
+
+class MarkerPreprocessor(DocumentPreprocessor):
+    """
+    Pre-processor that finds its place in the document by searching for marker lines, and describes its change as a DocumentEdit.
+    apply is provided, subclasses implement plan_edit and create, and must not override apply.
+
+    Adjacent marker pre-processors in a pipeline are fused into a single stage that plans every edit against one shared DocumentView,
+    so however many of them are enabled the document only gets copied once.
+    """
+
+    @abstractmethod
+    def plan_edit(self, view: DocumentView, config: FormatterConfig) -> DocumentEdit | None:
+        """Searches the view for the pre-processor's markers, and returns the edit to make or None to leave the document as-is."""
+
+    def apply(self, document: list[str], config: FormatterConfig) -> list[str]:
+        view = DocumentView(document)
+        edit = self.plan_edit(view, config)
+        if edit is None:
+            return document
+        view.apply(edit)
+        return view.build()
+
+
+FormatterKind = Literal["line", "multiline", "preprocessor"]
+
+
+def _sorted_by_priority[F: LineFormatter | MultilineFormatter | DocumentPreprocessor](
+    formatters: dict[str, F],
+) -> Mapping[str, F]:
+    # sorted is stable, so formatters sharing a priority stay in registration order
+    return MappingProxyType(dict(sorted(formatters.items(), key=lambda item: item[1].priority)))
+
+
+@dataclass(frozen=True, eq=False)
+class DispatchTable:
+    """
+    Immutable snapshot of the formatter registry, built once after every formatter module has been imported.
+    Each mapping is sorted by priority, formatters that share a priority keep their registration order.
+
+    attributes:
+        line: read-only mapping of line-formatters
+        multiline: read-only mapping of multiline formatters
+        preprocessor: read-only mapping of document pre-processors
+    """
+
+    line: Mapping[str, LineFormatter]
+    multiline: Mapping[str, MultilineFormatter]
+    preprocessor: Mapping[str, DocumentPreprocessor]
+
 
 @dataclass
 class FormatterRegistry:
@@ -136,15 +300,36 @@ class FormatterRegistry:
     Object used to house the registry of formatter modules
     This method of storing the registry allows you to use dot notation to pull out the desired types of formatters, eg registry.line[name]
 
+    Registering a formatter only ever adds it to its dict. Once everything has been imported the registry gets frozen
+    into a priority-sorted DispatchTable, which is what pipelines are compiled from.
+
     attributes:
-        line: the registry of line-formatters
-        multiline: the registry of multiline formatters
-        preprocessor: the registry of document pre-processors
+        line: the registry of line-formatters, in registration order
+        multiline: the registry of multiline formatters, in registration order
+        preprocessor: the registry of document pre-processors, in registration order
+        table: the dispatch table built by the last freeze, or None if the registry changed since
     """
 
     line: dict[str, LineFormatter] = field(default_factory=dict[str, LineFormatter])
     multiline: dict[str, MultilineFormatter] = field(default_factory=dict[str, MultilineFormatter])
     preprocessor: dict[str, DocumentPreprocessor] = field(default_factory=dict[str, DocumentPreprocessor])
+    table: DispatchTable | None = None
+
+    def register(self, kind: FormatterKind, formatter: LineFormatter | MultilineFormatter | DocumentPreprocessor) -> None:
+        """Adds a formatter to the registry. Registering after a freeze thaws the registry, the next freeze picks the formatter up."""
+        registry: dict[str, LineFormatter | MultilineFormatter | DocumentPreprocessor] = getattr(self, kind)
+        registry[formatter.name] = formatter
+        self.table = None
+
+    def freeze(self) -> DispatchTable:
+        """Returns the priority-sorted dispatch table, only sorting the registry if it changed since the last freeze."""
+        if self.table is None:
+            self.table = DispatchTable(
+                line=_sorted_by_priority(self.line),
+                multiline=_sorted_by_priority(self.multiline),
+                preprocessor=_sorted_by_priority(self.preprocessor),
+            )
+        return self.table
 
 
 @dataclass
@@ -163,11 +348,15 @@ class FormatterConfig:
         footing section is largely the same
 
         input_path: file to pull the source document from
+        input_mode: how the source document is read. "stream" reads it through a regular file buffer,
+            "mmap" memory-maps it and decodes lines lazily, "auto" maps only large files.
         output_path: file to push the results to
 
         preformatted_unicode_columns: number of text colums preformatted text blocks should take up
+        max_multiline_buffer_lines: how many lines a multiline block may buffer before it's treated as unterminated
 
         enabled_formatters: list of module names to use during formatting
+        peridot: render Peridot substitutions in the formatted document, see chandragen.peridot
 
     """
 
@@ -183,8 +372,11 @@ class FormatterConfig:
     footing_strip_offset: int = 0
 
     input_path: Path | None = None
+    input_mode: str = "auto"
     output_path: Path | None = None
 
     preformatted_unicode_columns: int = 80
+    max_multiline_buffer_lines: int = 100_000
 
     enabled_formatters: list[str] = field(default_factory=list[str])
+    peridot: bool = False
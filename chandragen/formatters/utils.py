@@ -0,0 +1,28 @@
+from collections.abc import Callable
+
+
+def transform_joined_lines(lines: list[str], transform: Callable[[str], str]) -> list[str]:
+    """
+    Runs a text transform once over a run of lines joined into a single string, then splits the result back into lines.
+
+    Only valid for transforms that never match, add or remove newlines, like most single-line regex substitutions.
+    Falls back to transforming line by line if a line carries embedded newlines, or the transform broke the line count.
+
+    Args:
+        lines: the lines to transform
+        transform: function taking a string and returning the transformed string
+
+    Returns:
+        the transformed lines, one per input line
+    """
+    if not lines:
+        return []
+    line_ends = [line.endswith("\n") for line in lines]
+    text = "\n".join([line[:-1] if ends else line for line, ends in zip(lines, line_ends, strict=True)])
+    if text.count("\n") == len(lines) - 1:
+        transformed = transform(text).split("\n")
+        if len(transformed) == len(lines):
+            return [
+                f"{line}\n" if ends else line for line, ends in zip(transformed, line_ends, strict=True)
+            ]
+    return [transform(line) for line in lines]
@@ -0,0 +1,129 @@
+import hashlib
+import os
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+from uuid import uuid4
+
+from loguru import logger
+
+# how much of an existing file gets copied into a new one at a time
+COPY_CHUNK_SIZE = 1 << 16
+
+
+@dataclass(frozen=True)
+class WriteResult:
+    """
+    Describes what happened when a document was written out.
+
+    attributes:
+        path: the file the document was written to
+        changed: False if the file already held identical content and was left untouched
+        bytes_written: how many bytes actually hit the output file, 0 when the write was skipped
+        bytes_skipped: how many bytes didn't need to be written because the existing file was identical
+        digest: sha256 hex digest of the document's contents
+    """
+
+    path: Path
+    changed: bool
+    bytes_written: int
+    bytes_skipped: int
+    digest: str
+
+    @property
+    def size(self) -> int:
+        return self.bytes_written + self.bytes_skipped
+
+
+def _open_existing(path: Path) -> BinaryIO | None:
+    try:
+        return path.open("rb")
+    except FileNotFoundError:
+        return None
+
+
+def _start_temp_file(path: Path, existing: BinaryIO | None, matched: int) -> tuple[Path, BinaryIO]:
+    """
+    Creates the temporary file a changed document gets written to, next to the target,
+    starting it with the first `matched` bytes of the existing file, the part of the document that was identical.
+    """
+    temp_path = path.with_name(f".{path.name}.{uuid4().hex[:8]}.tmp")
+    # os.open applies the umask the same way a plain open(path, "w") would
+    temp_file = os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), "wb")
+    try:
+        if existing is not None:
+            existing.seek(0)
+            while matched > 0:
+                chunk = existing.read(min(matched, COPY_CHUNK_SIZE))
+                temp_file.write(chunk)
+                matched -= len(chunk)
+    except BaseException:
+        temp_file.close()
+        temp_path.unlink(missing_ok=True)
+        raise
+    return temp_path, temp_file
+
+
+def write_document(path: Path, lines: Iterable[str], encoding: str = "utf-8") -> WriteResult:
+    """
+    Writes a document atomically, leaving the existing file alone if it already holds the same content.
+
+    The lines are hashed and compared against the existing file as they stream in, and nothing is written while they match.
+    At the first difference the identical part is copied into a temporary file next to the target and the rest streams
+    into it, which is then synced to disk and renamed into place,
+    so readers (and killed workers, or a crash) only ever see the old file or the complete new one.
+    Identical output never touches the disk, so the target keeps its mtime.
+
+    Args:
+        path: the file to write
+        lines: the lines of the document, eg. a stream from DocumentFormatter.stream_document
+        encoding: text encoding for the output file
+
+    Returns:
+        a WriteResult describing the write
+    """
+    digest = hashlib.sha256()
+    size = 0
+    existing = _open_existing(path)
+    temp_path: Path | None = None
+    temp_file: BinaryIO | None = None
+    try:
+        for line in lines:
+            data = line.encode(encoding)
+            digest.update(data)
+            if temp_file is None and existing is not None and existing.read(len(data)) == data:
+                size += len(data)
+                continue
+            if temp_file is None:
+                temp_path, temp_file = _start_temp_file(path, existing, size)
+            temp_file.write(data)
+            size += len(data)
+
+        hexdigest = digest.hexdigest()
+        # everything matched, but there's no file yet or the existing one goes on for longer
+        if temp_file is None and (existing is None or existing.read(1)):
+            temp_path, temp_file = _start_temp_file(path, existing, size)
+        if temp_path is None or temp_file is None:
+            logger.debug(f"{path} is unchanged, skipped writing {size} bytes")
+            return WriteResult(path, changed=False, bytes_written=0, bytes_skipped=size, digest=hexdigest)
+
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+        temp_file.close()
+        if existing is not None:
+            # keep the permissions of the file being replaced
+            temp_path.chmod(os.fstat(existing.fileno()).st_mode & 0o7777)
+        temp_path.replace(path)
+    except BaseException:
+        if temp_file is not None:
+            temp_file.close()
+        if temp_path is not None:
+            temp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        if existing is not None:
+            existing.close()
+
+    logger.debug(f"wrote {size} bytes to {path}")
+    return WriteResult(path, changed=True, bytes_written=size, bytes_skipped=0, digest=hexdigest)
@@ -8,8 +8,15 @@ from uuid import UUID, uuid4, uuid1
 
 from loguru import logger
 
-from chandragen import system_config
+import chandragen
 from chandragen.db.controllers.job_queue import JobQueueController
+from chandragen.db.notify import JobWaiter
+
+# how long an idle worker waits before checking the queue again. it doubles on every miss up to the max, as a fallback
+# for lost notifications, and the max is much lower when the database can't notify workers at all.
+POLL_INTERVAL_MIN = 0.05
+POLL_INTERVAL_MAX = 30.0
+POLL_INTERVAL_MAX_UNNOTIFIED = 2.0
 
 
 class WorkerShutdownError(Exception):
@@ -24,7 +31,8 @@ class WorkerShutdownError(Exception):
 class WorkerProcess(Process):
     """Worker Process
 
-    A process that periodically checks the job queue and claims a job if available.
+    A process that claims jobs from the job queue while there are any, and otherwise sleeps
+    until it's notified that more were queued, polling with exponential backoff as a fallback.
     Runs the claimed job using the appropriate runner. Designed for high concurrency
     situations, handling small units of work alongside many other workers.
     """
@@ -47,6 +55,7 @@ class WorkerProcess(Process):
 
     def setup(self):
         self.running = True
+        self.waiter = JobWaiter(self.id.hex)
         self._ipc_thread = threading.Thread(name=f"worker_{self.id}_ipc", target=self.handle_ipc, daemon=True)
         self._ipc_thread.start()
         logger.debug(f"Starting worker process {self.id}!")
@@ -69,6 +78,7 @@ class WorkerProcess(Process):
 
     def cleanup(self):
         logger.debug(f"worker {str(self.id)[:6]} is shutting down")
+        self.waiter.close()
 
     def handle_ipc(self):
         while self.running:
@@ -98,6 +108,7 @@ class WorkerProcess(Process):
 
     def run(self):
         self.setup()
+        interval = POLL_INTERVAL_MIN
         while self.running:
             job = self.job_queue_db.claim_next_pending_job(self.id)
             if job:
@@ -106,14 +117,19 @@ class WorkerProcess(Process):
                 self.current_job = job_id
                 self.run_job(job)
                 self.current_job = None
+                interval = POLL_INTERVAL_MIN
+            elif self.waiter.wait(interval):
+                # woken up by a notification (or a stop), so there's probably a job waiting right now
+                interval = POLL_INTERVAL_MIN
             else:
-                # queue miss means we can just go ahead and sleep for a second.
-                # logger.debug(f"worker process {self.id} missed queue, resting for a sec")
-                sleep(0.5)
+                # queue miss and nothing was queued meanwhile, back off further
+                max_interval = POLL_INTERVAL_MAX if self.waiter.listening else POLL_INTERVAL_MAX_UNNOTIFIED
+                interval = min(interval * 2, max_interval)
         self.cleanup()
 
     def stop(self):
         self.running = False
+        self.waiter.wake()
 
 
 class ProcessPooler(Thread):
@@ -125,9 +141,9 @@ class ProcessPooler(Thread):
         from chandragen.jobs.runners import RUNNER_REGISTRY
 
         self.runners = RUNNER_REGISTRY
-        self.min_workers = system_config.minimum_workers_per_pool
-        self.max_workers = system_config.max_workers_per_pool
-        self.check_interval = system_config.tick_rate
+        self.min_workers = chandragen.system_config.minimum_workers_per_pool
+        self.max_workers = chandragen.system_config.max_workers_per_pool
+        self.check_interval = chandragen.system_config.tick_rate
         self.job_queue_db = JobQueueController()
 
         self.workers: dict[UUID, tuple[Process, Connection]] = {}
@@ -138,7 +154,7 @@ class ProcessPooler(Thread):
         for _ in range(self.min_workers):
             self.spawn_worker()
 
-        while system_config.running:
+        while chandragen.system_config.running:
             # logger.debug("ticking pooler")
             self.clean_up_dead_workers()
             self.balance_workers()
@@ -1,14 +1,43 @@
+import json
 from collections.abc import Iterable
+from datetime import UTC, datetime
 from pathlib import Path
 
 from loguru import logger
 
-from chandragen import system_config
+import chandragen
+from chandragen.db.controllers.document_metadata import DocumentMetadataController
+from chandragen.db.controllers.peridot_dependency import PeridotDependencyController
+from chandragen.db.controllers.render_manifest import RenderManifestController
+from chandragen.db.models.document_metadata import DocumentMetadataEntry
 from chandragen.db.models.job_queue import JobQueueEntry
-from chandragen.formatters import FORMATTER_REGISTRY, apply_formatting_to_file
+from chandragen.db.models.render_manifest import RenderManifestEntry
+from chandragen.formatters import (
+    DocumentFormatter,
+    FormatterFlags,
+    FormatterProfile,
+    WriteResult,
+    apply_formatting_to_file,
+    write_document,
+)
+from chandragen.formatters.cache import hash_file, render_fingerprint
+from chandragen.formatters.frontmatter import read_frontmatter
+from chandragen.formatters.manifest import get_manifest
 from chandragen.formatters.types import FormatterConfig
 from chandragen.jobs import Job
 from chandragen.jobs.runners import JobRunner, jobrunner
+from chandragen.peridot.engine import get_peridot_engine
+
+
+def parse_date(date: str | None) -> datetime | None:
+    """Parses an ISO 8601 frontmatter date, dates without a timezone are taken to be UTC. returns None for anything else."""
+    if date is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(date)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=UTC)
 
 
 class FormatterJob(Job):
@@ -31,6 +60,14 @@ class FormatterJob(Job):
     footing_strip_offset: int            = 0
 
     preformatted_unicode_columns: int    = 80
+    input_mode: str                      = "auto"
+    # render Peridot substitutions once the formatters are done
+    peridot: bool                        = False
+
+    # re-render even when the render manifest says the output is already up to date
+    force_rebuild: bool                  = False
+    # record per-formatter timings and store them as the job result
+    profile_formatters: bool             = False
 
 
 @jobrunner("formatter")
@@ -43,31 +80,201 @@ class FormatterJobRunner(JobRunner[FormatterJob]):
         return path.glob("*.md*")
 
     def run_config(self, config: FormatterConfig) -> bool:
-        all_formatters = [*FORMATTER_REGISTRY.line, *FORMATTER_REGISTRY.multiline, *FORMATTER_REGISTRY.preprocessor]
-        if system_config.log_level == "DEBUG":
+        if chandragen.system_config.log_level == "DEBUG":
+            all_formatters = get_manifest().names()
             for i in config.enabled_formatters:
                 if not all_formatters.__contains__(i):
                     logger.warning(f"Formatter not found: {i}")
-    
-        if apply_formatting_to_file(config):
-            logger.info(f"Successfully converted file {config.input_path}!")
-            return True
-        logger.error(f"Failed to convert {config.jobname}!")
-        return False
+
+        if config.input_path is None or config.output_path is None:
+            # let the formatter report the broken config
+            return apply_formatting_to_file(config) is not None
+
+        input_hash = hash_file(config.input_path)
+        fingerprint = render_fingerprint(config)
+        if not self.job.force_rebuild:
+            if self.is_up_to_date(config.output_path, input_hash, fingerprint):
+                logger.info(f"File {config.input_path} is unchanged since the last render, skipping")
+                self.ensure_metadata(config.input_path, config.output_path, input_hash)
+                return True
+            if self.reuse_render(config.input_path, config.output_path, input_hash, fingerprint):
+                self.ensure_metadata(config.input_path, config.output_path, input_hash)
+                return True
+
+        # formatted here rather than through apply_formatting_to_file, to get at the frontmatter the formatter captured
+        formatter = DocumentFormatter(config, FormatterFlags(), self.profile)
+        result = formatter.format_file()
+        self.record_render(config.input_path, result, input_hash, fingerprint, formatter.volatile)
+        self.record_metadata(config.input_path, result.path, input_hash, formatter.metadata)
+        self.dependency_db.set_partials(result.path, formatter.dependencies)
+        if config.peridot:
+            # the engine's caches are shared by every document this worker renders
+            logger.debug(f"Peridot caches: {get_peridot_engine().cache_stats()}")
+        logger.info(
+            f"Successfully converted file {config.input_path}! "
+            f"{result.bytes_written} bytes written, {result.bytes_skipped} bytes skipped as unchanged"
+        )
+        return True
+
+    def is_up_to_date(self, output_path: Path, input_hash: str, fingerprint: str) -> bool:
+        """Checks the render manifest for a render of the same input and pipeline that's still sitting at the output path."""
+        entry = self.render_manifest.get_entry(output_path)
+        if entry is None or entry.input_hash != input_hash or entry.fingerprint != fingerprint:
+            return False
+        # eg. a page with a timestamp, rendering it again is the whole point of re-running the job
+        if entry.volatile:
+            return False
+        # the output may have been deleted or edited by hand since, a size check catches most of that without reading it
+        try:
+            if output_path.stat().st_size != entry.output_size:
+                return False
+        except OSError:
+            return False
+        return self.partials_unchanged(output_path)
+
+    def partials_unchanged(self, output_path: Path) -> bool:
+        """Checks that every Peridot partial the render at an output path included is still the same as when it was rendered."""
+        for dependency in self.dependency_db.get_partials(output_path):
+            if dependency.partial_path not in self.partial_hashes:
+                try:
+                    self.partial_hashes[dependency.partial_path] = hash_file(Path(dependency.partial_path))
+                except OSError:
+                    self.partial_hashes[dependency.partial_path] = None
+            if self.partial_hashes[dependency.partial_path] != dependency.partial_hash:
+                return False
+        return True
+
+    def reuse_render(self, input_path: Path, output_path: Path, input_hash: str, fingerprint: str) -> bool:
+        """
+        Copies an identical render that another job already wrote, instead of formatting the document again.
+        Volatile renders are never copied, returns False if there's no usable render to copy.
+        """
+        entry = self.render_manifest.find_render(input_hash, fingerprint, exclude=output_path)
+        if entry is None:
+            return False
+        cached_path = Path(entry.output_path)
+        # partials are resolved relative to the including document, so the same source can include different ones elsewhere
+        if self.dependency_db.get_partials(cached_path):
+            return False
+        try:
+            if hash_file(cached_path) != entry.output_hash:
+                return False
+            # copied rather than hardlinked, so a later change to either output can't leak into the other
+            with cached_path.open(encoding="utf-8", newline="") as cached:
+                result = write_document(output_path, cached)
+        except OSError as e:
+            logger.debug(f"could not reuse render {cached_path} for {output_path}: {e}")
+            return False
+        self.record_render(input_path, result, input_hash, fingerprint)
+        self.dependency_db.set_partials(output_path, {})
+        logger.info(f"Reused identical render {cached_path} for {input_path}")
+        return True
+
+    def record_render(
+        self, input_path: Path, result: WriteResult, input_hash: str, fingerprint: str, volatile: bool = False
+    ):
+        """Stores a fresh render in the manifest, so the next run can skip or reuse it unless it's volatile."""
+        self.render_manifest.record_render(
+            RenderManifestEntry(
+                output_path=str(result.path),
+                input_path=str(input_path),
+                input_hash=input_hash,
+                fingerprint=fingerprint,
+                output_hash=result.digest,
+                output_size=result.size,
+                volatile=volatile,
+            )
+        )
        
  
+    def record_metadata(self, input_path: Path, output_path: Path, input_hash: str, frontmatter: dict[str, str]):
+        """Stores the frontmatter of a rendered document for index jobs, or drops the stored entry if it has none anymore."""
+        if not frontmatter:
+            if self.metadata_db.get_entry(output_path) is not None:
+                self.metadata_db.delete_entries([str(output_path)])
+            return
+        self.metadata_db.record_entry(
+            DocumentMetadataEntry(
+                output_path=str(output_path),
+                input_path=str(input_path),
+                input_hash=input_hash,
+                title=frontmatter.get("title"),
+                description=frontmatter.get("description"),
+                author=frontmatter.get("author"),
+                date=frontmatter.get("date"),
+                published_at=parse_date(frontmatter.get("date")),
+                fields_json=json.dumps(frontmatter),
+                updated_at=datetime.now(UTC),
+            )
+        )
+
+    def ensure_metadata(self, input_path: Path, output_path: Path, input_hash: str):
+        """
+        Makes sure a document that didn't need rendering has its metadata stored, eg. renders from before the metadata table existed.
+        Only the frontmatter at the top of the source gets read, and only when the stored entry is missing or stale.
+        """
+        entry = self.metadata_db.get_entry(output_path)
+        if entry is not None and entry.input_hash == input_hash:
+            return
+        try:
+            frontmatter = read_frontmatter(input_path)
+        except (OSError, UnicodeDecodeError) as e:
+            logger.debug(f"could not read the frontmatter of {input_path}: {e}")
+            return
+        self.record_metadata(input_path, output_path, input_hash, frontmatter)
+
+    @staticmethod
+    def build_config(job: FormatterJob) -> FormatterConfig:
+        """Builds the pipeline config for a single-file formatter job."""
+        return FormatterConfig(
+                jobname = job.jobname,
+                input_path = job.input_path,
+                output_path = job.output_path,
+                enabled_formatters = job.enabled_formatters,
+                formatter_flags = job.formatter_flags,
+                preformatted_unicode_columns = job.preformatted_unicode_columns,
+                input_mode = job.input_mode,
+                peridot = job.peridot,
+                heading = job.heading,
+                heading_end_pattern = job.heading_end_pattern,
+                heading_strip_offset = job.heading_strip_offset,
+                footing = job.footing,
+                footing_start_pattern = job.footing_start_pattern,
+                footing_strip_offset = job.footing_strip_offset
+        )
+
+    def is_current(self, input_path: Path, output_path: Path, fingerprint: str) -> bool:
+        """Checks whether a file in a directory job is already rendered and up to date, so it doesn't need a job."""
+        try:
+            input_hash = hash_file(input_path)
+        except OSError:
+            # let the file's own job report it
+            return False
+        if not self.is_up_to_date(output_path, input_hash, fingerprint):
+            return False
+        self.ensure_metadata(input_path, output_path, input_hash)
+        return True
+
     def run(self):
         job = self.job
         logger.info(f"Running formatting job {job.jobname} with strategy {"directory globbing" if job.is_dir else "single file"}")
         # rather than executing the directory job directly, spawn new jobs for each file and let the worker pool do it!
         if job.is_dir:
             job_queue_entries: list[JobQueueEntry] = []
+            # paths aren't part of the fingerprint, so every file in the directory shares the job's
+            fingerprint = render_fingerprint(self.build_config(job))
+            skipped = 0
             for file in self.collect_files(job.input_path, job.is_recursive):
+                output_path = self.job.output_path / f"{file.stem}.gmi"
+                # only files that changed, or include a partial that changed, are worth a job of their own
+                if not job.force_rebuild and self.is_current(file, output_path, fingerprint):
+                    skipped += 1
+                    continue
                 config = self.job.model_copy(deep=True)
                 config.input_path = file
                 config.is_dir = False
                 config.is_recursive = False
-                config.output_path = self.job.output_path / f"{file.stem}.gmi"
+                config.output_path = output_path
                 config.jobname = f"{job.jobname}({file})"
                 logger.debug(f"runner {str(self.job_id)[:4]} registering single-file job for path {file}")
                 job_queue_entries += [
@@ -76,34 +283,38 @@ class FormatterJobRunner(JobRunner[FormatterJob]):
                         job_type="formatter",
                         config_json=config.model_dump_json()
                     )]
-                self.job_queue_db.add_job_list(job_queue_entries)
-                self.job_queue_db.mark_job_complete(self.job_id)
-                logger.info(f"Job {job.jobname} completed successfully! registered {len(job_queue_entries)} formatter jobs!")
-        else:
-            config = FormatterConfig(
-                    jobname = job.jobname,
-                    input_path = job.input_path,
-                    output_path = job.output_path,
-                    enabled_formatters = job.enabled_formatters,
-                    formatter_flags = job.formatter_flags,
-                    preformatted_unicode_columns = job.preformatted_unicode_columns,
-                    heading = job.heading,
-                    heading_end_pattern = job.heading_end_pattern,
-                    heading_strip_offset = job.heading_strip_offset,
-                    footing = job.footing,
-                    footing_start_pattern = job.footing_start_pattern,
-                    footing_strip_offset = job.footing_strip_offset
+            self.job_queue_db.add_job_list(job_queue_entries)
+            self.job_queue_db.mark_job_complete(self.job_id)
+            logger.info(
+                f"Job {job.jobname} completed successfully! registered {len(job_queue_entries)} formatter jobs, "
+                f"{skipped} files were already up to date!"
             )
+        else:
+            config = self.build_config(job)
             logger.info(f"Job {job.jobname} invoking formatter module!")
-            if self.run_config(config):
+            success = self.run_config(config)
+            self.report_profile()
+            if success:
                 logger.info(f"Job {job.jobname} converted successfully")
                 self.job_queue_db.mark_job_complete(self.job_id)
             else:
                 logger.error(f"Job {job.jobname} failed to convert")
                 self.job_queue_db.mark_job_failed(self.job_id)
                 
+    def report_profile(self):
+        """Logs the formatter timings collected during the job, and stores them as the job result."""
+        if self.profile is None or not self.profile.timings:
+            return
+        logger.info(f"Formatter timings for job {self.job.jobname}:\n{self.profile.render()}")
+        self.job_queue_db.set_job_result(self.job_id, self.job.jobname, json.dumps(self.profile.to_dict()))
+
     def setup(self):
-        pass
+        self.render_manifest = RenderManifestController(self.job_queue_db.session)
+        self.metadata_db = DocumentMetadataController(self.job_queue_db.session)
+        self.dependency_db = PeridotDependencyController(self.job_queue_db.session)
+        # hashes of the partials checked during the job, by path. None for partials that couldn't be read
+        self.partial_hashes: dict[str, str | None] = {}
+        self.profile = FormatterProfile() if self.job.profile_formatters else None
     def cleanup(self) -> None:
         pass 
  
\ No newline at end of file
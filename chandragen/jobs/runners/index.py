@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import posixpath
+from collections.abc import Iterator, Sequence
+from datetime import UTC, datetime
+from pathlib import Path
+from time import monotonic
+from urllib.parse import quote, urlsplit, urlunsplit
+from xml.sax.saxutils import escape
+
+from loguru import logger
+
+from chandragen.db.controllers.document_metadata import DocumentMetadataController
+from chandragen.db.controllers.render_manifest import RenderManifestController
+from chandragen.db.models.document_metadata import DocumentMetadataEntry
+from chandragen.db.models.render_manifest import RenderManifestEntry
+from chandragen.db.notify import FINISHED_CHANNEL, JobWaiter
+from chandragen.formatters import WriteResult, write_document
+from chandragen.jobs import Job
+from chandragen.jobs.runners import JobRunner, jobrunner
+
+"""
+ChandraGen Index Jobs 📰
+
+Builds a gemlog index page, and optionally an Atom feed, for every document rendered into a directory.
+
+Everything comes from the document metadata table that formatter jobs fill in as they render,
+so no source document is ever read. The job first waits for the jobs still rendering into its directory to finish,
+then checks how many entries the directory has and when the latest one changed,
+and skips the whole build if neither moved since the last one.
+"""
+
+
+class IndexJob(Job):
+    @property
+    def job_type(self) -> str:
+        return "index"
+
+    # directory the listed documents were rendered into, as written in their formatter job's output path
+    entries_path: Path
+    output_path: Path
+    title: str
+    # pre-formatted gemtext placed between the title and the list of entries
+    heading: str | None      = None
+
+    feed_path: Path | None   = None
+    # URL the index page's directory is served at, feed links are resolved against it. required for feeds.
+    base_url: str | None     = None
+    author: str | None       = None
+    feed_entries: int        = 50
+
+    # rebuild even when nothing changed since the last build
+    force_rebuild: bool      = False
+
+
+def _relative_link(path: Path | str, directory: Path) -> str:
+    return quote(Path(os.path.relpath(path, directory)).as_posix())
+
+
+def _absolute_url(base_url: str, link: str) -> str:
+    # urljoin only resolves relative links for the schemes urllib knows about, and gemini isn't one of them
+    parts = urlsplit(base_url)
+    return urlunsplit(parts._replace(path=posixpath.normpath(posixpath.join(parts.path or "/", link))))
+
+
+def _timestamp(moment: datetime) -> str:
+    # some databases hand timestamps back without their timezone, they're always stored in UTC
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=UTC)
+    return moment.isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def render_index(job: IndexJob, entries: Sequence[DocumentMetadataEntry]) -> Iterator[str]:
+    """Renders the index page, linking every entry in the gemini feed format: `=> link YYYY-MM-DD - title`."""
+    directory = job.output_path.parent
+    yield f"# {job.title}\n\n"
+    if job.heading:
+        yield from job.heading.splitlines(keepends=True)
+        yield "\n"
+    for entry in entries:
+        title = entry.title or Path(entry.output_path).stem
+        date = f"{entry.published_at:%Y-%m-%d} - " if entry.published_at is not None else ""
+        yield f"=> {_relative_link(entry.output_path, directory)} {date}{title}\n"
+    if job.feed_path is not None:
+        yield f"\n=> {_relative_link(job.feed_path, directory)} Atom feed\n"
+
+
+def render_feed(job: IndexJob, entries: Sequence[DocumentMetadataEntry], base_url: str) -> Iterator[str]:
+    """
+    Renders an Atom feed of the newest entries. Entry timestamps are their frontmatter dates,
+    falling back to when the entry was last updated, so an unchanged set of entries always renders the same feed.
+    """
+    directory = job.output_path.parent
+    entries = entries[: job.feed_entries]
+    updated = max((entry.published_at or entry.updated_at for entry in entries), default=None)
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield '<feed xmlns="http://www.w3.org/2005/Atom">\n'
+    yield f"  <id>{escape(base_url)}</id>\n"
+    yield f"  <title>{escape(job.title)}</title>\n"
+    if updated is not None:
+        yield f"  <updated>{_timestamp(updated)}</updated>\n"
+    yield f"  <author><name>{escape(job.author or job.title)}</name></author>\n"
+    yield f'  <link href="{escape(_absolute_url(base_url, quote(job.output_path.name)))}" rel="alternate"/>\n'
+    if job.feed_path is not None:
+        yield f'  <link href="{escape(_absolute_url(base_url, _relative_link(job.feed_path, directory)))}" rel="self"/>\n'
+    for entry in entries:
+        url = escape(_absolute_url(base_url, _relative_link(entry.output_path, directory)))
+        yield "  <entry>\n"
+        yield f"    <id>{url}</id>\n"
+        yield f"    <title>{escape(entry.title or Path(entry.output_path).stem)}</title>\n"
+        yield f"    <updated>{_timestamp(entry.published_at or entry.updated_at)}</updated>\n"
+        yield f'    <link href="{url}" rel="alternate"/>\n'
+        if entry.description:
+            yield f"    <summary>{escape(entry.description)}</summary>\n"
+        if entry.author:
+            yield f"    <author><name>{escape(entry.author)}</name></author>\n"
+        yield "  </entry>\n"
+    yield "</feed>\n"
+
+
+@jobrunner("index")
+class IndexJobRunner(JobRunner[IndexJob]):
+    job_class = IndexJob
+    # seconds between checks on the jobs the index waits on, in case a finished notification gets lost
+    WAIT_INTERVAL = 5.0
+    # longest the index waits on the documents it lists, after that it's built from whatever has been rendered
+    MAX_WAIT = 600.0
+
+    def setup(self):
+        self.metadata_db = DocumentMetadataController(self.job_queue_db.session)
+        self.render_manifest = RenderManifestController(self.job_queue_db.session)
+
+    def cleanup(self) -> None:
+        pass
+
+    def run(self):
+        job = self.job
+        if job.feed_path is not None and not job.base_url:
+            logger.error(f"Index job {job.jobname} has a feed_path but no base_url to link feed entries to")
+            self.job_queue_db.mark_job_failed(self.job_id)
+            return
+
+        self.wait_for_entries()
+        self.build()
+        self.job_queue_db.mark_job_complete(self.job_id)
+
+    def pending_jobs(self) -> list[str]:
+        """Names of the unfinished jobs rendering into the index's directory, directory jobs rendering a parent of it too."""
+        directory = self.job.entries_path
+        pending: list[str] = []
+        for entry in self.job_queue_db.get_unfinished_jobs(exclude_type=self.job.job_type):
+            output_path = json.loads(entry.config_json).get("output_path")
+            if output_path is None:
+                continue
+            output_path = Path(output_path)
+            if output_path.is_relative_to(directory) or directory.is_relative_to(output_path):
+                pending.append(entry.name)
+        return pending
+
+    def wait_for_entries(self) -> None:
+        """
+        Blocks until none of the documents the index lists are still being rendered, waking up whenever a job finishes.
+        Jobs rendering anywhere else don't hold the index up, and it waits at most MAX_WAIT,
+        so a queue that never empties (eg. in cron mode) can't keep it from ever being built.
+        """
+        if not self.pending_jobs():
+            return
+        deadline = monotonic() + self.MAX_WAIT
+        waiter = JobWaiter(f"index_{self.job_id.hex}", FINISHED_CHANNEL)
+        try:
+            # checked again now that we're listening, a job finishing before that wouldn't wake us up
+            while pending := self.pending_jobs():
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    logger.warning(f"index job {self.job.jobname} gave up waiting on {len(pending)} jobs, building it anyway")
+                    return
+                logger.debug(f"index job {self.job.jobname} waiting on {len(pending)} unfinished jobs")
+                waiter.wait(min(self.WAIT_INTERVAL, remaining))
+        finally:
+            waiter.close()
+
+    def state_hash(self) -> str:
+        """Hashes the number of entries in the directory and when the latest one changed. any added, updated or removed entry changes it."""
+        count, updated_at = self.metadata_db.get_directory_state(self.job.entries_path)
+        return hashlib.sha256(json.dumps([count, updated_at], default=str).encode()).hexdigest()
+
+    def settings_hash(self) -> str:
+        settings = self.job.model_dump(mode="json", exclude={"jobname", "interval", "force_rebuild"})
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+    def is_up_to_date(self, output_path: Path, state_hash: str, settings_hash: str) -> bool:
+        """Checks the render manifest for a build of the same entries and settings that's still sitting at the output path."""
+        entry = self.render_manifest.get_entry(output_path)
+        if entry is None or entry.input_hash != state_hash or entry.fingerprint != settings_hash:
+            return False
+        try:
+            return output_path.stat().st_size == entry.output_size
+        except OSError:
+            return False
+
+    def build(self):
+        job = self.job
+        settings_hash = self.settings_hash()
+        state_hash = self.state_hash()
+        outputs = [job.output_path] if job.feed_path is None else [job.output_path, job.feed_path]
+        if not job.force_rebuild and all(self.is_up_to_date(path, state_hash, settings_hash) for path in outputs):
+            logger.info(f"Index {job.output_path} is unchanged since the last build, skipping")
+            return
+
+        entries = self.prune(self.metadata_db.get_entries_under(job.entries_path))
+        # pruning changes the state, record the build against what's left
+        state_hash = self.state_hash()
+        results = [write_document(job.output_path, render_index(job, entries))]
+        if job.feed_path is not None and job.base_url:
+            base_url = job.base_url if job.base_url.endswith("/") else f"{job.base_url}/"
+            results.append(write_document(job.feed_path, render_feed(job, entries, base_url)))
+        for result in results:
+            self.record_build(result, state_hash, settings_hash)
+        logger.info(f"Built index {job.output_path} with {len(entries)} entries")
+
+    def prune(self, entries: Sequence[DocumentMetadataEntry]) -> list[DocumentMetadataEntry]:
+        """Drops the entries of documents that have been deleted since they were rendered, and the index page's own entry."""
+        missing = {entry.output_path for entry in entries if not Path(entry.output_path).exists()}
+        if missing:
+            logger.info(f"Removing {len(missing)} deleted documents from the index")
+            self.metadata_db.delete_entries(sorted(missing))
+        index = str(self.job.output_path)
+        return [entry for entry in entries if entry.output_path not in missing and entry.output_path != index]
+
+    def record_build(self, result: WriteResult, state_hash: str, settings_hash: str):
+        self.render_manifest.record_render(
+            RenderManifestEntry(
+                output_path=str(result.path),
+                input_path=str(self.job.entries_path),
+                input_hash=state_hash,
+                fingerprint=settings_hash,
+                output_hash=result.digest,
+                output_size=result.size,
+            )
+        )
@@ -8,7 +8,6 @@ from uuid import uuid1
 from loguru import logger
 
 import chandragen
-from chandragen import system_config
 from chandragen.db.controllers.job_queue import JobQueueController
 from chandragen.db.models.job_queue import JobQueueEntry
 from chandragen.jobs import Job
@@ -24,7 +23,7 @@ class GarbageCollector(Thread):
 
     def run(self):
         logger.debug("garbage collector thread initializing")
-        while system_config.running:
+        while chandragen.system_config.running:
             self.tick()
             sleep(120)
 
@@ -58,22 +57,22 @@ class SchedulerRunner:
     """
 
     def __init__(self):
-        self.tick_rate = system_config.tick_rate
+        self.tick_rate = chandragen.system_config.tick_rate
         # start a pooler up!
         self.garbage_collector = GarbageCollector()
         self.garbage_collector.start()
 
     def run(self, jobs: list[J]):
-        if system_config.scheduler_mode == "oneshot":
+        if chandragen.system_config.scheduler_mode == "oneshot":
             scheduler = OneShotScheduler(jobs)
-        elif system_config.scheduler_mode == "cron":
+        elif chandragen.system_config.scheduler_mode == "cron":
             scheduler = CronScheduler()
         else:
-            logger.error(f"Err: valid scheduler not specified; {system_config.scheduler_mode} is invalid")
+            logger.error(f"Err: valid scheduler not specified; {chandragen.system_config.scheduler_mode} is invalid")
             return
         logger.info(f"Invoking scheduler {scheduler}")
         scheduler.start()
-        while system_config.running:
+        while chandragen.system_config.running:
             scheduler.tick()
             sleep(self.tick_rate)
         logger.info(f"scheduler {scheduler} exiting")
@@ -155,7 +154,7 @@ class OneShotScheduler(JobScheduler):
 
         if not jobs_in_flight:
             logger.info("All jobs complete, shutting down.")
-            updated_config = system_config
+            updated_config = chandragen.system_config
             updated_config.running = False
             chandragen.update_system_config(updated_config)
             self.shutdown_event.set()
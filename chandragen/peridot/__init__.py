@@ -0,0 +1,29 @@
+"""
+ChandraGen Peridot 💎
+
+Peridot is a templating format for gemtext, see peridot_draft_specification.md.
+Documents are compiled into templates by a single-pass parser, cached by their contents, and rendered by the engine
+as the last stage of a formatter pipeline with `peridot` enabled.
+"""
+
+from chandragen.peridot.engine import PeridotEngine, TemplateCache, get_peridot_engine
+from chandragen.peridot.registry import HANDLER_REGISTRY, register_handler
+from chandragen.peridot.template import InlineLine, Substitution, Template, Text
+from chandragen.peridot.types import Heading, PeridotError, RenderContext, SubstitutionHandler, require_option
+
+__all__ = [
+    "HANDLER_REGISTRY",
+    "Heading",
+    "InlineLine",
+    "PeridotEngine",
+    "PeridotError",
+    "RenderContext",
+    "Substitution",
+    "SubstitutionHandler",
+    "Template",
+    "TemplateCache",
+    "Text",
+    "get_peridot_engine",
+    "register_handler",
+    "require_option",
+]
@@ -0,0 +1,159 @@
+import csv
+import json
+from collections.abc import Generator
+from pathlib import Path
+from typing import TextIO, cast
+
+from loguru import logger
+
+from chandragen.peridot.types import PeridotError
+
+"""
+ChandraGen Peridot Data Sources 📊
+
+Reads the rows of file-backed data sources for handlers like `table`, as a stream.
+
+- CSV and TSV: the first row is the header
+- JSON Lines: one object per line, the keys of the first object are the header
+
+Rows come out one at a time with every cell as a string, so a data source of any size is read in constant memory.
+Broken rows, eg. lines of a JSON Lines file that aren't objects, are logged and skipped rather than failing the whole table.
+"""
+
+# data source formats, by file extension
+DATA_FORMATS = {".csv": "csv", ".tsv": "tsv", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+
+def data_format(path: Path, explicit: str | None = None) -> str:
+    """Works out the format of a data source from its extension, unless given explicitly. raises PeridotError if unknown."""
+    data_type = explicit or DATA_FORMATS.get(path.suffix.lower())
+    if data_type is None or data_type not in DATA_FORMATS.values():
+        msg = f"unknown data source format for {path}, use one of {sorted(set(DATA_FORMATS.values()))}"
+        raise PeridotError(msg)
+    return data_type
+
+
+def _cell(value: object) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _select(header: list[str], fields: list[str] | None) -> list[int] | None:
+    """Maps the requested fields to column indexes in the source, None keeps every column."""
+    if fields is None:
+        return None
+    missing = [field for field in fields if field not in header]
+    if missing:
+        msg = f"data source has no field(s) {missing}, it has {header}"
+        raise PeridotError(msg)
+    return [header.index(field) for field in fields]
+
+
+def _open(path: Path) -> TextIO:
+    try:
+        return path.open(encoding="utf-8", newline="")
+    except OSError as e:
+        msg = f"could not open data source {path}: {e}"
+        raise PeridotError(msg) from None
+
+
+def _csv_rows(path: Path, delimiter: str, indexes: list[int] | None) -> Generator[list[str]]:
+    with _open(path) as file:
+        reader = csv.reader(file, delimiter=delimiter)
+        try:
+            # the header, read_rows already got it
+            next(reader, None)
+            for row in reader:
+                if not row:
+                    continue
+                yield row if indexes is None else [row[index] if index < len(row) else "" for index in indexes]
+        except (csv.Error, UnicodeDecodeError) as e:
+            # neither can be picked up after, so the table ends here
+            logger.warning(f"stopped reading {path} at a malformed row: {e}")
+
+
+def _parse_record(line: str) -> dict[str, object] | None:
+    """Parses a line of JSON Lines, None if it isn't an object. raises json.JSONDecodeError if it isn't JSON."""
+    record: object = json.loads(line)
+    if not isinstance(record, dict):
+        return None
+    return cast("dict[str, object]", record)
+
+
+def _jsonl_rows(path: Path, fields: list[str]) -> Generator[list[str]]:
+    with _open(path) as file:
+        try:
+            for number, line in enumerate(file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = _parse_record(line)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"skipping malformed line {number} of {path}: {e}")
+                    continue
+                if record is None:
+                    logger.warning(f"skipping line {number} of {path}, it isn't an object")
+                    continue
+                yield [_cell(record.get(field)) for field in fields]
+        except UnicodeDecodeError as e:
+            logger.warning(f"stopped reading {path}, it isn't valid UTF-8: {e}")
+
+
+def _first_record(file: TextIO, path: Path) -> dict[str, object]:
+    for line in file:
+        if not line.strip():
+            continue
+        try:
+            record = _parse_record(line)
+        except json.JSONDecodeError as e:
+            msg = f"the first line of {path} isn't valid JSON: {e}"
+            raise PeridotError(msg) from None
+        if record is None:
+            msg = f"the first line of {path} isn't a JSON object"
+            raise PeridotError(msg)
+        return record
+    msg = f"data source {path} is empty"
+    raise PeridotError(msg)
+
+
+def _open_rows(
+    file: TextIO, path: Path, data_type: str, fields: list[str] | None
+) -> tuple[list[str], Generator[list[str]]]:
+    if data_type == "jsonl":
+        first = _first_record(file, path)
+        header = fields if fields is not None else list(first)
+        return header, _jsonl_rows(path, header)
+
+    delimiter = "\t" if data_type == "tsv" else ","
+    source_header = next(csv.reader(file, delimiter=delimiter), None)
+    if source_header is None:
+        msg = f"data source {path} is empty"
+        raise PeridotError(msg)
+    indexes = _select(source_header, fields)
+    header = source_header if fields is None else fields
+    return header, _csv_rows(path, delimiter, indexes)
+
+
+def read_rows(path: Path, data_type: str, fields: list[str] | None = None) -> tuple[list[str], Generator[list[str]]]:
+    """
+    Opens a data source, reading just enough of it to find the header.
+
+    Args:
+        path: the file to read
+        data_type: csv, tsv or jsonl, see data_format
+        fields: which fields to keep, in order. defaults to every field in the header.
+
+    Returns:
+        the header, and a lazy generator over the rows. the file is only opened again once the rows are read,
+        and closed when they run out or the generator is closed, so rows that are never read hold nothing open.
+        Raises PeridotError if the file can't be read, is empty, or lacks one of the fields.
+    """
+    with _open(path) as file:
+        try:
+            return _open_rows(file, path, data_type, fields)
+        except (csv.Error, UnicodeDecodeError) as e:
+            msg = f"could not read data source {path}: {e}"
+            raise PeridotError(msg) from None
@@ -0,0 +1,628 @@
+import hashlib
+import importlib
+import os
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Callable, Hashable, Iterable, Iterator, Mapping
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import partial
+from itertools import chain, islice
+from pathlib import Path
+from pickle import PicklingError
+from time import monotonic
+
+from loguru import logger
+
+from chandragen.formatters.manifest import load_handler_modules
+from chandragen.peridot.parser import BLOCK_OPEN, INLINE_OPEN, LINE_PREFIX, iter_nodes, parse_template
+from chandragen.peridot.registry import BUILTIN_HANDLER_MODULE, HANDLER_REGISTRY
+from chandragen.peridot.template import InlineLine, Node, Substitution, Template, Text
+from chandragen.peridot.types import PeridotError, RenderContext, SubstitutionHandler, parse_heading
+
+"""
+ChandraGen Peridot Engine 💎
+
+Renders Peridot documents: gemtext with inline, line and block substitutions that get filled in at generation time.
+
+Documents are compiled into templates once and cached by the sha256 of their contents,
+so a page re-rendered on every cron tick only pays for rendering its substitutions, not for parsing the page again.
+Documents longer than CACHED_DOCUMENT_LINES skip the cache: they're compiled a node at a time as the formatters
+hand lines over, and rendered as they're compiled, so a huge page never has to fit in memory.
+The engine runs as the last stage of the formatter pipeline when a job enables it, after every formatter has run.
+
+Rendering takes one pass over the template. Handlers that need the whole document, like `toc`, are deferred:
+the main pass leaves a placeholder where they go and keeps collecting headings and counters as it renders,
+then a final pass over the output fills the placeholders in. Everything up to the first placeholder streams out immediately,
+only the output after it is held back until the document is done.
+
+Handlers declaring a "pure" or "ttl" cache policy get their output memoized, keyed by handler, normalized options, body
+and whatever else the handler says it reads. The cache lives on the engine, so every document a worker renders shares it,
+and the banners and tables repeated across thousands of pages only get rendered once per worker.
+
+Line and block substitutions whose handler allows it are all handed to a thread or process pool when rendering starts,
+and their output is spliced back in as the main pass reaches them, so a page full of slow data-driven blocks
+takes about as long as its slowest block. lines before the first unfinished block still stream out right away.
+Long documents only read STREAM_LOOKAHEAD_NODES nodes ahead of the main pass, so it's the blocks within that window
+that run side by side.
+Serial substitutions that aren't cached stream their lines straight from the handler, so a `table` over a large data source
+never has to fit in memory.
+
+Partials pulled in with `include` are compiled once and cached by path, and only read again when their size or
+modification time changes. every partial a document includes is recorded in its context, so formatter jobs can keep
+a page -> partials dependency graph and rebuild just the pages using a partial that changed.
+"""
+
+# how many compiled templates an engine keeps around
+TEMPLATE_CACHE_SIZE = 256
+# documents longer than this are rendered as they're compiled instead of being collected and cached
+CACHED_DOCUMENT_LINES = 4096
+# how many nodes of a streamed document get read ahead of the main pass, so the pools have work to start on
+STREAM_LOOKAHEAD_NODES = 32
+# how many handler results an engine keeps around
+RESULT_CACHE_SIZE = 4096
+# how many compiled partials an engine keeps around, and how deep partials may include other partials
+PARTIAL_CACHE_SIZE = 256
+MAX_INCLUDE_DEPTH = 8
+# upper bounds on the pools concurrent substitutions are evaluated on, they're only started once a handler needs them
+MAX_RENDER_THREADS = 32
+MAX_RENDER_PROCESSES = min(4, os.cpu_count() or 1)
+
+
+@dataclass(slots=True)
+class _DeferredLine:
+    """Placeholder for an InlineLine holding deferred substitutions, everything else in it is already rendered."""
+
+    parts: list[str | Substitution]
+    # where the line sits in the context's headings, if it's a heading
+    heading_index: int | None = None
+
+    def preview(self) -> str:
+        """The line with its deferred substitutions as written."""
+        return "".join(part if isinstance(part, str) else part.source[0] for part in self.parts)
+
+
+@dataclass(slots=True)
+class _DeferredSubstitution:
+    """Placeholder for a deferred line or block substitution."""
+
+    substitution: Substitution
+
+
+_Placeholder = _DeferredLine | _DeferredSubstitution
+
+
+# what a pool hands back for a substitution: its output, and what it recorded in its copy of the context
+_PoolResult = tuple[tuple[str, ...], dict[str, str], bool]
+
+
+@dataclass(slots=True)
+class _ConcurrentRender:
+    """A line or block substitution being evaluated on a pool."""
+
+    substitution: Substitution
+    handler: SubstitutionHandler
+    options: dict[str, str]
+    # result cache key, None when the handler's output isn't cached
+    key: Hashable | None
+    future: Future[_PoolResult]
+
+
+def _render_lines(
+    handler: SubstitutionHandler, substitution: Substitution, options: Mapping[str, str], context: RenderContext
+) -> Iterable[str]:
+    """Renders a line or block substitution, the output may be a lazy iterator."""
+    if substitution.kind == "block":
+        return handler.render_block(options, list(substitution.body), context)
+    return handler.render_line(options, context)
+
+
+def _render_lines_eagerly(
+    handler: SubstitutionHandler, substitution: Substitution, options: Mapping[str, str], context: RenderContext
+) -> tuple[str, ...]:
+    """Renders a line or block substitution in full, for the result cache and pools. module level so process pools can pickle it."""
+    return tuple(_render_lines(handler, substitution, options, context))
+
+
+# marks the pool threads that are rendering a substitution, see _start_concurrent
+_pool_thread = threading.local()
+
+
+def _render_on_pool(
+    handler: SubstitutionHandler, substitution: Substitution, options: Mapping[str, str], context: RenderContext
+) -> _PoolResult:
+    """Renders a substitution on a pool, with a snapshot of the context, returning the dependencies and volatility it recorded."""
+    _pool_thread.active = True
+    try:
+        output = _render_lines_eagerly(handler, substitution, options, context)
+    finally:
+        _pool_thread.active = False
+    return output, context.dependencies, context.volatile
+
+
+class TemplateCache:
+    """
+    A bounded LRU of compiled templates, keyed by the sha256 of the document they were compiled from.
+    Thread-safe, handlers on the thread pool compile partials through it while the main pass renders.
+    """
+
+    def __init__(self, max_templates: int = TEMPLATE_CACHE_SIZE):
+        self.max_templates = max_templates
+        self.templates: OrderedDict[str, Template] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, text: str) -> Template:
+        """Returns the template for a document, compiling it if it isn't cached yet."""
+        digest = hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+        with self.lock:
+            template = self.templates.get(digest)
+            if template is not None:
+                self.hits += 1
+                self.templates.move_to_end(digest)
+                return template
+            self.misses += 1
+
+        # compiled outside the lock, two threads compiling the same document at once just both get a valid template
+        template = parse_template(text.splitlines(keepends=True), digest)
+        with self.lock:
+            self.templates[digest] = template
+            if len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        return template
+
+
+class PartialCache:
+    """
+    A bounded LRU of compiled partials, keyed by their resolved path.
+    A cached partial is only read again once its size or modification time changes. Thread-safe, like TemplateCache.
+    """
+
+    def __init__(self, templates: TemplateCache, max_partials: int = PARTIAL_CACHE_SIZE):
+        self.templates = templates
+        self.max_partials = max_partials
+        # path -> (modification time in ns, size, compiled partial)
+        self.partials: OrderedDict[Path, tuple[int, int, Template]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, path: Path) -> Template:
+        """Returns the compiled partial at a path. raises OSError or UnicodeDecodeError if it can't be read."""
+        stat = path.stat()
+        with self.lock:
+            cached = self.partials.get(path)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self.hits += 1
+                self.partials.move_to_end(path)
+                return cached[2]
+            self.misses += 1
+
+        # newlines are kept as-is, so the template's digest matches the hash of the file on disk
+        with path.open(encoding="utf-8", newline="") as file:
+            template = self.templates.get(file.read())
+        with self.lock:
+            self.partials[path] = (stat.st_mtime_ns, stat.st_size, template)
+            self.partials.move_to_end(path)
+            if len(self.partials) > self.max_partials:
+                self.partials.popitem(last=False)
+        return template
+
+
+class ResultCache:
+    """
+    A bounded LRU of handler output, shared by every document an engine renders.
+    Entries can expire, for handlers with a "ttl" cache policy. Thread-safe, like TemplateCache.
+    """
+
+    def __init__(self, max_results: int = RESULT_CACHE_SIZE):
+        self.max_results = max_results
+        # key -> (output, monotonic time it expires at, or None to keep it until it's evicted)
+        self.results: OrderedDict[Hashable, tuple[str | tuple[str, ...], float | None]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> str | tuple[str, ...] | None:
+        with self.lock:
+            cached = self.results.get(key)
+            if cached is not None:
+                output, expires_at = cached
+                if expires_at is None or expires_at > monotonic():
+                    self.hits += 1
+                    self.results.move_to_end(key)
+                    return output
+                del self.results[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, output: str | tuple[str, ...], ttl: float | None) -> None:
+        with self.lock:
+            self.results[key] = (output, None if ttl is None else monotonic() + ttl)
+            self.results.move_to_end(key)
+            if len(self.results) > self.max_results:
+                self.results.popitem(last=False)
+
+
+def has_substitutions(text: str) -> bool:
+    """Cheap check for whether a document could contain any substitutions at all, lets plain documents skip compiling."""
+    return INLINE_OPEN in text or LINE_PREFIX in text or BLOCK_OPEN in text
+
+
+class PeridotEngine:
+    """
+    Compiles and renders Peridot documents.
+
+    args:
+        handlers: the substitution handlers available to documents, by name. defaults to every registered handler.
+        template_cache_size: how many compiled templates to keep
+        result_cache_size: how many memoized handler results to keep
+        max_threads: size of the thread pool for "thread" handlers
+        max_processes: size of the process pool for "process" handlers
+
+    methods:
+        compile: returns the template for a document, from the cache if it was compiled before
+        render: lazily renders a template, yielding lines
+        render_lines: compiles and renders a document given as lines
+        render_text: compiles and renders a document held in a string
+    """
+
+    def __init__(
+        self,
+        handlers: Mapping[str, SubstitutionHandler] | None = None,
+        template_cache_size: int = TEMPLATE_CACHE_SIZE,
+        result_cache_size: int = RESULT_CACHE_SIZE,
+        max_threads: int = MAX_RENDER_THREADS,
+        max_processes: int = MAX_RENDER_PROCESSES,
+    ):
+        self.handlers: Mapping[str, SubstitutionHandler] = HANDLER_REGISTRY if handlers is None else handlers
+        self.templates = TemplateCache(template_cache_size)
+        self.results = ResultCache(result_cache_size)
+        self.partials = PartialCache(self.templates)
+        self.max_threads = max_threads
+        self.max_processes = max_processes
+        self._threads: ThreadPoolExecutor | None = None
+        self._processes: ProcessPoolExecutor | None = None
+        # pools are started on first use, possibly by handlers rendering partials from the thread pool
+        self._pools_lock = threading.Lock()
+
+    @property
+    def handler_versions(self) -> dict[str, int]:
+        """The version of every available handler, for render fingerprints."""
+        return {name: handler.version for name, handler in sorted(self.handlers.items())}
+
+    def cache_stats(self) -> str:
+        """Hit and miss counts of the template and result caches, for logging."""
+        return (
+            f"templates {self.templates.hits} hits / {self.templates.misses} misses, "
+            f"handler results {self.results.hits} hits / {self.results.misses} misses, "
+            f"partials {self.partials.hits} hits / {self.partials.misses} misses"
+        )
+
+    def compile(self, text: str) -> Template:
+        return self.templates.get(text)
+
+    def render(self, template: Template, context: RenderContext | None = None) -> Iterator[str]:
+        """
+        Renders a template, yielding the lines of the rendered document.
+        Substitutions that can't be rendered (unknown handlers, bad options) are logged and left in the document as written.
+        """
+        # every node is already compiled, so every substitution a pool may evaluate starts before anything renders
+        yield from self._render_nodes(iter(template.nodes), context, lookahead=len(template.nodes))
+
+    def _render_nodes(self, nodes: Iterator[Node], context: RenderContext | None, lookahead: int) -> Iterator[str]:
+        """
+        Renders nodes as they come in. substitutions wait until up to `lookahead` nodes have been read past them,
+        so the line and block substitutions among those are already running on their pools when the main pass needs them.
+        """
+        context = context if context is not None else RenderContext()
+        if context.engine is None:
+            context.engine = self
+        # pools only ever see the context as it was when rendering started, whatever the main pass got to by then
+        initial = replace(context, counters=dict(context.counters), headings=list(context.headings))
+        # once a placeholder comes up, every line after it waits for the final pass so the output stays in order
+        held: list[str | _Placeholder] = []
+        pending: deque[tuple[Node, _ConcurrentRender | tuple[str, ...] | None]] = deque()
+        try:
+            for node in nodes:
+                pending.append((node, self._start_concurrent(node, context, initial)))
+                while pending and (isinstance(pending[0][0], Text) or len(pending) > lookahead):
+                    yield from self._main_pass(*pending.popleft(), context, held)
+            while pending:
+                yield from self._main_pass(*pending.popleft(), context, held)
+        finally:
+            # a render abandoned halfway through shouldn't leave work queued up on the pools
+            for _node, rendered in pending:
+                if isinstance(rendered, _ConcurrentRender):
+                    rendered.future.cancel()
+        if held:
+            yield from self._final_pass(held, context)
+
+    def _main_pass(
+        self,
+        node: Node,
+        rendered: _ConcurrentRender | tuple[str, ...] | None,
+        context: RenderContext,
+        held: list[str | _Placeholder],
+    ) -> Iterator[str]:
+        """Renders a node, yielding its lines until the first placeholder and holding everything after it."""
+        lines = self._render_node(node, context) if rendered is None else self._finish_concurrent(rendered, context)
+        for line in lines:
+            if isinstance(line, str):
+                context.record_line(line)
+                if not held:
+                    yield line
+                    continue
+            elif isinstance(line, _DeferredLine) and context.record_line(line.preview()) is not None:
+                # keeps the heading's place in the document, its text gets filled in with the line
+                line.heading_index = len(context.headings) - 1
+            held.append(line)
+
+    def _final_pass(self, held: list[str | _Placeholder], context: RenderContext) -> Iterator[str]:
+        """Fills in the placeholders in the held back output, now that the context covers the whole document."""
+        # inline placeholders go first, so headings holding one are complete by the time a toc lists them
+        for index, line in enumerate(held):
+            if isinstance(line, _DeferredLine):
+                held[index] = self._resolve_line(line, context)
+        for line in held:
+            if isinstance(line, _DeferredSubstitution):
+                yield from self._render_substitution(line.substitution, context)
+            else:
+                yield line  # pyright: ignore[reportReturnType]
+
+    def render_partial(self, path: Path, context: RenderContext) -> list[str]:
+        """
+        Renders a partial into the document being rendered, recording it as one of the document's dependencies.
+        Partials share the document's counters, but their headings only count once they're part of the document.
+        Raises PeridotError if the partial can't be read, or includes itself.
+        """
+        path = path.resolve()
+        if path in context.include_stack:
+            msg = f"partial {path} includes itself"
+            raise PeridotError(msg)
+        if len(context.include_stack) >= MAX_INCLUDE_DEPTH:
+            msg = f"partials are nested more than {MAX_INCLUDE_DEPTH} deep at {path}"
+            raise PeridotError(msg)
+        try:
+            template = self.partials.get(path)
+        except (OSError, UnicodeDecodeError) as e:
+            msg = f"could not read partial {path}: {e}"
+            raise PeridotError(msg) from None
+        context.dependencies[str(path)] = template.digest
+        partial_context = replace(
+            context, headings=[], in_preformat=False, include_stack=(*context.include_stack, path)
+        )
+        lines = list(self.render(template, partial_context))
+        context.volatile = context.volatile or partial_context.volatile
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        return lines
+
+    def render_lines(self, lines: Iterable[str], context: RenderContext | None = None) -> Iterator[str]:
+        """
+        Renders a document given as lines.
+        Documents up to CACHED_DOCUMENT_LINES long are collected, and their templates cached by content.
+        Longer ones are compiled as they're read and never held in memory, except for output held back by a placeholder.
+        """
+        lines = iter(lines)
+        document = list(islice(lines, CACHED_DOCUMENT_LINES + 1))
+        if len(document) > CACHED_DOCUMENT_LINES:
+            yield from self._render_nodes(iter_nodes(chain(document, lines)), context, STREAM_LOOKAHEAD_NODES)
+            return
+        text = "".join(document)
+        if not has_substitutions(text):
+            yield from document
+            return
+        yield from self.render(self.compile(text), context)
+
+    def render_text(self, text: str, context: RenderContext | None = None) -> str:
+        if not has_substitutions(text):
+            return text
+        return "".join(self.render(self.compile(text), context))
+
+    def _is_deferred(self, substitution: Substitution) -> bool:
+        handler = self.handlers.get(substitution.name)
+        return handler is not None and handler.is_deferred(dict(substitution.options))
+
+    def _render_node(self, node: Node, context: RenderContext) -> Iterator[str | _Placeholder]:
+        """Main pass rendering of a single node, deferred substitutions come out as placeholders."""
+        if isinstance(node, Text):
+            yield from node.lines
+        elif isinstance(node, InlineLine):
+            parts = [
+                part if isinstance(part, str) or self._is_deferred(part) else self._render_inline(part, context)
+                for part in node.parts
+            ]
+            texts = [part for part in parts if isinstance(part, str)]
+            if len(texts) == len(parts):
+                yield "".join(texts)
+            else:
+                yield _DeferredLine(parts)
+        elif self._is_deferred(node):
+            yield _DeferredSubstitution(node)
+        else:
+            yield from self._render_substitution(node, context)
+
+    def _resolve_line(self, placeholder: _DeferredLine, context: RenderContext) -> str:
+        """Final pass rendering of an inline line, with the context of the whole document."""
+        line = "".join(
+            part if isinstance(part, str) else self._render_inline(part, context) for part in placeholder.parts
+        )
+        if placeholder.heading_index is not None:
+            heading = parse_heading(line)
+            if heading is not None:
+                context.headings[placeholder.heading_index] = heading
+        return line
+
+    def _handler(self, substitution: Substitution) -> SubstitutionHandler | None:
+        handler = self.handlers.get(substitution.name)
+        if handler is None:
+            logger.warning(f"unknown Peridot substitution handler {substitution.name!r}, leaving it as-is")
+        return handler
+
+    def _cache_key(
+        self,
+        handler: SubstitutionHandler,
+        substitution: Substitution,
+        options: Mapping[str, str],
+        context: RenderContext,
+    ) -> Hashable | None:
+        """
+        The result cache key for a substitution, None if the handler's cache policy doesn't allow caching it.
+        Every rendered substitution goes through here, so it also marks the context when the substitution is volatile.
+        """
+        if handler.is_volatile(options):
+            context.volatile = True
+        if handler.get_cache_policy(options) == "never":
+            return None
+        # options are normalized so the order they were written in, and overridden duplicates, don't split the cache
+        return (
+            handler.name,
+            handler.version,
+            substitution.kind,
+            tuple(sorted(options.items())),
+            substitution.body,
+            handler.cache_inputs(options, context),
+        )
+
+    def _cache_result(
+        self, handler: SubstitutionHandler, options: Mapping[str, str], key: Hashable, output: str | tuple[str, ...]
+    ) -> None:
+        ttl = handler.cache_ttl if handler.get_cache_policy(options) == "ttl" else None
+        self.results.put(key, output, ttl)
+
+    def _memoized[R: (str, tuple[str, ...])](
+        self, handler: SubstitutionHandler, options: Mapping[str, str], key: Hashable, render: Callable[[], R]
+    ) -> R:
+        """Renders a substitution through the result cache."""
+        cached = self.results.get(key)
+        if cached is not None:
+            return cached  # pyright: ignore[reportReturnType]
+        output = render()
+        self._cache_result(handler, options, key, output)
+        return output
+
+    def _pool(self, handler: SubstitutionHandler) -> Executor:
+        with self._pools_lock:
+            if handler.concurrency == "process":
+                if self._processes is None:
+                    self._processes = ProcessPoolExecutor(self.max_processes)
+                return self._processes
+            if self._threads is None:
+                self._threads = ThreadPoolExecutor(self.max_threads, thread_name_prefix="peridot")
+            return self._threads
+
+    def _start_concurrent(
+        self, node: Node, context: RenderContext, initial: RenderContext
+    ) -> _ConcurrentRender | tuple[str, ...] | None:
+        """
+        Hands a line or block substitution to its pool, if its handler allows it, for the main pass to pick up later.
+        The handler gets a snapshot of `initial`, the context as it was when the document started rendering.
+        Cached output is returned as-is instead of being evaluated again, None means the main pass renders the node itself.
+        """
+        # a partial rendered by a handler on the thread pool renders serially, so it never waits on the pool it runs on
+        if not isinstance(node, Substitution) or getattr(_pool_thread, "active", False):
+            return None
+        handler = self.handlers.get(node.name)
+        options = dict(node.options)
+        if handler is None or handler.concurrency == "serial" or handler.is_deferred(options):
+            return None
+        key = self._cache_key(handler, node, options, context)
+        cached = None if key is None else self.results.get(key)
+        if isinstance(cached, tuple):
+            return cached
+        # every handler gets a snapshot of the context, the main pass keeps changing the real one as the pools run.
+        # the engine itself can't be pickled, process pools get a snapshot without it
+        snapshot = replace(
+            initial,
+            counters=dict(initial.counters),
+            headings=list(initial.headings),
+            dependencies=dict(context.dependencies),
+            engine=None if handler.concurrency == "process" else context.engine,
+        )
+        future = self._pool(handler).submit(_render_on_pool, handler, node, options, snapshot)
+        return _ConcurrentRender(node, handler, options, key, future)
+
+    def _finish_concurrent(
+        self, rendered: _ConcurrentRender | tuple[str, ...], context: RenderContext
+    ) -> Iterable[str]:
+        """Waits for a substitution evaluated on a pool, and returns its output."""
+        if isinstance(rendered, tuple):
+            return rendered
+        substitution, handler = rendered.substitution, rendered.handler
+        try:
+            output, dependencies, volatile = rendered.future.result()
+        except PeridotError as e:
+            logger.warning(f"could not render Peridot substitution {substitution.source[0].strip()!r}: {e}")
+            return substitution.source
+        except (BrokenExecutor, PicklingError, AttributeError, TypeError) as e:
+            if handler.concurrency != "process":
+                raise
+            # most likely the handler, or something it was given, can't be pickled. a genuine bug shows up again here
+            logger.warning(
+                f"Peridot handler {handler.name!r} could not run in a process pool, rendering it in-process: {e}"
+            )
+            return self._render_substitution(substitution, context)
+        context.dependencies.update(dependencies)
+        context.volatile = context.volatile or volatile
+        if rendered.key is not None:
+            self._cache_result(handler, rendered.options, rendered.key, output)
+        return output
+
+    def _render_inline(self, substitution: Substitution, context: RenderContext) -> str:
+        handler = self._handler(substitution)
+        if handler is None:
+            return "".join(substitution.source)
+        options = dict(substitution.options)
+        try:
+            key = self._cache_key(handler, substitution, options, context)
+            if key is None:
+                return handler.render_inline(options, context)
+            return self._memoized(handler, options, key, partial(handler.render_inline, options, context))
+        except PeridotError as e:
+            logger.warning(f"could not render Peridot substitution {substitution.source[0]!r}: {e}")
+            return "".join(substitution.source)
+
+    def _render_substitution(self, substitution: Substitution, context: RenderContext) -> Iterable[str]:
+        handler = self._handler(substitution)
+        if handler is None:
+            return substitution.source
+        options = dict(substitution.options)
+        try:
+            key = self._cache_key(handler, substitution, options, context)
+            if key is None:
+                # uncached output streams straight through, so a handler can render far more than fits in memory
+                return self._guarded(substitution, _render_lines(handler, substitution, options, context))
+            return self._memoized(
+                handler, options, key, partial(_render_lines_eagerly, handler, substitution, options, context)
+            )
+        except PeridotError as e:
+            logger.warning(f"could not render Peridot substitution {substitution.source[0].strip()!r}: {e}")
+            return substitution.source
+
+    def _guarded(self, substitution: Substitution, lines: Iterable[str]) -> Iterator[str]:
+        """Passes streamed output through, ending it early if the handler fails partway through."""
+        try:
+            yield from lines
+        except PeridotError as e:
+            logger.warning(f"Peridot substitution {substitution.source[0].strip()!r} failed partway through: {e}")
+
+
+def import_handlers() -> None:
+    """Imports the builtin handlers, and the plugins the formatter manifest lists as registering handlers."""
+    importlib.import_module(BUILTIN_HANDLER_MODULE)
+    load_handler_modules()
+
+
+# The default engine is created on first use, and shared by every document rendered in the process
+_engine: PeridotEngine | None = None
+
+
+def get_peridot_engine() -> PeridotEngine:
+    """Returns the process-wide engine, importing the builtin and plugin handlers the first time it's called."""
+    global _engine  # noqa: PLW0603
+    if _engine is None:
+        import_handlers()
+        _engine = PeridotEngine()
+    return _engine
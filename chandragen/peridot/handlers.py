@@ -0,0 +1,329 @@
+import re
+import unicodedata
+from collections.abc import Generator, Hashable, Iterable, Iterator, Mapping
+from contextlib import closing
+from itertools import chain, islice
+from pathlib import Path
+
+from chandragen.formatters.cache import hash_file
+from chandragen.formatters.tables import measure_columns, parse_table, render_table, stream_table, text_width
+from chandragen.peridot.datasources import data_format, read_rows
+from chandragen.peridot.registry import register_handler
+from chandragen.peridot.types import (
+    MAX_HEADING_LEVEL,
+    CachePolicy,
+    PeridotError,
+    RenderContext,
+    SubstitutionHandler,
+    require_option,
+)
+
+_NOT_SLUG = re.compile(r"[^a-z0-9]+")
+# how many rows of a data source a table measures its columns from by default
+DATA_SAMPLE_ROWS = 1000
+
+
+def slugify(text: str) -> str:
+    """Lowercases text and boils it down to ascii letters and digits separated by single dashes."""
+    ascii_text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return _NOT_SLUG.sub("-", ascii_text.lower()).strip("-")
+
+
+def int_option(options: Mapping[str, str], name: str, default: int) -> int:
+    """Reads an integer option, raising PeridotError if it isn't one."""
+    value = options.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        msg = f"option {name!r} must be a whole number, got {value!r}"
+        raise PeridotError(msg) from None
+
+
+def resolve_path(path: str, context: RenderContext) -> Path:
+    """Resolves a path option against the directory of the document, or the partial, being rendered."""
+    resolved = Path(path).expanduser()
+    if resolved.is_absolute():
+        return resolved
+    if context.include_stack:
+        return context.include_stack[-1].parent / resolved
+    if context.config.input_path is not None:
+        return context.config.input_path.parent / resolved
+    return Path.cwd() / resolved
+
+
+# Standard substitution handlers, every Peridot engine should support these
+@register_handler
+class Slugify(SubstitutionHandler):
+    cache_policy = "pure"
+
+    def __init__(self):
+        super().__init__(
+            "slugify",
+            """
+    Slugify
+
+    Converts the text option to a URL and path safe slug, eg. <<slugify:(text: "Hello, World!")>> becomes hello-world.
+    As a block, the body gets slugified instead.
+            """,
+        )
+
+    @classmethod
+    def create(cls) -> SubstitutionHandler:
+        return cls()
+
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        return slugify(require_option(options, "text", self.name))
+
+    def render_block(self, options: Mapping[str, str], body: list[str], context: RenderContext) -> list[str]:
+        return [f"{slugify(' '.join(body))}\n"]
+
+
+@register_handler
+class Timestamp(SubstitutionHandler):
+    def __init__(self):
+        super().__init__(
+            "timestamp",
+            """
+    Timestamp
+
+    Inserts the time the document was rendered at, in UTC.
+    The format option takes a strftime format, eg. <<timestamp:(format: %Y-%m-%d)>>. defaults to ISO 8601.
+            """,
+        )
+
+    @classmethod
+    def create(cls) -> SubstitutionHandler:
+        return cls()
+
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        time_format = options.get("format")
+        if time_format is None:
+            return context.now.isoformat(timespec="seconds")
+        return context.now.strftime(time_format)
+
+
+@register_handler
+class Counter(SubstitutionHandler):
+    version = 2
+
+    def __init__(self):
+        super().__init__(
+            "counter",
+            """
+    Counter
+
+    Inserts the next value of a named counter, counting up from 1 through the document.
+    options:
+        name: which counter to increment, every name counts separately. defaults to "default".
+        start: the first value of the counter
+        step: how much the counter goes up by each time
+        total: insert the counter's final value in the document instead of counting up, eg. "part 1 of <<counter:(total)>>".
+            rendered in the final pass, so it works anywhere in the document.
+            """,
+        )
+
+    @classmethod
+    def create(cls) -> SubstitutionHandler:
+        return cls()
+
+    def is_deferred(self, options: Mapping[str, str]) -> bool:
+        return "total" in options
+
+    def is_volatile(self, options: Mapping[str, str]) -> bool:
+        # counters can't be cached because they change as the document renders, but the same document always counts the same
+        return False
+
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        name = options.get("name", "default")
+        if "total" in options:
+            return str(context.counters.get(name, 0))
+        step = int_option(options, "step", 1)
+        current = context.counters.get(name)
+        value = int_option(options, "start", 1) if current is None else current + step
+        context.counters[name] = value
+        return str(value)
+
+
+@register_handler
+class Table(SubstitutionHandler):
+    cache_policy = "pure"
+    # stays serial: a pool hands a substitution's whole output back at once, while source tables stream into the page
+    # a row at a time so they never have to fit in memory. body tables are CPU-bound and cached, threads can't help them.
+
+    def __init__(self):
+        super().__init__(
+            "table",
+            """
+    Table
+
+    Renders the markdown table in the body of a block as a unicode box-drawing table, the same way format_tables_as_unicode does.
+    The columns option sets how many text columns the table may take up, it defaults to the job's preformatted text columns.
+
+    With a source option the rows come from a data file instead, eg. >>> table: (source: status.csv)
+    CSV, TSV and JSON Lines files are supported, picked by extension or with the format option.
+    The source is streamed into the page a row at a time, so tables with hundreds of thousands of rows don't need to fit in memory.
+    options:
+        fields: which fields to show, in order, eg. (fields: "name, status"). defaults to every field.
+        limit: the most rows to show
+        widths: "sample" (the default) sizes the columns from the first rows, "scan" reads the whole source once to size them first.
+            cells wider than their column get wrapped either way.
+        sample: how many rows "sample" measures, defaults to 1000
+    Pages are rebuilt whenever their data sources change, the same way they are for partials.
+            """,
+        )
+
+    @classmethod
+    def create(cls) -> SubstitutionHandler:
+        return cls()
+
+    def get_cache_policy(self, options: Mapping[str, str]) -> CachePolicy:
+        # data sources can be far too big to keep around, and change under the same options
+        return "never" if "source" in options else self.cache_policy
+
+    def is_volatile(self, options: Mapping[str, str]) -> bool:
+        # data sources are recorded as dependencies, so a page is only rebuilt when its data changes
+        return False
+
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        msg = "table can only be used as a block or line substitution"
+        raise PeridotError(msg)
+
+    def cache_inputs(self, options: Mapping[str, str], context: RenderContext) -> Hashable:
+        return context.config.preformatted_unicode_columns
+
+    def render_line(self, options: Mapping[str, str], context: RenderContext) -> Iterable[str]:
+        if "source" not in options:
+            msg = "table needs a source option when used as a line substitution"
+            raise PeridotError(msg)
+        return self.render_source(options, context)
+
+    def render_block(self, options: Mapping[str, str], body: list[str], context: RenderContext) -> Iterable[str]:
+        if "source" in options:
+            return self.render_source(options, context)
+        columns = int_option(options, "columns", context.config.preformatted_unicode_columns)
+        return render_table(parse_table(body), columns)
+
+    def render_source(self, options: Mapping[str, str], context: RenderContext) -> Iterator[str]:
+        """Opens the data source and sizes the columns, returning the table's lines as a lazy iterator."""
+        path = resolve_path(options["source"], context).resolve()
+        data_type = data_format(path, options.get("format"))
+        fields = (
+            [field.strip() for field in options["fields"].split(",") if field.strip()] if "fields" in options else None
+        )
+        limit = int_option(options, "limit", 0) or None
+        columns = int_option(options, "columns", context.config.preformatted_unicode_columns)
+
+        mode = options.get("widths", "sample")
+        if mode not in {"sample", "scan"}:
+            msg = f"widths must be sample or scan, got {mode!r}"
+            raise PeridotError(msg)
+        sample_rows = int_option(options, "sample", DATA_SAMPLE_ROWS) if mode == "sample" else 0
+
+        # the rows only open the file once they're read, nothing is left open if anything below fails
+        header, rows = read_rows(path, data_type, fields)
+        try:
+            context.dependencies[str(path)] = hash_file(path)
+        except OSError as e:
+            msg = f"could not read data source {path}: {e}"
+            raise PeridotError(msg) from None
+        natural = [max(text_width(cell), 1) for cell in header]
+        if mode == "scan":
+            # a bounded first pass, only one width per column is kept while the source is read through
+            _, measured = read_rows(path, data_type, fields)
+            with closing(measured):
+                measure_columns(natural, islice(measured, limit))
+        return self.stream_source(header, natural, rows, limit=limit, sample_rows=sample_rows, columns=columns)
+
+    def stream_source(
+        self,
+        header: list[str],
+        natural: list[int],
+        rows: Generator[list[str]],
+        *,
+        limit: int | None,
+        sample_rows: int,
+        columns: int,
+    ) -> Iterator[str]:
+        """Streams a data source's table, sizing the columns from its first sample_rows rows if there are any to take."""
+        # closes the source as soon as the table is done, or its output gets closed before that
+        with closing(rows):
+            limited = islice(rows, limit)
+            if sample_rows:
+                sample = list(islice(limited, sample_rows))
+                measure_columns(natural, sample)
+                limited = chain(sample, limited)
+            yield from stream_table(header, ["left"] * len(header), natural, limited, columns)
+
+
+@register_handler
+class TableOfContents(SubstitutionHandler):
+    deferred = True
+
+    def __init__(self):
+        super().__init__(
+            "toc",
+            """
+    Table of Contents
+
+    Lists the headings of the whole document, including the ones after the substitution, as an indented bullet list.
+    Use it as a line substitution, eg. >>> toc: (depth: 2)
+    The depth option sets the deepest heading level to list, it defaults to 3. headings in preformatted blocks don't count.
+            """,
+        )
+
+    @classmethod
+    def create(cls) -> SubstitutionHandler:
+        return cls()
+
+    def is_volatile(self, options: Mapping[str, str]) -> bool:
+        # only depends on the document's own headings
+        return False
+
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        msg = "toc can only be used as a line substitution"
+        raise PeridotError(msg)
+
+    def render_line(self, options: Mapping[str, str], context: RenderContext) -> list[str]:
+        depth = int_option(options, "depth", MAX_HEADING_LEVEL)
+        headings = [heading for heading in context.headings if heading.level <= depth]
+        if not headings:
+            return []
+        top_level = min(heading.level for heading in headings)
+        return [f"* {'  ' * (heading.level - top_level)}{heading.text}\n" for heading in headings]
+
+
+@register_handler
+class Include(SubstitutionHandler):
+    def __init__(self):
+        super().__init__(
+            "include",
+            """
+    Include
+
+    Renders a partial, a shared gemtext or Peridot file like a navigation bar or footer, in place of the substitution.
+    Use it as a line substitution, eg. >>> include: (path: partials/footer.gmi)
+    Relative paths are resolved from the directory of the document, or of the partial, doing the including.
+    Partials can use substitutions and include other partials. pages are rebuilt whenever a partial they include changes.
+            """,
+        )
+
+    @classmethod
+    def create(cls) -> SubstitutionHandler:
+        return cls()
+
+    def is_volatile(self, options: Mapping[str, str]) -> bool:
+        # partials are recorded as dependencies, and whatever renders inside them marks the page itself
+        return False
+
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        msg = "include can only be used as a line substitution"
+        raise PeridotError(msg)
+
+    def render_line(self, options: Mapping[str, str], context: RenderContext) -> list[str]:
+        if context.engine is None:
+            msg = "include needs an engine to render partials with"
+            raise PeridotError(msg)
+        path = resolve_path(require_option(options, "path", self.name), context)
+        return context.engine.render_partial(path, context)
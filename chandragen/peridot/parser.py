@@ -0,0 +1,280 @@
+from collections.abc import Iterable, Iterator
+
+from loguru import logger
+
+from chandragen.peridot.template import InlineLine, Node, Options, Substitution, Template, Text
+
+"""
+ChandraGen Peridot Parser 🔎
+
+Compiles Peridot documents into templates in a single pass over the lines, without regexes.
+
+- Inline substitutions: `<<name>>` or `<<name:(option: value, option2: value)>>` anywhere in a line
+- Line substitutions: `>>> name: (option: value)` on a line of its own
+- Block substitutions: `>>{ name: (option: value)` on the opening line, the body, then `>>}` on a line of its own
+
+Lines are sorted out with a few startswith checks, and only lines containing `<<` get scanned for inline substitutions.
+The scanner only ever moves forward, a malformed substitution is left as literal text and scanning carries on after it,
+so compiling stays linear in the size of the document however broken its syntax is.
+Preformatted blocks are gemtext's verbatim text, nothing inside them is treated as a substitution.
+"""
+
+INLINE_OPEN = "<<"
+INLINE_CLOSE = ">>"
+LINE_PREFIX = ">>>"
+BLOCK_OPEN = ">>{"
+BLOCK_CLOSE = ">>}"
+PREFORMAT_TOGGLE = "```"
+# the most literal lines iter_nodes collects into a single Text node
+STREAM_TEXT_LINES = 64
+
+_BLANK = " \t"
+_QUOTES = "\"'"
+
+
+def _skip_blank(text: str, index: int) -> int:
+    while index < len(text) and text[index] in _BLANK:
+        index += 1
+    return index
+
+
+def _scan_name(text: str, index: int) -> tuple[str, int]:
+    """Scans a handler name: a letter or underscore, then letters, digits, underscores, dashes and dots."""
+    start = index
+    if index < len(text) and (text[index].isalpha() or text[index] == "_"):
+        index += 1
+        while index < len(text) and (text[index].isalnum() or text[index] in "_-."):
+            index += 1
+    return text[start:index], index
+
+
+def _scan_value(text: str, index: int) -> tuple[str | None, int]:
+    """Scans an option value, quoted or not. returns None for an unterminated quote."""
+    if index < len(text) and text[index] in _QUOTES:
+        closing = text.find(text[index], index + 1)
+        if closing < 0:
+            return None, len(text)
+        return text[index + 1 : closing], _skip_blank(text, closing + 1)
+    start = index
+    while index < len(text) and text[index] not in ",)\n":
+        index += 1
+    return text[start:index].strip(), index
+
+
+def _scan_options(text: str, index: int) -> tuple[Options | None, int]:
+    """
+    Scans an option list starting at the opening parenthesis at text[index].
+    Values can be quoted with ' or " to hold commas, colons and parentheses, options without a value get an empty one.
+    Returns the options (None if they're malformed) and the index the scan stopped at.
+    """
+    options: list[tuple[str, str]] = []
+    end = len(text)
+    index += 1
+    while True:
+        index = _skip_blank(text, index)
+        if index >= end or text[index] == "\n":
+            return None, index
+        if text[index] == ")":
+            return tuple(options), index + 1
+
+        start = index
+        while index < end and text[index] not in ":,)\n":
+            index += 1
+        key = text[start:index].strip()
+        value: str | None = ""
+        if index < end and text[index] == ":":
+            value, index = _scan_value(text, _skip_blank(text, index + 1))
+            if value is None:
+                return None, index
+        if key:
+            options.append((key, value))
+
+        if index >= end or text[index] == "\n":
+            return None, index
+        if text[index] == ",":
+            index += 1
+        elif text[index] != ")":
+            # junk after a quoted value
+            return None, index
+
+
+def _scan_header(text: str, index: int) -> tuple[tuple[str, Options] | None, int]:
+    """
+    Scans the `name: (options)` part shared by every substitution kind, starting at the name.
+    The colon and options are both optional.
+    Returns the name and options, or None if they're malformed, and the index the scan stopped at.
+    """
+    name, index = _scan_name(text, index)
+    if not name:
+        return None, index
+    options: Options | None = ()
+    after_name = _skip_blank(text, index)
+    if after_name < len(text) and text[after_name] == ":":
+        index = _skip_blank(text, after_name + 1)
+        if index < len(text) and text[index] == "(":
+            options, index = _scan_options(text, index)
+    elif after_name < len(text) and text[after_name] == "(":
+        options, index = _scan_options(text, after_name)
+    if options is None:
+        return None, index
+    return (name, options), index
+
+
+def _parse_inline(line: str) -> InlineLine | None:
+    """Splits a line into literal text and inline substitutions. returns None if it doesn't contain any."""
+    parts: list[str | Substitution] = []
+    literal_start = 0
+    search_from = 0
+    while True:
+        open_index = line.find(INLINE_OPEN, search_from)
+        if open_index < 0:
+            break
+        header, index = _scan_header(line, open_index + len(INLINE_OPEN))
+        if header is None or not line.startswith(INLINE_CLOSE, index):
+            # never look back into text that was already scanned, that's what keeps this linear
+            search_from = max(index, open_index + len(INLINE_OPEN))
+            continue
+        name, options = header
+        close_index = index + len(INLINE_CLOSE)
+        if open_index > literal_start:
+            parts.append(line[literal_start:open_index])
+        parts.append(Substitution("inline", name, options, source=(line[open_index:close_index],)))
+        literal_start = search_from = close_index
+
+    if not parts:
+        return None
+    if literal_start < len(line):
+        parts.append(line[literal_start:])
+    return InlineLine(tuple(parts))
+
+
+def _parse_line_substitution(line: str) -> Substitution | None:
+    """Parses `>>> name: (options)`. the colon is required, so quote lines starting with `>>` stay quote lines."""
+    index = _skip_blank(line, len(LINE_PREFIX))
+    name, index = _scan_name(line, index)
+    index = _skip_blank(line, index)
+    if not name or not line.startswith(":", index):
+        return None
+    index = _skip_blank(line, index + 1)
+    options: Options | None = ()
+    if line.startswith("(", index):
+        options, index = _scan_options(line, index)
+    if options is None or line[index:].strip():
+        return None
+    return Substitution("line", name, options, source=(line,))
+
+
+def _parse_block_header(line: str) -> tuple[str, Options] | None:
+    """Parses the opening line of a block, `>>{ name: (options)`."""
+    header, index = _scan_header(line, _skip_blank(line, len(BLOCK_OPEN)))
+    if header is None or line[index:].strip():
+        return None
+    return header
+
+
+class _TemplateCompiler:
+    """Sorts the lines of a document into template nodes one at a time, merging runs of literal lines into single Text nodes."""
+
+    def __init__(self):
+        self.nodes: list[Node] = []
+        self.literal: list[str] = []
+        self.handlers: set[str] = set()
+        self.in_preformat = False
+        # the opening line, handler name and options of the block substitution being collected
+        self.block: tuple[str, str, Options] | None = None
+        self.block_body: list[str] = []
+
+    def add_node(self, node: Substitution | InlineLine, names: Iterable[str]) -> None:
+        if self.literal:
+            self.nodes.append(Text(tuple(self.literal)))
+            self.literal.clear()
+        self.nodes.append(node)
+        self.handlers.update(names)
+
+    def feed(self, line: str) -> None:
+        if self.block is not None:
+            self.feed_block(line, self.block)
+            return
+
+        if line.startswith(PREFORMAT_TOGGLE):
+            self.in_preformat = not self.in_preformat
+            self.literal.append(line)
+            return
+        if self.in_preformat:
+            self.literal.append(line)
+            return
+
+        if line.startswith(BLOCK_OPEN):
+            header = _parse_block_header(line)
+            if header is not None:
+                self.block = (line, *header)
+                return
+        elif line.startswith(LINE_PREFIX):
+            substitution = _parse_line_substitution(line)
+            if substitution is not None:
+                self.add_node(substitution, (substitution.name,))
+                return
+        if INLINE_OPEN in line:
+            inline = _parse_inline(line)
+            if inline is not None:
+                self.add_node(inline, (part.name for part in inline.parts if isinstance(part, Substitution)))
+                return
+        self.literal.append(line)
+
+    def feed_block(self, line: str, block: tuple[str, str, Options]) -> None:
+        if not line.startswith(BLOCK_CLOSE) or line[len(BLOCK_CLOSE) :].strip():
+            self.block_body.append(line)
+            return
+        opening, name, options = block
+        body = tuple(self.block_body)
+        self.add_node(Substitution("block", name, options, body, (opening, *body, line)), (name,))
+        self.block = None
+        self.block_body = []
+
+    def take_nodes(self) -> list[Node]:
+        """Returns the nodes completed so far and forgets them, literal lines collected since the last node included."""
+        if self.literal:
+            self.nodes.append(Text(tuple(self.literal)))
+            self.literal.clear()
+        nodes, self.nodes = self.nodes, []
+        return nodes
+
+    def finish(self) -> list[Node]:
+        """Returns the remaining nodes once the document is over, an unclosed block is left as literal lines."""
+        if self.block is not None:
+            opening, name, _options = self.block
+            logger.warning(f"Peridot block substitution {name!r} is never closed with {BLOCK_CLOSE}, leaving it as-is")
+            self.literal += [opening, *self.block_body]
+            self.block = None
+            self.block_body = []
+        return self.take_nodes()
+
+
+def parse_template(lines: Iterable[str], digest: str) -> Template:
+    """
+    Compiles the lines of a Peridot document into a template.
+
+    Args:
+        lines: the lines of the document, each ending in a newline
+        digest: sha256 of the document, stored on the template so it can be cached by content
+
+    Returns:
+        the compiled Template
+    """
+    compiler = _TemplateCompiler()
+    for line in lines:
+        compiler.feed(line)
+    return Template(digest, tuple(compiler.finish()), frozenset(compiler.handlers))
+
+
+def iter_nodes(lines: Iterable[str], max_text_lines: int = STREAM_TEXT_LINES) -> Iterator[Node]:
+    """
+    Compiles the lines of a Peridot document into template nodes as they're read, for documents too long to hold in memory.
+    Each node is yielded as soon as it's complete, runs of literal lines are split into Text nodes of at most max_text_lines.
+    """
+    compiler = _TemplateCompiler()
+    for line in lines:
+        compiler.feed(line)
+        if compiler.nodes or len(compiler.literal) >= max_text_lines:
+            yield from compiler.take_nodes()
+    yield from compiler.finish()
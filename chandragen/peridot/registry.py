@@ -0,0 +1,13 @@
+from chandragen.peridot.types import SubstitutionHandler
+
+BUILTIN_HANDLER_MODULE = "chandragen.peridot.handlers"
+
+# every registered substitution handler, by name
+HANDLER_REGISTRY: dict[str, SubstitutionHandler] = {}
+
+
+def register_handler(cls: type[SubstitutionHandler]):
+    """decorator that adds a substitution handler to the registry at import time"""
+    handler = cls.create()
+    HANDLER_REGISTRY[handler.name] = handler
+    return cls
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Literal
+
+"""
+ChandraGen Peridot Templates 🌿
+
+A Peridot document compiles into a Template: a flat tuple of nodes that can be rendered any number of times.
+
+- Text: a run of literal lines, passed through untouched
+- InlineLine: a line mixing literal text with inline substitutions
+- Substitution: a line or block substitution replacing whole lines, or an inline one inside an InlineLine
+
+Templates are immutable, so one compiled template can be shared by every render of the same document.
+"""
+
+SubstitutionKind = Literal["inline", "line", "block"]
+# options in the order they were written, duplicate keys included. later ones win when handlers read them.
+Options = tuple[tuple[str, str], ...]
+
+
+@dataclass(frozen=True, slots=True)
+class Text:
+    """A run of literal lines."""
+
+    lines: tuple[str, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class Substitution:
+    """
+    A single substitution.
+
+    attributes:
+        kind: inline, line or block
+        name: name of the handler that renders it
+        options: the options written between the parentheses
+        body: the lines between the opening and closing line of a block substitution. empty for the other kinds.
+        source: the exact text of the substitution, put back as-is when it can't be rendered
+    """
+
+    kind: SubstitutionKind
+    name: str
+    options: Options
+    body: tuple[str, ...] = ()
+    source: tuple[str, ...] = ()
+
+
+@dataclass(frozen=True, slots=True)
+class InlineLine:
+    """A line containing inline substitutions, split into literal text and the substitutions between it."""
+
+    parts: tuple[str | Substitution, ...]
+
+
+Node = Text | InlineLine | Substitution
+
+
+@dataclass(frozen=True)
+class Template:
+    """
+    A compiled Peridot document.
+
+    attributes:
+        digest: sha256 of the document the template was compiled from
+        nodes: the document's nodes, in order
+        handlers: names of every handler the template's substitutions use
+    """
+
+    digest: str
+    nodes: tuple[Node, ...]
+    handlers: frozenset[str]
+
+    def substitutions(self) -> list[Substitution]:
+        """Every substitution in the template in document order, including the ones inside InlineLines."""
+        found: list[Substitution] = []
+        for node in self.nodes:
+            if isinstance(node, Substitution):
+                found.append(node)
+            elif isinstance(node, InlineLine):
+                found += [part for part in node.parts if isinstance(part, Substitution)]
+        return found
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from collections.abc import Hashable, Iterable, Mapping
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Literal, Protocol
+
+from chandragen.formatters.types import FormatterConfig
+from chandragen.peridot.parser import PREFORMAT_TOGGLE
+
+# deepest heading level gemtext has
+MAX_HEADING_LEVEL = 3
+
+# how a handler's results may be reused across substitutions and documents, see SubstitutionHandler
+CachePolicy = Literal["pure", "ttl", "never"]
+# where the engine may evaluate a handler's line and block substitutions, see SubstitutionHandler
+Concurrency = Literal["serial", "thread", "process"]
+
+
+class PeridotError(Exception):
+    """Raised by substitution handlers when a substitution can't be rendered, eg. a missing or invalid option."""
+
+
+@dataclass(frozen=True, slots=True)
+class Heading:
+    """A heading seen while rendering a document."""
+
+    level: int
+    text: str
+
+
+class PartialRenderer(Protocol):
+    """What handlers get to use of the engine rendering their document, see PeridotEngine.render_partial."""
+
+    def render_partial(self, path: Path, context: RenderContext) -> list[str]: ...
+
+
+@dataclass
+class RenderContext:
+    """
+    Per-document state shared by every substitution rendered into one document.
+
+    attributes:
+        config: the pipeline config of the document being rendered
+        now: the moment the render started. every handler sees the same time, so one document never mixes two.
+        counters: current value of every named counter in the document
+        headings: every heading rendered so far, in document order. deferred handlers see all of them.
+        in_preformat: whether the last line rendered was inside a preformatted block
+        dependencies: resolved path and sha256 of every partial the document included, partials included by partials too
+        include_stack: the partials currently being rendered, innermost last. empty while rendering the document itself.
+        engine: the engine rendering the document, set when rendering starts. handlers use it to render partials.
+        volatile: whether anything rendered so far was volatile, see SubstitutionHandler.is_volatile,
+            so rendering the same document again could give a different result, eg. a timestamp.
+    """
+
+    config: FormatterConfig = field(default_factory=FormatterConfig)
+    now: datetime = field(default_factory=lambda: datetime.now(UTC))
+    counters: dict[str, int] = field(default_factory=dict[str, int])
+    headings: list[Heading] = field(default_factory=list[Heading])
+    in_preformat: bool = False
+    dependencies: dict[str, str] = field(default_factory=dict[str, str])
+    include_stack: tuple[Path, ...] = ()
+    engine: PartialRenderer | None = field(default=None, repr=False, compare=False)
+    volatile: bool = False
+
+    def record_line(self, line: str) -> Heading | None:
+        """
+        Collects what deferred handlers need to know about a rendered line, the engine calls this for every line of the main pass.
+        Returns the heading the line adds, if any.
+        """
+        if line.startswith(PREFORMAT_TOGGLE):
+            self.in_preformat = not self.in_preformat
+            return None
+        heading = None if self.in_preformat else parse_heading(line)
+        if heading is not None:
+            self.headings.append(heading)
+        return heading
+
+
+def parse_heading(line: str) -> Heading | None:
+    """Parses a gemtext heading line, returns None for every other line."""
+    if not line.startswith("#"):
+        return None
+    text = line.lstrip("#")
+    level = len(line) - len(text)
+    text = text.strip()
+    if level > MAX_HEADING_LEVEL or not text:
+        return None
+    return Heading(level, text)
+
+
+class SubstitutionHandler(ABC):
+    """
+    Base class describing a Peridot substitution handler
+
+    Properties:
+        name: the name substitutions use to invoke the handler, eg. `<<name:(...)>>`
+        description: multi-line string that will be presented to the end user when they query the handler metadata.
+        version: class-level integer, bump it whenever a change to the handler changes its output.
+        deferred: class-level flag for handlers that need the whole document, eg. every heading for a table of contents.
+            deferred substitutions get a placeholder in the main pass, and are rendered in one final pass over the output
+            once the rest of the document has been rendered and its context is complete.
+        cache_policy: class-level setting for whether the engine may memoize the handler's output.
+            "pure" handlers always render the same output for the same options, body and cache_inputs, it's kept until evicted.
+            "ttl" handlers drift over time, eg. data pulled from elsewhere. their output is kept for cache_ttl seconds.
+            "never" handlers render every substitution, eg. ones that read or change per-document state like counters.
+        cache_ttl: class-level number of seconds a "ttl" handler's output stays cached
+        concurrency: class-level setting for how the engine may evaluate the handler's line and block substitutions.
+            "serial" handlers render in document order as the engine reaches them.
+            "thread" handlers are handed to a thread pool as soon as rendering starts, for handlers waiting on I/O.
+            "process" handlers go to a process pool, for CPU-bound handlers. the handler, options and context get pickled,
+                so the handler's module has to be importable by the pool's processes.
+            concurrent handlers get a snapshot of the context as it was when rendering started, so they can't use
+            per-document state like counters or headings. the dependencies they record are merged back once they finish.
+            "thread" handlers may render partials through context.engine, its caches are shared safely across threads,
+            and the partial's own substitutions render serially on the handler's thread.
+
+    Methods:
+        create: class method that generates the handler instance
+        is_deferred: whether a substitution with the given options waits for the final pass. defaults to `deferred`.
+        get_cache_policy: the cache policy for a substitution with the given options. defaults to `cache_policy`.
+        is_volatile: whether a substitution with the given options can render differently for the same document,
+            eg. a timestamp. formatter jobs re-render pages using one on every run instead of skipping them as unchanged.
+            defaults to any cache policy but "pure". handlers that only can't be cached because of per-document state,
+            or whose inputs are tracked as dependencies like partials, override it to return False.
+        cache_inputs: everything outside the options and body the output depends on, eg. config values. part of the cache key.
+        render_inline: renders an inline substitution `<<name:(options)>>`, returning the text to put in its place.
+        render_line: renders a line substitution `>>> name: (options)`, returning the lines to put in its place.
+            falls back to the inline rendering on a line of its own unless overridden.
+        render_block: renders a block substitution `>>{ name: (options)` ... `>>}`, getting the lines between the two as body.
+            raises PeridotError unless overridden, not every handler makes sense as a block.
+        render_line and render_block may return a lazy iterator to stream large output. serial substitutions that aren't
+        cached are written out as the iterator yields, so check options and open files before returning it.
+        a PeridotError raised partway through the iterator ends the substitution's output early.
+    """
+
+    version: int = 1
+    deferred: bool = False
+    cache_policy: CachePolicy = "never"
+    cache_ttl: float = 60.0
+    concurrency: Concurrency = "serial"
+
+    def __init__(self, name: str, description: str):
+        self.name: str = name
+        self.description: str = description
+
+    @classmethod
+    @abstractmethod
+    def create(cls) -> SubstitutionHandler:
+        pass
+
+    def is_deferred(self, options: Mapping[str, str]) -> bool:
+        return self.deferred
+
+    def get_cache_policy(self, options: Mapping[str, str]) -> CachePolicy:
+        return self.cache_policy
+
+    def is_volatile(self, options: Mapping[str, str]) -> bool:
+        return self.get_cache_policy(options) != "pure"
+
+    def cache_inputs(self, options: Mapping[str, str], context: RenderContext) -> Hashable:
+        return ()
+
+    @abstractmethod
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        pass
+
+    def render_line(self, options: Mapping[str, str], context: RenderContext) -> Iterable[str]:
+        return [f"{self.render_inline(options, context)}\n"]
+
+    def render_block(self, options: Mapping[str, str], body: list[str], context: RenderContext) -> Iterable[str]:
+        msg = f"{self.name} can't be used as a block substitution"
+        raise PeridotError(msg)
+
+
+def require_option(options: Mapping[str, str], name: str, handler: str) -> str:
+    """Returns an option, raising PeridotError if the substitution didn't set it."""
+    try:
+        return options[name]
+    except KeyError:
+        msg = f"{handler} substitution is missing the {name!r} option"
+        raise PeridotError(msg) from None
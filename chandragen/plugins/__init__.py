@@ -2,26 +2,70 @@ import importlib
 import importlib.util
 import pkgutil
 import sys
+from collections.abc import Generator
+from contextlib import contextmanager
 from pathlib import Path
+from types import ModuleType
+
+import chandragen
+
+# Plugins mounted into the container, usually read-only
+EXTERNAL_PLUGINS_PATH = Path("/plugins")
+
+
+def bundled_plugin_modules() -> list[str]:
+    """Names of the plugin modules shipped inside the chandragen.plugins package."""
+    current_module = sys.modules[__name__]
+    return [f"{__name__}.{modname}" for _, modname, ispkg in pkgutil.iter_modules(current_module.__path__) if not ispkg]
+
+
+def external_plugin_files() -> list[Path]:
+    """Source files of the plugins in the external plugins directory, if there is one."""
+    if not EXTERNAL_PLUGINS_PATH.exists():
+        return []
+    return sorted(path for path in EXTERNAL_PLUGINS_PATH.glob("*.py") if path.name != "__init__.py")
+
+
+@contextmanager
+def _bytecode_cache() -> Generator[None]:
+    """
+    Points bytecode caching at the cache directory while external plugins get imported.
+    The plugins directory is read-only in containers, so bytecode written next to the sources would never be cached,
+    and every process would recompile every plugin. A pycache prefix set through PYTHONPYCACHEPREFIX is left alone,
+    and so is the default when no system config is loaded, eg. when chandragen is used as a library.
+    """
+    previous = sys.pycache_prefix
+    config = chandragen.loaded_system_config()
+    if previous is None and config is not None:
+        sys.pycache_prefix = str(config.cache_dir.resolve() / "pycache")
+    try:
+        yield
+    finally:
+        sys.pycache_prefix = previous
+
+
+def import_external_plugin(plugin_file: Path) -> ModuleType:
+    """Imports a plugin from the external plugins directory, reusing the module if that file was already imported."""
+    module_name = plugin_file.stem
+    module = sys.modules.get(module_name)
+    if module is not None and getattr(module, "__file__", None) == str(plugin_file):
+        return module
+
+    if str(EXTERNAL_PLUGINS_PATH) not in sys.path:
+        sys.path.insert(0, str(EXTERNAL_PLUGINS_PATH))  # Add to importable path
+    spec = importlib.util.spec_from_file_location(module_name, plugin_file)
+    if spec is None or spec.loader is None:
+        msg = f"cannot import plugin {plugin_file}"
+        raise ImportError(msg)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    with _bytecode_cache():
+        spec.loader.exec_module(module)
+    return module
 
 
 def import_all_plugins():
-    current_package = __name__
-    current_module = sys.modules[current_package]
-
-    for _, modname, ispkg in pkgutil.iter_modules(current_module.__path__):
-        if not ispkg:
-            importlib.import_module(f"{current_package}.{modname}")
-    external_plugins_path = Path("/plugins")
-    if external_plugins_path.exists():
-        sys.path.insert(0, str(external_plugins_path))  # Add to importable path
-
-        for plugin_file in external_plugins_path.glob("*.py"):
-            if plugin_file.name == "__init__.py":
-                continue  # skip __init__.py
-            module_name = plugin_file.stem
-            spec = importlib.util.spec_from_file_location(module_name, plugin_file)
-            if spec and spec.loader:
-                module = importlib.util.module_from_spec(spec)
-                sys.modules[module_name] = module
-                spec.loader.exec_module(module)       
\ No newline at end of file
+    for module_name in bundled_plugin_modules():
+        importlib.import_module(module_name)
+    for plugin_file in external_plugin_files():
+        import_external_plugin(plugin_file)
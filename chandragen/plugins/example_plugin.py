@@ -1,3 +1,4 @@
+from chandragen.formatters.markers import DocumentEdit, DocumentMarker, DocumentView
 from chandragen.formatters.registry import (
     register_line_formatter,
     register_multiline_formatter,
@@ -8,7 +9,10 @@ from chandragen.formatters.types import (
     FormatterConfig,
     FormatterFlags,
     LineFormatter,
+    MarkerPreprocessor,
     MultilineFormatter,
+    Substitution,
+    SubstitutionFormatter,
 )
 
 
@@ -30,11 +34,21 @@ class ExampleLineFormattingPlugin(LineFormatter):
             ["None"],
         )
 
+    # set stateless to True if apply only depends on the line (and flags.in_preformat) and never changes the flags.
+    # it lets the pipeline batch lines across paragraph breaks.
+    stateless = True
+
     # Boilerplate method needed for the plugin class to load properly
     @classmethod
     def create(cls) -> LineFormatter:
         return cls()
 
+    # The prepare function is optional, and runs once whenever a pipeline using the formatter is compiled.
+    # apply is called for every single line of every document, so anything expensive to build
+    # (compiled regexes, lookup tables, etc) should be set up here and stored on the instance instead.
+    def prepare(self) -> None:
+        return
+
     # The apply function contains the formatting logic to run.
     # this can be *absolutely anything* so long as it takes a string representing a single line, and returns a string containing a single line.
     # All formatters MUST be designed under the assumption that the input data will be some mix of an input format and valid gemtext.
@@ -43,6 +57,38 @@ class ExampleLineFormattingPlugin(LineFormatter):
     def apply(self, line: str, flags: FormatterFlags) -> str:
         return line
 
+    # apply_many is optional. the pipeline hands it runs of consecutive plain lines (never preformatted or multiline blocks),
+    # and it must return exactly one line per line it was given. if it isn't overridden, apply gets called on each line instead.
+    # regex formatters can usually do a whole run in one pass, see transform_joined_lines in chandragen.formatters.utils
+    def apply_many(self, lines: list[str], flags: FormatterFlags) -> list[str]:
+        return lines
+
+
+# Formatters that only replace text can skip apply entirely, and declare the substitution instead.
+# the pipeline fuses adjacent literal substitutions into a single regex pass over each line, as long as their keys
+# and replacements can't overlap, so fusing them can never change the output.
+@register_line_formatter
+class ExampleSubstitutionPlugin(SubstitutionFormatter):
+    def __init__(self):
+        super().__init__(
+            "example_substitution_plugin",
+            """
+    Example plugin substitution formatter:
+    
+    This line-formatter replaces the word "ChandraGen" with "chandragen".
+    it's provided with chandragen to show an example of a declarative formatter
+            """,
+            ["None"],
+        )
+
+    # Substitution.literal takes a mapping of exact strings to replace, Substitution.regex takes a pattern and a replacement.
+    # patterns must only ever match within a single line.
+    substitution = Substitution.literal({"ChandraGen": "chandragen"})
+
+    @classmethod
+    def create(cls) -> LineFormatter:
+        return cls()
+
 
 @register_multiline_formatter
 class ExampleMultilineFormattingPlugin(MultilineFormatter):
@@ -66,6 +112,10 @@ class ExampleMultilineFormattingPlugin(MultilineFormatter):
     def create(cls) -> MultilineFormatter:
         return cls()
 
+    # Just like line formatters, multiline formatters and pre-processors can build their state once in prepare.
+    def prepare(self) -> None:
+        return
+
     # The apply function contains the formatting logic to run.
     # this can be *absolutely anything* so long as it takes a list of lines to format, and returns a list of formatted lines.
     # All formatters MUST be designed under the assumption that the input data will be some mix of an input format and valid gemtext.
@@ -107,3 +157,37 @@ class ExampleDocumentPreprocessingPlugin(DocumentPreprocessor):
     def apply(self, document: list[str], config: FormatterConfig):
         return document
 
+
+# Pre-processors that cut out or replace runs of lines around a marker line can describe their change instead of making it.
+# the pipeline runs adjacent marker pre-processors (strip_heading, strip_footing, convert_frontmatter...) as one stage,
+# planning every edit against a shared DocumentView so the document is only copied once no matter how many of them are enabled.
+@register_preprocessor
+class ExampleMarkerPlugin(MarkerPreprocessor):
+    def __init__(self):
+        super().__init__(
+            "example_marker_plugin",
+            """
+    Example plugin marker preprocessor:
+    
+    This preprocessor removes everything from a "<!-- draft -->" line to the end of the document.
+    it's provided with chandragen to show an example of a marker pre-processor
+        """,
+            ["None"],
+        )
+
+    # DocumentMarker.exact matches whole lines (line ending included), and is the fastest to search for.
+    # DocumentMarker.startswith and DocumentMarker.regex are available for anything fuzzier.
+    draft_marker = DocumentMarker.exact("<!-- draft -->\n")
+
+    @classmethod
+    def create(cls) -> DocumentPreprocessor:
+        return cls()
+
+    # plan_edit must only look at the document through the view, and must not change it.
+    # indexes are positions in the document as edited by earlier pre-processors.
+    # return None to leave the document alone, or a DocumentEdit replacing a range of lines and/or appending lines.
+    def plan_edit(self, view: DocumentView, config: FormatterConfig) -> DocumentEdit | None:
+        draft_start = view.find(self.draft_marker)
+        if draft_start is None:
+            return None
+        return DocumentEdit(draft_start, len(view))
@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import pytest
+
+from chandragen.peridot.datasources import read_rows
+from chandragen.peridot.handlers import Table
+from chandragen.peridot.types import RenderContext
+
+ROWS = "".join(f"row {index},{index * 2}\n" for index in range(50))
+
+
+def _open_handles(path: Path) -> int:
+    descriptors = Path("/proc/self/fd")
+    if not descriptors.is_dir():
+        pytest.skip("needs /proc to list open files")
+    count = 0
+    for descriptor in descriptors.iterdir():
+        try:
+            count += descriptor.readlink() == path
+        except OSError:
+            continue
+    return count
+
+
+@pytest.fixture
+def source(tmp_path: Path) -> Path:
+    path = tmp_path / "data.csv"
+    path.write_text(f"name,value\n{ROWS}")
+    return path
+
+
+def test_rows_that_are_never_read_hold_nothing_open(source: Path):
+    header, rows = read_rows(source, "csv")
+    assert header == ["name", "value"]
+    assert _open_handles(source) == 0
+    assert next(rows) == ["row 0", "0"]
+    assert _open_handles(source) == 1
+    rows.close()
+    assert _open_handles(source) == 0
+
+
+def test_jsonl_rows_match_the_csv_rows(source: Path, tmp_path: Path):
+    jsonl = tmp_path / "data.jsonl"
+    jsonl.write_text("".join(f'{{"name": "row {index}", "value": {index * 2}}}\n' for index in range(50)))
+    assert list(read_rows(jsonl, "jsonl")[1]) == list(read_rows(source, "csv")[1])
+
+
+@pytest.mark.parametrize("widths", ["sample", "scan"])
+def test_limited_tables_close_their_source(source: Path, widths: str):
+    table = Table()
+    lines = list(table.render_line({"source": str(source), "limit": "5", "widths": widths}, RenderContext()))
+    assert sum("row" in line for line in lines) == 5
+    assert _open_handles(source) == 0
+
+
+def test_abandoned_tables_close_their_source(source: Path):
+    lines = iter(Table().render_line({"source": str(source), "sample": "5"}, RenderContext()))
+    while "row 0" not in next(lines):
+        pass
+    assert _open_handles(source) == 1
+    lines.close()  # pyright: ignore[reportAttributeAccessIssue]
+    assert _open_handles(source) == 0
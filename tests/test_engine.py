@@ -0,0 +1,55 @@
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+
+from chandragen.peridot.engine import PeridotEngine
+from chandragen.peridot.types import PeridotError, RenderContext, SubstitutionHandler
+
+
+class ThreadedInclude(SubstitutionHandler):
+    concurrency = "thread"
+
+    def __init__(self):
+        super().__init__("threaded_include", "")
+
+    @classmethod
+    def create(cls) -> SubstitutionHandler:
+        return cls()
+
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        msg = "threaded_include can only be used as a line substitution"
+        raise PeridotError(msg)
+
+    def render_line(self, options: Mapping[str, str], context: RenderContext) -> Iterable[str]:
+        assert context.engine is not None
+        return context.engine.render_partial(Path(options["path"]), context)
+
+
+class Shout(SubstitutionHandler):
+    concurrency = "thread"
+
+    def __init__(self):
+        super().__init__("shout", "")
+
+    @classmethod
+    def create(cls) -> SubstitutionHandler:
+        return cls()
+
+    def render_inline(self, options: Mapping[str, str], context: RenderContext) -> str:
+        return options["text"].upper()
+
+
+def test_thread_handlers_render_partials_through_the_engine(tmp_path: Path):
+    partials = []
+    for index in range(8):
+        partial = tmp_path / f"partial_{index}.gmi"
+        partial.write_text(f"partial {index}\n>>> shout: (text: nested {index})\n")
+        partials.append(partial)
+    document = "".join(f">>> threaded_include: (path: {partials[index % 8]})\n" for index in range(64))
+    engine = PeridotEngine({"threaded_include": ThreadedInclude(), "shout": Shout()}, max_threads=4)
+
+    context = RenderContext()
+    rendered = engine.render_text(document, context)
+
+    assert rendered == "".join(f"partial {index % 8}\nNESTED {index % 8}\n" for index in range(64))
+    assert sorted(context.dependencies) == sorted(str(partial.resolve()) for partial in partials)
+    assert engine.partials.hits + engine.partials.misses == 64
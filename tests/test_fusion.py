@@ -0,0 +1,38 @@
+import pytest
+
+from chandragen.bench import FUSION_CASES, LiteralSubstitution, run_substitutions
+from chandragen.formatters.line_formatters import ConvertKnownMDXComponents
+from chandragen.formatters.pipeline import FusedSubstitution, compile_pipeline
+from chandragen.formatters.types import DispatchTable, FormatterFlags
+
+
+@pytest.mark.parametrize("name", list(FUSION_CASES))
+def test_fused_output_matches_sequential_output(name: str):
+    mappings, line = FUSION_CASES[name]
+    assert run_substitutions(mappings, line, fuse=True) == run_substitutions(mappings, line, fuse=False)
+
+
+def test_sequential_substitutions_see_each_others_output():
+    assert run_substitutions([{"bc": "XY"}, {"ab": "ZW"}], "abc", fuse=True) == ("aXY", "aXY")
+    assert run_substitutions([{"x": "ab"}, {"bc": "ZZ"}], "xc", fuse=True) == ("aZZ", "aZZ")
+
+
+def test_only_independent_literals_get_fused():
+    formatters = {
+        "names": LiteralSubstitution("names", {"ChandraGen": "chandragen"}),
+        "notes": LiteralSubstitution("notes", {"<Note>": "NOTE:"}),
+        "overlapping": LiteralSubstitution("overlapping", {"Note": "note"}),
+    }
+    plan = compile_pipeline(tuple(formatters), DispatchTable(line=formatters, multiline={}, preprocessor={}))
+    assert len(plan.line_formatters) == 2
+    fused = plan.line_formatters[0].__self__
+    assert isinstance(fused, FusedSubstitution)
+    assert fused.names == ("names", "notes")
+
+
+def test_mdx_components_are_replaced_one_after_the_other():
+    formatter = ConvertKnownMDXComponents()
+    formatter.prepare()
+    line = "<Warn</Note>ing> careful </Warning>"
+    assert formatter.apply(line, FormatterFlags()) == "WARNING: careful "
+    assert formatter.apply_many([line], FormatterFlags()) == ["WARNING: careful "]
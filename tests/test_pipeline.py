@@ -0,0 +1,36 @@
+from chandragen.formatters.pipeline import compile_pipeline
+from chandragen.formatters.types import DispatchTable, FormatterConfig, FormatterFlags, MultilineFormatter
+
+
+class StartsWith(MultilineFormatter):
+    def __init__(self, name: str, start_pattern: str):
+        super().__init__(name, "", ["text/markdown"], start_pattern, "^$")
+
+    @classmethod
+    def create(cls) -> MultilineFormatter:
+        return cls("starts_with", "^x")
+
+    def apply(self, buffer: list[str], config: FormatterConfig, flags: FormatterFlags) -> list[str]:
+        return buffer
+
+
+def _multiline_plan(*formatters: MultilineFormatter):
+    table = DispatchTable(line={}, multiline={formatter.name: formatter for formatter in formatters}, preprocessor={})
+    return compile_pipeline(tuple(formatter.name for formatter in formatters), table)
+
+
+def test_numbered_backreferences_stay_out_of_the_merged_start_pattern():
+    plan = _multiline_plan(StartsWith("plain", "^x"), StartsWith("doubled", r"^(b)\1"))
+    assert plan.multiline_unmerged == (1,)
+    matched = plan.match_multiline_start("bb\n")
+    assert matched is not None
+    assert matched.formatter.name == "doubled"
+    assert plan.match_multiline_start("b\n") is None
+
+
+def test_unmerged_start_patterns_keep_pipeline_order():
+    plan = _multiline_plan(StartsWith("doubled", r"^(c)\1"), StartsWith("any_c", "^c"))
+    for line, expected in (("cc\n", "doubled"), ("c\n", "any_c")):
+        matched = plan.match_multiline_start(line)
+        assert matched is not None
+        assert matched.formatter.name == expected
@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import pytest
+
+from chandragen.formatters import reader
+from chandragen.formatters.types import FormatterConfig
+
+DOCUMENTS = {
+    "plain": "# Title\n\nSome text.\n",
+    "no trailing newline": "first\nlast",
+    "line endings": "windows\r\nold mac\runix\n\r\n",
+    "multibyte": "mōōn ☾ orbit\n" * 40,
+    "long line": "x" * 300 + "\nshort\n",
+    "empty": "",
+}
+
+
+def _read(path: Path, mode: str) -> list[str]:
+    with reader.open_document(FormatterConfig(input_path=path, input_mode=mode)) as lines:
+        return list(lines)
+
+
+@pytest.mark.parametrize("name", list(DOCUMENTS))
+def test_mmap_input_matches_stream_input(name: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # small spans so the multi-span paths get exercised without a huge file
+    monkeypatch.setattr(reader, "MMAP_SPAN_BYTES", 16)
+    path = tmp_path / "document.md"
+    path.write_bytes(DOCUMENTS[name].encode())
+    assert _read(path, "mmap") == _read(path, "stream")
+
+
+def test_mmap_input_can_be_left_early(tmp_path: Path):
+    path = tmp_path / "document.md"
+    path.write_text("a\nb\nc\n")
+    with reader.open_document(FormatterConfig(input_path=path, input_mode="mmap")) as lines:
+        assert next(iter(lines)) == "a\n"
+
+
+def test_unknown_input_mode_is_rejected(tmp_path: Path):
+    path = tmp_path / "document.md"
+    path.write_text("a\n")
+    with pytest.raises(ValueError, match="unknown input mode"):
+        _read(path, "carrier pigeon")
@@ -0,0 +1,47 @@
+from collections.abc import Iterator
+
+import pytest
+
+from chandragen.bench import BENCH_PIPELINES, CorpusSpec, bench_config, generate_corpus
+from chandragen.formatters import DocumentFormatter, format_lines, format_text
+from chandragen.formatters.types import FormatterFlags
+from chandragen.peridot import engine as peridot_engine
+from chandragen.peridot.engine import PeridotEngine
+from chandragen.peridot.handlers import Counter, Slugify, TableOfContents
+from chandragen.peridot.types import RenderContext
+
+CORPUS = generate_corpus(CorpusSpec(documents=3, blocks_per_document=120, seed=7))
+
+
+def _one_at_a_time(document: list[str]) -> Iterator[str]:
+    yield from document
+
+
+@pytest.mark.parametrize("pipeline", list(BENCH_PIPELINES))
+def test_streamed_output_matches_buffered_output(pipeline: str):
+    config = bench_config(BENCH_PIPELINES[pipeline])
+    for document in CORPUS:
+        buffered = DocumentFormatter(config, FormatterFlags()).format_document(list(document))
+        streamed = list(format_lines(_one_at_a_time(document), config))
+        assert streamed == buffered
+        assert format_text("".join(document), config) == "".join(buffered)
+
+
+def test_long_peridot_documents_stream_like_short_ones(monkeypatch: pytest.MonkeyPatch):
+    document = ["# Contents\n", ">>> toc: (depth: 2)\n", "\n"]
+    for index in range(40):
+        document += [
+            "## Part <<counter:(name: part)>> of <<counter:(name: part, total: yes)>>\n",
+            f"anchor <<slugify:(text: Section {index} Title)>>\n",
+            "\n",
+        ]
+    handlers = {"counter": Counter(), "slugify": Slugify(), "toc": TableOfContents()}
+
+    buffered = PeridotEngine(handlers).render_text("".join(document), RenderContext())
+    # a small threshold sends the same document down the streaming path, with few nodes of lookahead
+    monkeypatch.setattr(peridot_engine, "CACHED_DOCUMENT_LINES", 16)
+    monkeypatch.setattr(peridot_engine, "STREAM_LOOKAHEAD_NODES", 2)
+    streamed = "".join(PeridotEngine(handlers).render_lines(_one_at_a_time(document), RenderContext()))
+
+    assert streamed == buffered
+    assert "Part 40 of 40" in streamed